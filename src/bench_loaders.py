@@ -0,0 +1,127 @@
+import pandas as pd
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from engine.loaders import (load_shelf_coords, load_shelf_cells, load_inventory,
+                            load_parameters, load_route_schedule,
+                            SHELF_MAP_PATH, INVENTORY_PATH, PARAMS_PATH, ROUTE_SCHEDULE_PATH)
+from step2_wave_generator import read_csv_robust
+
+# ==========================================
+# 載入器效能比對：舊版 iterrows vs engine/loaders 向量化版
+# 用法: cd src && python bench_loaders.py
+# ==========================================
+
+# ---------------- 舊版實作 (保留作為對照組) ----------------
+def legacy_shelf_coords(path, pos_order='rc', keep='last'):
+    df = pd.read_csv(path)
+    coords = {}
+    for _, r in df.iterrows():
+        sid = str(r['shelf_id'])
+        if keep == 'first' and sid in coords: continue
+        pos = (int(r['y']), int(r['x'])) if pos_order == 'rc' else (int(r['x']), int(r['y']))
+        coords[sid] = {'floor': r['floor'], 'pos': pos}
+    return coords
+
+def legacy_shelf_cells(path):
+    shelf_set = {'2F': set(), '3F': set()}
+    df = pd.read_csv(path)
+    for _, r in df.iterrows():
+        if 0 <= r['x'] < 61 and 0 <= r['y'] < 32:
+            shelf_set[r['floor']].add((int(r['x']), int(r['y'])))
+    return shelf_set
+
+def legacy_inventory(path):
+    inv = defaultdict(list)
+    df = pd.read_csv(path, dtype=str)
+    df.columns = [c.upper().strip() for c in df.columns]
+    part_col = next((c for c in df.columns if 'PART' in c), None)
+    cell_col = next((c for c in df.columns if 'CELL' in c or 'LOC' in c), None)
+    for _, r in df.iterrows():
+        if pd.notna(r[part_col]) and pd.notna(r[cell_col]):
+            inv[str(r[part_col]).strip()].append(str(r[cell_col]).strip())
+    return inv
+
+def legacy_parameters(path):
+    params = {}
+    df = pd.read_csv(path, encoding='utf-8-sig')
+    for _, row in df.iterrows():
+        name = str(row['parameter_name']).strip()
+        val_str = str(row['parameter_value']).strip()
+        dtype = str(row['data_type']).strip().lower()
+        if val_str.lower() == 'nan' or val_str == '': val = None
+        elif dtype in ['integer', 'int']:
+            try: val = int(float(val_str))
+            except: val = 0
+        elif dtype == 'float':
+            try: val = float(val_str)
+            except: val = 0.0
+        else: val = val_str
+        params[name] = val
+    return params
+
+def legacy_parse_time_str(time_str):
+    s = str(time_str).strip()
+    if not s or s.lower() == 'nan': return None
+    fmts = ["%H:%M:%S", "%H:%M"] if ':' in s else (["%H%M"] if s.isdigit() else [])
+    if not ':' in s: s = s.zfill(4)
+    for fmt in fmts:
+        try: return datetime.strptime(s, fmt).time()
+        except ValueError: continue
+    return None
+
+def legacy_route_schedule(path):
+    df = read_csv_robust(path, dtype={'ROUTECD': str, 'PARTCUSTID': str})
+    df['ROUTECD'] = df['ROUTECD'].str.strip()
+    df['PARTCUSTID'] = df['PARTCUSTID'].str.strip()
+    df.dropna(subset=['ROUTECD', 'PARTCUSTID', 'ORDERENDTIME'], inplace=True)
+    schedule_map = {}
+    for _, row in df.iterrows():
+        t = legacy_parse_time_str(row['ORDERENDTIME'])
+        if t: schedule_map.setdefault((row['ROUTECD'], row['PARTCUSTID']), []).append(t)
+    for k in schedule_map: schedule_map[k].sort()
+    return schedule_map
+
+# ---------------- 比對 ----------------
+def bench(name, old_fn, new_fn, repeat=3):
+    t0 = time.perf_counter()
+    old = old_fn()
+    t_old = time.perf_counter() - t0
+    t_new = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        new = new_fn()
+        t_new = min(t_new, time.perf_counter() - t0)
+    same = dict(old) == dict(new)
+    mark = "✅" if same else "❌"
+    print(f"{mark} {name:<16} 舊版 {t_old:7.3f}s | 新版 {t_new:7.3f}s | 加速 {t_old / max(t_new, 1e-9):6.1f}x | 筆數 {len(new)}")
+    return same
+
+def main():
+    print("🏁 [Bench] 資料載入器比對 (iterrows vs 向量化)")
+    cases = []
+    if os.path.exists(SHELF_MAP_PATH):
+        cases += [
+            ('shelf_coords(rc)', lambda: legacy_shelf_coords(SHELF_MAP_PATH, 'rc', 'last'),
+             lambda: load_shelf_coords(SHELF_MAP_PATH, 'rc', 'last')),
+            ('shelf_coords(xy)', lambda: legacy_shelf_coords(SHELF_MAP_PATH, 'xy', 'first'),
+             lambda: load_shelf_coords(SHELF_MAP_PATH, 'xy', 'first')),
+            ('shelf_cells', lambda: legacy_shelf_cells(SHELF_MAP_PATH),
+             lambda: load_shelf_cells(SHELF_MAP_PATH)),
+        ]
+    if os.path.exists(INVENTORY_PATH):
+        cases.append(('inventory', lambda: legacy_inventory(INVENTORY_PATH), lambda: load_inventory(INVENTORY_PATH)))
+    if os.path.exists(PARAMS_PATH):
+        cases.append(('parameters', lambda: legacy_parameters(PARAMS_PATH), lambda: load_parameters(PARAMS_PATH)))
+    if os.path.exists(ROUTE_SCHEDULE_PATH):
+        cases.append(('route_schedule', lambda: legacy_route_schedule(ROUTE_SCHEDULE_PATH),
+                      lambda: load_route_schedule(ROUTE_SCHEDULE_PATH)))
+
+    results = [bench(*c) for c in cases]
+    if all(results): print("🎉 所有載入器輸出與舊版一致")
+    else: print("⚠️ 有載入器輸出與舊版不一致，請檢查上方標記")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import time
+from collections import defaultdict
+
+from engine import ingest
+from engine.loaders import outbound_frame, inbound_frame
+from step4_preprocessor import Preprocessor, DATA_DIR, FILL_SEED, route_stations
+
+# ==========================================
+# 預處理併單效能比對：舊版 (逐列 iterrows + 每列一個 dict) vs 向量化 groupby
+# 以 wave_orders / historical_receiving 為一天的樣本，平移日期放大成 N 天
+# 舊版只跑前幾天 (太慢)，並逐筆比對兩者的任務輸出 (分站一律用 crc32，才能比較)
+# 用法: cd src && python bench_preprocessor.py [放大天數，預設 365]
+# ==========================================
+
+LEGACY_DAYS = 3
+
+
+# ---------------- 舊版實作 (保留作為對照組) ----------------
+def legacy_fill(p, tasks_raw):
+    part_shelf_map = {}
+    valid_shelves = list(p.shelf_coords.keys())
+    st_lists = p._station_lists()
+    draws = iter(np.random.default_rng(FILL_SEED).integers(max(len(valid_shelves), 1), size=len(tasks_raw)).tolist())
+    for t in tasks_raw:
+        part = str(t.get('PARTNO', '')).strip()
+        loc = str(t.get('LOC', '')).strip()
+        if len(loc) >= 5: part_shelf_map[part] = loc
+    for t in tasks_raw:
+        loc = str(t.get('LOC', '')).strip()
+        if len(loc) < 5:
+            part = str(t.get('PARTNO', '')).strip()
+            if part in part_shelf_map:
+                t['LOC'] = part_shelf_map[part]
+            elif part in p.inventory_map and p.inventory_map[part]:
+                cust = str(t.get('PARTCUSTID', 'UNK'))
+                t['LOC'] = p.inventory_index.choose(part, {f: route_stations([cust], sts)[0] for f, sts in st_lists.items() if sts})
+            elif valid_shelves:
+                t['LOC'] = f"{valid_shelves[next(draws)]}-A-01"
+
+
+def legacy_build(p, df_tasks):
+    final_queues = {'2F': [], '3F': []}
+    st_lists = p._station_lists()
+    for wave_id, wave_df in df_tasks.groupby('WAVE_ID'):
+        for floor in ['2F', '3F']:
+            f_df = wave_df[wave_df['LOC'].str.startswith(floor[0], na=False)].copy()
+            if f_df.empty or not st_lists[floor]: continue
+            shelf_tasks = defaultdict(list)
+            for i, row in f_df.iterrows():
+                loc = str(row['LOC'])
+                shelf_id = loc[:9] if len(loc) >= 9 else loc
+                cust_id = str(row.get('PARTCUSTID', 'UNK'))
+                shelf_tasks[shelf_id].append({'station': route_stations([cust_id], st_lists[floor])[0], 'row': row})
+            for sid, items in shelf_tasks.items():
+                final_queues[floor].append({
+                    'task_id': f"{wave_id}_{sid}", 'type': 'ORDER', 'shelf_id': sid, 'wave_id': wave_id, 'priority': 10,
+                    'stops': [{'station': items[0]['station'], 'time': 15 + (len(items) * 5)}],
+                    'datetime': min([x['row']['datetime'] for x in items]),
+                    'item_rows': [x['row'].name for x in items]
+                })
+    return final_queues
+
+
+# ---------------- 放大資料 ----------------
+def load_day():
+    frames = []
+    for name, fn, conv in [('wave_orders', 'wave_orders.csv', outbound_frame),
+                           ('receiving', 'historical_receiving_ex.csv', inbound_frame)]:
+        try: frames.append(conv(ingest.load_table(name, os.path.join(DATA_DIR, 'transaction', fn))))
+        except FileNotFoundError: pass
+    return pd.concat(frames, ignore_index=True)
+
+
+def tile_days(day, n_days):
+    parts = []
+    for d in range(n_days):
+        shift = pd.Timedelta(days=d)
+        parts.append(day.assign(datetime=day['datetime'] + shift, WAVE_ID=day['WAVE_ID'].astype(str) + f"_D{d:03d}"))
+    df = pd.concat(parts, ignore_index=True)
+    return df.sort_values('datetime', kind='stable').reset_index(drop=True)
+
+
+def run_vectorized(p, df):
+    df = df.copy()
+    p._fill_locations(df)
+    return p._build_queues(df)
+
+
+def run_legacy(p, df):
+    tasks_raw = df.to_dict('records')
+    legacy_fill(p, tasks_raw)
+    return legacy_build(p, pd.DataFrame(tasks_raw))
+
+
+def main(n_days=365):
+    p = Preprocessor()
+    day = load_day()
+
+    small = tile_days(day, LEGACY_DAYS)
+    t0 = time.time(); old = run_legacy(p, small); t_old = time.time() - t0
+    t0 = time.time(); new = run_vectorized(p, small); t_new = time.time() - t0
+    same = all(a == b for f in old for a, b in zip(old[f], new[f])) and all(len(old[f]) == len(new[f]) for f in old)
+    print(f"🧪 {LEGACY_DAYS} 天 ({len(small)} 筆): 舊版 {t_old:.2f}s | 向量化 {t_new:.2f}s | 輸出一致: {same}")
+
+    big = tile_days(day, n_days)
+    t0 = time.time(); queues = run_vectorized(p, big); t_big = time.time() - t0
+    n_tasks = sum(len(q) for q in queues.values())
+    print(f"🏁 {n_days} 天 ({len(big)} 筆): 向量化 {t_big:.2f}s -> {n_tasks} 任務 "
+          f"(舊版推估 {t_old / LEGACY_DAYS * n_days:.0f}s)")
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
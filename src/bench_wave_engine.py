@@ -0,0 +1,82 @@
+import pandas as pd
+import numpy as np
+import os
+import time
+from datetime import datetime, timedelta
+
+from engine.loaders import load_route_schedule, load_route_schedule_frame
+from logic.wave_engine import CutoffTable, assign_waves
+from step2_wave_generator import read_csv_robust, DATA_TRANSACTION_DIR, HISTORICAL_ORDERS_FILE
+
+# ==========================================
+# 波次指派效能比對：舊版逐筆 assign_wave vs logic/wave_engine
+# 用法: cd src && python bench_wave_engine.py [放大天數，預設 365]
+# ==========================================
+
+# ---------------- 舊版實作 (保留作為對照組) ----------------
+def legacy_assign_wave(order_datetime, schedule_times):
+    order_time = order_datetime.time()
+    for cutoff_time in schedule_times:
+        if order_time <= cutoff_time:
+            return datetime.combine(order_datetime.date(), cutoff_time), False
+    next_day = order_datetime.date() + timedelta(days=1)
+    return datetime.combine(next_day, schedule_times[0]), True
+
+def legacy_assign_all(df_orders, schedule_map):
+    wave_ids, stamps, rolls = [], [], []
+    for _, row in df_orders.iterrows():
+        key = (row['ROUTECD'], row['PARTCUSTID'])
+        if key in schedule_map:
+            target_dt, is_next_day = legacy_assign_wave(row['datetime'], schedule_map[key])
+            wave_ids.append(f"W_{target_dt.strftime('%Y%m%d_%H%M')}")
+            stamps.append(target_dt)
+            rolls.append(1 if is_next_day else 0)
+        else:
+            def_dt = datetime.combine(row['datetime'].date(), datetime.strptime("23:59", "%H:%M").time())
+            wave_ids.append(f"W_{def_dt.strftime('%Y%m%d')}_DEFAULT")
+            stamps.append(def_dt)
+            rolls.append(0)
+    return wave_ids, pd.to_datetime(pd.Series(stamps)).to_numpy(), np.array(rolls)
+
+def load_orders(days):
+    df = read_csv_robust(os.path.join(DATA_TRANSACTION_DIR, HISTORICAL_ORDERS_FILE), dtype=str)
+    df.columns = [c.replace('﻿', '') for c in df.columns]
+    df = df.dropna(subset=['ROUTECD', 'PARTCUSTID', 'DATE', 'TIME'])
+    df['ROUTECD'] = df['ROUTECD'].str.strip()
+    df['PARTCUSTID'] = df['PARTCUSTID'].str.strip()
+    df['datetime'] = pd.to_datetime(df['DATE'] + ' ' + df['TIME'], errors='coerce')
+    df = df.dropna(subset=['datetime'])
+    # 以日期平移複製訂單，模擬長期 (例如一整年) 的歷史量
+    span = (df['datetime'].dt.normalize().max() - df['datetime'].dt.normalize().min()).days + 1
+    reps = max(1, -(-days // span))
+    parts = [df.assign(datetime=df['datetime'] + pd.Timedelta(days=i * span)) for i in range(reps)]
+    return pd.concat(parts, ignore_index=True)
+
+def main(days=365):
+    print(f"🏁 [Bench] 波次指派比對 (約 {days} 天訂單量)")
+    schedule_map = load_route_schedule()
+    table = CutoffTable(load_route_schedule_frame())
+    df = load_orders(days)
+    print(f"   -> 訂單筆數: {len(df)}")
+
+    t0 = time.perf_counter()
+    codes = table.lookup(df['ROUTECD'].to_numpy(), df['PARTCUSTID'].to_numpy())
+    new_ids, new_dl, new_roll, _ = assign_waves(df['datetime'], codes, table)
+    t_new = time.perf_counter() - t0
+    print(f"   -> 新版 (向量化): {t_new:.3f}s")
+
+    # 舊版太慢，只取樣本比對並以樣本速度外推
+    sample = df.sample(n=min(len(df), 50000), random_state=0).sort_index()
+    t0 = time.perf_counter()
+    old_ids, old_dl, old_roll = legacy_assign_all(sample, schedule_map)
+    t_old = (time.perf_counter() - t0) * len(df) / len(sample)
+    print(f"   -> 舊版 (逐筆, 外推): {t_old:.3f}s | 加速 {t_old / max(t_new, 1e-9):.1f}x")
+
+    pos = df.index.get_indexer(sample.index)
+    same = (list(new_ids[pos]) == old_ids and np.array_equal(new_dl[pos], old_dl)
+            and np.array_equal(new_roll[pos], old_roll))
+    print("🎉 樣本結果與舊版一致" if same else "❌ 樣本結果與舊版不一致")
+
+if __name__ == "__main__":
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 365)
@@ -0,0 +1,42 @@
+import os
+import argparse
+
+from engine.audit import run_audit, print_report, save_report, load_state, save_state, CHECK_REGISTRY, CHUNK_BYTES
+
+# 單趟稽核：碰撞 / 撞牆 / 瞬移 / 超速 / 料架重複佔用 / 卡車 / 資料格式，一次讀檔產出合併報告
+# (取代分別執行 debug_overlap_check、debug_check_teleport、debug_ultimate_audit、debug_physics_audit ...)
+# --incremental：以 logs/audit_state.json 記錄已稽核的位置，事件檔續寫 / 模擬接續後只稽核新增的事件
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOG_DIR = os.path.join(BASE_DIR, 'logs')
+REPORT_PATH = os.path.join(LOG_DIR, 'audit_report.json')
+STATE_PATH = os.path.join(LOG_DIR, 'audit_state.json')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='simulation_events.csv 單趟稽核')
+    parser.add_argument('--events', default=os.path.join(LOG_DIR, 'simulation_events.csv'))
+    parser.add_argument('--checks', default=','.join(CHECK_REGISTRY), help=f"逗號分隔 (可用: {','.join(CHECK_REGISTRY)})")
+    parser.add_argument('--workers', type=int, default=max(1, min(8, (os.cpu_count() or 2) - 1)))
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / (1 << 20))
+    parser.add_argument('--out', default=REPORT_PATH)
+    parser.add_argument('--incremental', action='store_true', help='只稽核上次之後新增的事件 (狀態檔 --state)')
+    parser.add_argument('--state', default=STATE_PATH)
+    parser.add_argument('--reset', action='store_true', help='忽略既有狀態檔，從頭稽核')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.events):
+        print(f"❌ 找不到事件檔: {args.events}")
+    else:
+        state = None
+        if args.incremental:
+            state = {} if args.reset else load_state(args.state, args.events)
+            print(f"🔁 增量稽核: 從位元組 {state.get('offset', 0):,} 接續" if state else "🔁 增量稽核: 從頭開始")
+        print(f"🕵️‍♂️ [單趟稽核] {args.events} (workers={args.workers})")
+        report = run_audit(args.events, checks=[c for c in args.checks.split(',') if c], workers=args.workers,
+                           chunk_bytes=int(args.chunk_mb * (1 << 20)), state=state)
+        print_report(report)
+        save_report(report, args.out)
+        print(f"\n📝 報告: {args.out}")
+        if args.incremental:
+            save_state(report['_state'], args.state)
+            print(f"💾 狀態: {args.state}")
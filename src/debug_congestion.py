@@ -3,6 +3,8 @@ import numpy as np
 import os
 from collections import Counter
 
+from engine.traffic_heatmap import load_heatmap, hotspots, HEATMAP_FILE
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 DATA_MAP_DIR = os.path.join(BASE_DIR, 'data', 'master')
@@ -18,9 +20,33 @@ def load_map_shape(filename):
         except: pass
     return (0,0)
 
+def report_heatmap_hotspots(top=5):
+    """模擬中累計的交通熱區 (不需重讀事件檔)；檔案不存在時回傳 False"""
+    path = os.path.join(LOG_DIR, HEATMAP_FILE)
+    if not os.path.exists(path): return False
+    meta, counts = load_heatmap(path)
+    n_buckets = counts['visit'].shape[1]
+    print(f"   🔥 [交通熱區] {n_buckets} 個時間桶 x {meta['bucket_sec']}s")
+    for label, kinds in [('通行+等待', ('visit', 'wait')), ('原地等待', ('wait',)), ('預約鎖定秒數', ('lock',))]:
+        print(f"\n   📍 [Top {top} {label}]")
+        for floor, x, y, count in hotspots(counts, meta, kinds=kinds, top=top):
+            print(f"      {floor} ({x}, {y}) - {count}")
+    # 最塞的時段：等待步數最多的時間桶
+    per_bucket = counts['wait'].sum(axis=(0, 2, 3))
+    if per_bucket.any():
+        b = int(per_bucket.argmax())
+        start = f"+{b * meta['bucket_sec']}s"
+        if meta.get('base_time') is not None:
+            start = pd.Timestamp(meta['base_time'] + b * meta['bucket_sec'], unit='s').strftime('%Y-%m-%d %H:%M')
+        print(f"\n   ⏱️ 等待最多的時段: {start} ({int(per_bucket[b])} 次)")
+    return True
+
 def analyze_congestion():
     print("🔍 [塞車與路障分析] 啟動...")
     
+    if report_heatmap_hotspots():
+        print()
+    
     evt_path = os.path.join(LOG_DIR, 'simulation_events.csv')
     if not os.path.exists(evt_path):
         print("❌ 找不到事件檔")
@@ -0,0 +1,224 @@
+import numpy as np
+from collections import OrderedDict, deque
+
+# ==========================================
+# AGV 空間索引 (每樓層一個)
+# 取代「每次派車都掃全部 AGV 算曼哈頓距離」：
+#   以 BUCKET x BUCKET 的格桶存放 AGV，依狀態 (idle / busy / loaded / parked) 分開
+#   update()  位置或狀態提交時呼叫，O(1)
+#   nearest() 由目標所在的桶向外一圈一圈找，找到 k 台且下一圈不可能更近即停止
+#   metric='bfs' 以地圖實際步數 (繞牆) 排序，曼哈頓距離當下界提早結束
+#   occupant() / at  pos -> AGV 的即時佔用表，「這格有沒有車」O(1)，不必掃整個 agv_pool
+#   add_density()    掛上 DensityGrid，AGV 每次換格時加減 kernel，得到隨時可用的擁擠度地圖
+# 座標慣例同 runner：pos = (row, col)
+# ==========================================
+
+STATUSES = ('idle', 'busy', 'loaded', 'parked')
+IDLE_STATUSES = ('idle', 'parked') # 可接新任務
+BUCKET = 4
+BFS_CACHE = 256 # 保留最近幾個目標點的 BFS 距離圖
+UNREACHABLE = np.iinfo(np.int32).max
+
+
+def box_kernel(radius, weight=1.0):
+    """(2r+1)^2 方框，每格 weight (等同以每台 AGV 為中心的 5x5 Counter 熱區)"""
+    return np.full((2 * radius + 1, 2 * radius + 1), float(weight))
+
+
+def manhattan_kernel(radius, fn):
+    """曼哈頓距離 d <= radius 的菱形，每格 fn(d)"""
+    d = np.abs(np.arange(-radius, radius + 1))
+    d = d[:, None] + d[None, :]
+    return np.where(d <= radius, fn(d), 0.0).astype(float)
+
+
+def bfs_distance_map(grid, target):
+    """目標點出發的 BFS 步數圖 (int32，只走非牆格，不可達 = UNREACHABLE)"""
+    grid = np.asarray(grid)
+    rows, cols = grid.shape[:2]
+    target = (int(target[0]), int(target[1]))
+    dist = np.full((rows, cols), UNREACHABLE, dtype=np.int32)
+    if 0 <= target[0] < rows and 0 <= target[1] < cols:
+        free = (grid != -1).tolist()
+        flat = dist.reshape(-1)
+        flat[target[0] * cols + target[1]] = 0
+        q = deque([target])
+        while q:
+            r, c = q.popleft()
+            d = int(flat[r * cols + c]) + 1
+            for nr, nc in ((r + 1, c), (r - 1, c), (r, c + 1), (r, c - 1)):
+                if 0 <= nr < rows and 0 <= nc < cols and free[nr][nc] and flat[nr * cols + nc] == UNREACHABLE:
+                    flat[nr * cols + nc] = d
+                    q.append((nr, nc))
+    return dist
+
+
+def bucket_ring(br, bc, r):
+    """與 (br, bc) 的 Chebyshev 桶距離 = r 的所有桶 (格桶由內向外搜尋用)"""
+    if r == 0:
+        yield br, bc; return
+    for c in range(bc - r, bc + r + 1):
+        yield br - r, c; yield br + r, c
+    for rr in range(br - r + 1, br + r):
+        yield rr, bc - r; yield rr, bc + r
+
+
+class DensityGrid:
+    """AGV 擁擠度地圖：grid[r, c] = sum(kernel 中心對準每台 AGV)，換格時 O(kernel) 增量更新"""
+    def __init__(self, shape, kernel):
+        self.kernel = np.asarray(kernel, dtype=float)
+        self.kr, self.kc = self.kernel.shape[0] // 2, self.kernel.shape[1] // 2
+        self.grid = np.zeros(shape, dtype=float)
+
+    def add(self, pos, sign=1):
+        rows, cols = self.grid.shape
+        r, c = int(pos[0]), int(pos[1])
+        r0, r1 = max(r - self.kr, 0), min(r + self.kr + 1, rows)
+        c0, c1 = max(c - self.kc, 0), min(c + self.kc + 1, cols)
+        if r0 >= r1 or c0 >= c1: return
+        k = self.kernel[r0 - (r - self.kr):r1 - (r - self.kr), c0 - (c - self.kc):c1 - (c - self.kc)]
+        if sign > 0: self.grid[r0:r1, c0:c1] += k
+        else: self.grid[r0:r1, c0:c1] -= k
+
+
+class AgvSpatialIndex:
+    def __init__(self, grid, bucket=BUCKET, bfs_cache=BFS_CACHE):
+        """grid: 2D 地圖 (-1 = 牆)，BFS 距離只走非牆格"""
+        self.grid = np.asarray(grid)
+        self.rows, self.cols = self.grid.shape[:2]
+        self.bucket = bucket
+        self.n_br = (self.rows + bucket - 1) // bucket
+        self.n_bc = (self.cols + bucket - 1) // bucket
+        self.cells = {s: {} for s in STATUSES} # status -> {(br, bc): {agv: None}}
+        self.pos = {}
+        self.status = {}
+        self.at = {} # pos -> {agv: None} (同格多車時依提交順序)
+        self.seq = {} # 登錄順序，同距離時依此決定 (與掃 agv_pool 的結果一致)
+        self.bfs_cache = bfs_cache
+        self._bfs = OrderedDict()
+        self.densities = []
+
+    def add_density(self, kernel):
+        """掛上一張 DensityGrid (以目前所有 AGV 初始化)，之後隨 update() 同步"""
+        dens = DensityGrid((self.rows, self.cols), kernel)
+        for p in self.pos.values(): dens.add(p)
+        self.densities.append(dens)
+        return dens
+
+    @classmethod
+    def from_pool(cls, grid, agv_pool, status='idle', **kw):
+        """由 runner 的 agv_state[floor] ({agv: {'pos': ...}}) 建立"""
+        idx = cls(grid, **kw)
+        for aid, s in agv_pool.items(): idx.update(aid, s['pos'], status)
+        return idx
+
+    def _key(self, pos):
+        return (int(pos[0]) // self.bucket, int(pos[1]) // self.bucket)
+
+    def update(self, agv_id, pos=None, status=None):
+        """位置 / 狀態提交 (None = 不變)"""
+        old_pos = self.pos.get(agv_id); old_st = self.status.get(agv_id)
+        if agv_id not in self.seq: self.seq[agv_id] = len(self.seq)
+        new_pos = tuple(pos) if pos is not None else old_pos
+        new_st = status or old_st or 'idle'
+        if new_st not in self.cells: raise ValueError(f"未知的 AGV 狀態: {new_st}")
+        if new_pos is None: raise ValueError(f"AGV {agv_id} 尚無位置")
+        if old_pos != new_pos:
+            if old_pos is not None: self._leave(agv_id, old_pos)
+            self.at.setdefault(new_pos, {})[agv_id] = None
+            for dens in self.densities:
+                if old_pos is not None: dens.add(old_pos, -1)
+                dens.add(new_pos)
+        if old_pos is not None:
+            k_old = self._key(old_pos); k_new = self._key(new_pos)
+            if k_old == k_new and old_st == new_st:
+                self.pos[agv_id] = new_pos
+                return
+            bucket = self.cells[old_st][k_old]
+            del bucket[agv_id]
+            if not bucket: del self.cells[old_st][k_old]
+        self.cells[new_st].setdefault(self._key(new_pos), {})[agv_id] = None
+        self.pos[agv_id] = new_pos; self.status[agv_id] = new_st
+
+    def _leave(self, agv_id, pos):
+        cell = self.at[pos]
+        del cell[agv_id]
+        if not cell: del self.at[pos]
+
+    def occupant(self, pos, exclude=None):
+        """pos 上的 AGV (排除 exclude)，沒有則 None"""
+        cell = self.at.get(pos)
+        if not cell: return None
+        for aid in cell:
+            if aid != exclude: return aid
+        return None
+
+    def is_occupied(self, pos, exclude=None):
+        return self.occupant(pos, exclude) is not None
+
+    def set_status(self, agv_id, status):
+        self.update(agv_id, None, status)
+
+    def remove(self, agv_id):
+        if agv_id not in self.pos: return
+        bucket = self.cells[self.status[agv_id]][self._key(self.pos[agv_id])]
+        del bucket[agv_id]
+        if not bucket: del self.cells[self.status[agv_id]][self._key(self.pos[agv_id])]
+        self._leave(agv_id, self.pos[agv_id])
+        for dens in self.densities: dens.add(self.pos[agv_id], -1)
+        del self.pos[agv_id]; del self.status[agv_id]
+
+    def count(self, status=None):
+        if status is None: return len(self.pos)
+        sts = (status,) if isinstance(status, str) else status
+        return sum(len(b) for s in sts for b in self.cells[s].values())
+
+    def distance_map(self, target):
+        """目標點出發的 BFS 步數圖 (int32，不可達 = UNREACHABLE)，LRU 快取"""
+        target = (int(target[0]), int(target[1]))
+        dist = self._bfs.get(target)
+        if dist is not None:
+            self._bfs.move_to_end(target)
+            return dist
+        dist = bfs_distance_map(self.grid, target)
+        self._bfs[target] = dist
+        if len(self._bfs) > self.bfs_cache: self._bfs.popitem(last=False)
+        return dist
+
+    def nearest(self, target, k=1, status=IDLE_STATUSES, exclude=(), metric='manhattan'):
+        """
+        回傳最近的 k 台 [(距離, agv_id), ...] (由近到遠)
+        status: 單一狀態或狀態序列；metric: 'manhattan' / 'bfs' (BFS 不可達者排除)
+        """
+        sts = (status,) if isinstance(status, str) else tuple(status)
+        tables = [self.cells[s] for s in sts]
+        if not any(tables) or k <= 0: return []
+        tr, tc = int(target[0]), int(target[1])
+        dmap = self.distance_map(target) if metric == 'bfs' else None
+        br, bc = tr // self.bucket, tc // self.bucket
+        max_r = max(br, bc, self.n_br - 1 - br, self.n_bc - 1 - bc)
+        found = []
+        for r in range(max_r + 1):
+            for key in bucket_ring(br, bc, r):
+                for tab in tables:
+                    bucket = tab.get(key)
+                    if not bucket: continue
+                    for aid in bucket:
+                        if aid in exclude: continue
+                        p = self.pos[aid]
+                        if dmap is None:
+                            d = abs(p[0] - tr) + abs(p[1] - tc)
+                        else:
+                            d = int(dmap[p[0], p[1]]) if 0 <= p[0] < self.rows and 0 <= p[1] < self.cols else UNREACHABLE
+                            if d == UNREACHABLE: continue
+                        found.append((d, self.seq[aid], aid))
+            # 下一圈的 AGV 曼哈頓距離至少 r*bucket+1 (BFS 步數 >= 曼哈頓)
+            if len(found) >= k:
+                found.sort(key=lambda x: (x[0], x[1]))
+                if found[k - 1][0] <= r * self.bucket: break
+        found.sort(key=lambda x: (x[0], x[1]))
+        return [(d, aid) for d, _, aid in found[:k]]
+
+    def nearest_one(self, target, status=IDLE_STATUSES, exclude=(), metric='manhattan'):
+        res = self.nearest(target, 1, status, exclude, metric)
+        return res[0][1] if res else None
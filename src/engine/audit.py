@@ -0,0 +1,668 @@
+import pandas as pd
+import numpy as np
+import os
+import io
+import json
+import time
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from engine.event_store import normalize_obj_id, SHELF_REMOVE_TYPES, SHELF_ADD_TYPES
+from engine.loaders import load_map_grid, load_shelf_cells
+from engine.collisions import CollisionDetector, expand_segments, pack_key, WINDOW_SEC
+
+# ==========================================
+# 單趟、可插拔的事件稽核引擎 (simulation_events.csv)
+# 取代各 debug_* 腳本各自整份讀檔 + iterrows：
+#   1. 依位元組切成以換行對齊的 chunk，worker process 各自讀取並解碼成共用欄位陣列 (batch)
+#   2. 每個已註冊的 check 在 worker 內以 map(batch, ctx) 做 chunk 內的向量化檢查
+#   3. 主程序依檔案順序 reduce(partial)，處理跨 chunk 的狀態 (上一個位置、料架佔用、等待區段…)
+#   4. report() 匯總成一份報告 (logs/audit_report.json)
+#   5. (可選) 增量稽核：狀態檔記錄已處理的位元組位置與各 check 的跨 chunk 狀態，
+#      事件檔續寫後只處理新增的完整行 (run_audit(state=...) / load_state / save_state)
+# 座標慣例同事件檔：x = 欄 (col)，y = 列 (row)，地圖以 grid[y, x] 取值
+# ==========================================
+
+EVENT_HEADER = ['start_time', 'end_time', 'floor', 'obj_id', 'sx', 'sy', 'ex', 'ey', 'type', 'text']
+FLOORS = ('2F', '3F')
+TYPES = ('AGV_MOVE', 'YIELD', 'PICKING', 'PARKING', 'SHELF_LOAD', 'SHELF_UNLOAD', 'SHUFFLE_LOAD', 'SHUFFLE_UNLOAD',
+         'FORCE_TELE', 'STATION_STATUS')
+T = {name: i for i, name in enumerate(TYPES)}
+GRID_SHAPE = (32, 61)
+
+CHUNK_BYTES = 16 << 20
+STATE_VERSION = 1
+HEAD_BYTES = 4096 # 以檔頭位元組雜湊判斷事件檔是否被重寫 (而非續寫)
+SAMPLE_LIMIT = 10
+MAX_SPEED = 1.5 # 格/秒，超過視為超速
+STUCK_SEC = 300 # 連續原地等待超過此秒數視為卡住
+# AGV 佔據格子的事件 (PARKING = 隱藏，不佔位)
+OCCUPY_TYPES = ('AGV_MOVE', 'YIELD', 'PICKING', 'SHELF_LOAD', 'SHELF_UNLOAD', 'SHUFFLE_LOAD', 'SHUFFLE_UNLOAD')
+# 位置連續性 (瞬移) 檢查所用的事件
+TRACK_TYPES = OCCUPY_TYPES + ('PARKING',)
+
+CHECK_REGISTRY = {}
+
+
+def register_check(cls):
+    CHECK_REGISTRY[cls.name] = cls
+    return cls
+
+
+# ---------------- 讀檔與解碼 ----------------
+
+def complete_size(path, block=1 << 16):
+    """最後一個換行之後的位元組數不算 (寫入中的半行留給下次增量稽核)"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        pos = size
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            k = f.read(pos - start).rfind(b'\n')
+            if k >= 0: return start + k + 1
+            pos = start
+    return 0
+
+
+def plan_chunks(path, chunk_bytes=CHUNK_BYTES, start=None, end=None):
+    """檔案 -> [(byte_start, byte_end), ...]，每段以換行對齊 (start 為 None 時跳過表頭；end 預設為檔尾)"""
+    size = os.path.getsize(path) if end is None else end
+    with open(path, 'rb') as f:
+        if start is None:
+            f.readline()
+            start = f.tell()
+        bounds = []
+        pos = start
+        while pos < size:
+            f.seek(min(pos + chunk_bytes, size))
+            if f.tell() < size: f.readline()
+            end = f.tell()
+            bounds.append((pos, end))
+            pos = end
+    return bounds
+
+
+def read_batch(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        buf = f.read(end - start)
+    df = pd.read_csv(io.BytesIO(buf), header=None, names=EVENT_HEADER, dtype={'floor': str, 'obj_id': str, 'type': str, 'text': str},
+                     on_bad_lines='skip')
+    return decode_batch(df, start)
+
+
+def _epoch(col):
+    ts = pd.to_datetime(col, errors='coerce', format='ISO8601')
+    return np.where(ts.isna().to_numpy(), -1, ts.astype('datetime64[s]').astype('int64').to_numpy())
+
+
+def decode_batch(df, offset=0):
+    """事件 DataFrame -> 共用欄位陣列 (各 check 只讀不改)"""
+    obj = df['obj_id'].fillna('').astype(str)
+    uniq = pd.unique(obj)
+    norm = {u: normalize_obj_id(u) for u in uniq}
+    agv_num = {u: int(n[4:]) if n.startswith('AGV_') and n[4:].isdigit() else -1 for u, n in norm.items()}
+    coords = {c: pd.to_numeric(df[c], errors='coerce').fillna(-1).to_numpy(np.int64) for c in ['sx', 'sy', 'ex', 'ey']}
+    return dict(
+        offset=offset,
+        n=len(df),
+        t0=_epoch(df['start_time']),
+        t1=_epoch(df['end_time']),
+        floor=pd.Categorical(df['floor'], categories=FLOORS).codes.astype(np.int8),
+        obj=obj.map(norm).to_numpy(object),
+        agv=obj.map(agv_num).to_numpy(np.int64),
+        type=pd.Categorical(df['type'], categories=TYPES).codes.astype(np.int8),
+        text=df['text'].fillna('').astype(str).to_numpy(object),
+        **coords,
+    )
+
+
+def _types_mask(batch, names):
+    return np.isin(batch['type'], [T[n] for n in names])
+
+
+def _agv_order(batch, mask):
+    """符合條件的 AGV 列 -> 依 (AGV, 檔案順序) 排序的列索引"""
+    idx = np.nonzero(mask & (batch['agv'] >= 0) & (batch['t0'] >= 0) & (batch['t1'] >= 0))[0]
+    return idx[np.argsort(batch['agv'][idx], kind='stable')]
+
+
+def _same_as_prev(a):
+    out = np.zeros(len(a), dtype=bool)
+    out[1:] = a[1:] == a[:-1]
+    return out
+
+
+def _fmt_t(t):
+    return str(pd.to_datetime(int(t), unit='s')) if t >= 0 else 'NaT'
+
+
+def build_context(grids=None, initial_shelves=None):
+    """各 check 共用的靜態資料：地圖 {floor: grid} 與初始料架 {floor: {(x, y)}}"""
+    if grids is None:
+        grids = {}
+        for f in FLOORS:
+            try: grids[f] = load_map_grid(f"{f}_map.xlsx", *GRID_SHAPE)
+            except Exception: grids[f] = None
+    if initial_shelves is None:
+        try: initial_shelves = load_shelf_cells(rows_limit=GRID_SHAPE[0], cols_limit=GRID_SHAPE[1], floors=FLOORS)
+        except Exception: initial_shelves = {f: set() for f in FLOORS}
+    return {'grids': grids, 'initial_shelves': initial_shelves}
+
+
+# ---------------- checks ----------------
+
+class AuditCheck:
+    """
+    map(batch, ctx) 在 worker 內執行 (不可依賴實例狀態)，回傳可 pickle 的 partial；
+    reduce(partial) 在主程序依 chunk 順序呼叫；report() 回傳 {'count', 'samples', ...}
+    """
+    name = None
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.count = 0
+        self.samples = []
+
+    def _flag(self, n, samples):
+        self.count += n
+        room = SAMPLE_LIMIT - len(self.samples)
+        if room > 0: self.samples.extend(samples[:room])
+
+    @staticmethod
+    def map(batch, ctx):
+        raise NotImplementedError
+
+    def reduce(self, partial):
+        n, samples = partial
+        self._flag(n, samples)
+
+    def report(self):
+        return {'count': self.count, 'samples': self.samples}
+
+    def get_state(self):
+        """增量稽核：report() 之後要帶到下一次的跨 chunk 狀態 (可 json 序列化)，無狀態回傳 None"""
+        return None
+
+    def set_state(self, state):
+        pass
+
+
+@register_check
+class DataCheck(AuditCheck):
+    """時間欄位無法解析、結束早於開始、未知的樓層/事件類型"""
+    name = 'data'
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        self.rows = 0
+        self.t_min = None; self.t_max = None
+        self.kinds = {'bad_time': 0, 'end_before_start': 0, 'unknown_floor': 0, 'unknown_type': 0}
+
+    @staticmethod
+    def map(batch, ctx):
+        bad_time = (batch['t0'] < 0) | (batch['t1'] < 0)
+        masks = {
+            'bad_time': bad_time,
+            'end_before_start': ~bad_time & (batch['t1'] < batch['t0']),
+            'unknown_floor': batch['floor'] < 0,
+            'unknown_type': batch['type'] < 0,
+        }
+        samples = []
+        for kind, m in masks.items():
+            for i in np.nonzero(m)[0][:SAMPLE_LIMIT]:
+                samples.append({'kind': kind, 'byte': int(batch['offset']), 'obj': batch['obj'][i], 'time': _fmt_t(batch['t0'][i])})
+        ok = ~bad_time
+        t_rng = (int(batch['t0'][ok].min()), int(batch['t1'][ok].max())) if ok.any() else None
+        return batch['n'], {k: int(m.sum()) for k, m in masks.items()}, samples, t_rng
+
+    def reduce(self, partial):
+        n, kinds, samples, t_rng = partial
+        self.rows += n
+        for k, v in kinds.items(): self.kinds[k] += v
+        self._flag(sum(kinds.values()), samples)
+        if t_rng:
+            self.t_min = t_rng[0] if self.t_min is None else min(self.t_min, t_rng[0])
+            self.t_max = t_rng[1] if self.t_max is None else max(self.t_max, t_rng[1])
+
+    def report(self):
+        return dict(super().report(), rows=self.rows, kinds=self.kinds,
+                    time_range=[_fmt_t(self.t_min), _fmt_t(self.t_max)] if self.t_min is not None else None)
+
+    def get_state(self):
+        return {'t_min': self.t_min, 't_max': self.t_max}
+
+    def set_state(self, state):
+        self.t_min, self.t_max = state['t_min'], state['t_max']
+
+
+@register_check
+class WallCheck(AuditCheck):
+    """AGV 事件的起訖格在牆 (-1) 上或超出地圖"""
+    name = 'wall_clip'
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        self.kinds = {'wall': 0, 'out_of_bounds': 0}
+
+    @staticmethod
+    def map(batch, ctx):
+        rows, cols = GRID_SHAPE
+        kinds = {'wall': 0, 'out_of_bounds': 0}
+        samples = []
+        sel = np.nonzero(_types_mask(batch, TRACK_TYPES) & (batch['agv'] >= 0))[0]
+        for xk, yk in [('sx', 'sy'), ('ex', 'ey')]:
+            x = batch[xk][sel]; y = batch[yk][sel]; fl = batch['floor'][sel]
+            oob = (x < 0) | (x >= cols) | (y < 0) | (y >= rows)
+            wall = np.zeros(len(sel), dtype=bool)
+            for fi, f in enumerate(FLOORS):
+                grid = ctx['grids'].get(f)
+                if grid is None: continue
+                m = ~oob & (fl == fi)
+                wall[m] = grid[y[m], x[m]] == -1
+            for kind, m in [('wall', wall), ('out_of_bounds', oob)]:
+                kinds[kind] += int(m.sum())
+                for i in sel[m][:SAMPLE_LIMIT]:
+                    samples.append({'kind': kind, 'agv': batch['obj'][i], 'floor': FLOORS[batch['floor'][i]] if batch['floor'][i] >= 0 else '?',
+                                    'time': _fmt_t(batch['t0'][i]), 'cell': [int(batch[xk][i]), int(batch[yk][i])]})
+        return kinds, samples
+
+    def reduce(self, partial):
+        kinds, samples = partial
+        for k, v in kinds.items(): self.kinds[k] += v
+        self._flag(sum(kinds.values()), samples)
+
+    def report(self):
+        return dict(super().report(), kinds=self.kinds)
+
+
+@register_check
+class SpeedCheck(AuditCheck):
+    """單筆移動事件速度超過 MAX_SPEED (模擬器標記的 TELE_* 另計於 teleport)"""
+    name = 'speed'
+
+    @staticmethod
+    def map(batch, ctx):
+        sel = _types_mask(batch, ('AGV_MOVE',)) & (batch['agv'] >= 0) & (batch['t0'] >= 0) & (batch['t1'] >= 0)
+        sel &= ~pd.Series(batch['text']).str.startswith('TELE').to_numpy()
+        dist = np.abs(batch['ex'] - batch['sx']) + np.abs(batch['ey'] - batch['sy'])
+        dur = batch['t1'] - batch['t0']
+        bad = sel & (dist > 0) & ((dur <= 0) | (dist > MAX_SPEED * np.maximum(dur, 1)))
+        samples = [{'agv': batch['obj'][i], 'time': _fmt_t(batch['t0'][i]), 'dist': int(dist[i]), 'sec': int(dur[i]),
+                    'from': [int(batch['sx'][i]), int(batch['sy'][i])], 'to': [int(batch['ex'][i]), int(batch['ey'][i])]}
+                   for i in np.nonzero(bad)[0][:SAMPLE_LIMIT]]
+        return int(bad.sum()), samples
+
+
+@register_check
+class TeleportCheck(AuditCheck):
+    """同一台 AGV 相鄰兩筆事件，前一筆終點與下一筆起點距離 > 1 (跨 chunk 以最後位置接續)"""
+    name = 'teleport'
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        self.last = {} # agv -> (t1, floor, ex, ey)
+        self.declared = 0
+
+    @staticmethod
+    def map(batch, ctx):
+        idx = _agv_order(batch, _types_mask(batch, TRACK_TYPES))
+        agv = batch['agv'][idx]
+        fl = batch['floor'][idx]
+        sx, sy, ex, ey = (batch[c][idx] for c in ['sx', 'sy', 'ex', 'ey'])
+        same = _same_as_prev(agv)
+        jump = np.zeros(len(idx), dtype=np.int64)
+        jump[1:] = np.abs(sx[1:] - ex[:-1]) + np.abs(sy[1:] - ey[:-1])
+        bad = same & ((jump > 1) | ~_same_as_prev(fl))
+        samples = []
+        for j in np.nonzero(bad)[0][:SAMPLE_LIMIT]:
+            samples.append({'agv': batch['obj'][idx[j]], 'time': _fmt_t(batch['t0'][idx[j]]), 'dist': int(jump[j]),
+                            'from': [int(ex[j - 1]), int(ey[j - 1])], 'to': [int(sx[j]), int(sy[j])]})
+        first = np.nonzero(~same)[0]
+        last = np.r_[first[1:] - 1, len(idx) - 1].astype(np.int64) if len(idx) else first
+        heads = {int(agv[j]): (int(batch['t0'][idx[j]]), int(fl[j]), int(sx[j]), int(sy[j])) for j in first}
+        tails = {int(agv[j]): (int(batch['t1'][idx[j]]), int(fl[j]), int(ex[j]), int(ey[j])) for j in last}
+        text = pd.Series(batch['text'])
+        declared = int(((batch['type'] == T['FORCE_TELE']) | text.str.startswith('TELE').to_numpy()).sum())
+        return int(bad.sum()), samples, heads, tails, declared
+
+    def reduce(self, partial):
+        n, samples, heads, tails, declared = partial
+        self.declared += declared
+        for a, (t, fl, x, y) in heads.items():
+            prev = self.last.get(a)
+            if prev is None: continue
+            dist = abs(x - prev[2]) + abs(y - prev[3])
+            if dist > 1 or fl != prev[1]:
+                self._flag(1, [{'agv': f"AGV_{a}", 'time': _fmt_t(t), 'dist': dist, 'from': [prev[2], prev[3]], 'to': [x, y]}])
+        self._flag(n, samples)
+        self.last.update(tails)
+
+    def report(self):
+        return dict(super().report(), declared=self.declared)
+
+    def get_state(self):
+        return {'last': {str(a): list(v) for a, v in self.last.items()}}
+
+    def set_state(self, state):
+        self.last = {int(a): tuple(v) for a, v in state['last'].items()}
+
+
+@register_check
+class ShelfCheck(AuditCheck):
+    """料架佔用一致性：卸到已有料架的格子 (double) / 從空格取料架 (phantom)
+    事件檔不保證跨 AGV 依時間排序，料架操作 (約佔事件 1%) 先收集，report 時依時間穩定排序後重播"""
+    name = 'shelf'
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        init = ctx.get('initial_shelves') or {}
+        self.occupied = {f: set(init.get(f, set())) for f in FLOORS}
+        self.kinds = {'double': 0, 'phantom': 0}
+        self.ops = []
+
+    @staticmethod
+    def map(batch, ctx):
+        m = _types_mask(batch, SHELF_REMOVE_TYPES + SHELF_ADD_TYPES) & (batch['floor'] >= 0) & (batch['t0'] >= 0)
+        idx = np.nonzero(m)[0]
+        add = np.isin(batch['type'][idx], [T[n] for n in SHELF_ADD_TYPES])
+        return [(int(batch['t0'][i]), int(batch['floor'][i]), int(batch['sx'][i]), int(batch['sy'][i]), bool(a), batch['obj'][i])
+                for i, a in zip(idx, add)]
+
+    def reduce(self, ops):
+        self.ops.extend(ops)
+
+    def _replay(self, ops):
+        for t, fi, x, y, add, obj in sorted(ops, key=lambda op: op[0]):
+            occ = self.occupied[FLOORS[fi]]
+            cell = (x, y)
+            kind = None
+            if add:
+                if cell in occ: kind = 'double'
+                occ.add(cell)
+            else:
+                if cell not in occ: kind = 'phantom'
+                occ.discard(cell)
+            if kind:
+                self.kinds[kind] += 1
+                self._flag(1, [{'kind': kind, 'agv': obj, 'floor': FLOORS[fi], 'time': _fmt_t(t), 'cell': [x, y]}])
+
+    def report(self):
+        self._replay(self.ops)
+        self.ops = []
+        return dict(super().report(), kinds=self.kinds, shelves={f: len(s) for f, s in self.occupied.items()})
+
+    def get_state(self):
+        return {'occupied': {f: sorted([x, y] for x, y in s) for f, s in self.occupied.items()}}
+
+    def set_state(self, state):
+        self.occupied = {f: {tuple(c) for c in state['occupied'].get(f, [])} for f in FLOORS}
+
+
+@register_check
+class StuckCheck(AuditCheck):
+    """AGV 連續原地等待 (零位移 AGV_MOVE / YIELD，時間相接) 超過 STUCK_SEC"""
+    name = 'stuck'
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        self.open = {} # agv -> [start, end, floor, x, y] (延續到 chunk 結尾的等待區段)
+        self.longest = 0
+        self.carry = {} # 增量稽核：檔尾仍在等待的區段 -> [start, end, floor, x, y, 已回報]
+        self.reported = set() # 上次稽核已回報過 (仍在等待) 的 AGV
+
+    @staticmethod
+    def map(batch, ctx):
+        idx = _agv_order(batch, _types_mask(batch, TRACK_TYPES))
+        agv = batch['agv'][idx]
+        t0 = batch['t0'][idx]; t1 = batch['t1'][idx]
+        x = batch['sx'][idx]; y = batch['sy'][idx]; fl = batch['floor'][idx]
+        is_wait = np.isin(batch['type'][idx], [T['AGV_MOVE'], T['YIELD']]) & (x == batch['ex'][idx]) & (y == batch['ey'][idx])
+        same = _same_as_prev(agv)
+        cont = same.copy()
+        cont[1:] &= (t0[1:] == t1[:-1]) & (x[1:] == x[:-1]) & (y[1:] == y[:-1]) & is_wait[:-1]
+        run_start = is_wait & ~cont
+        run_id = np.cumsum(run_start) - 1
+        w = np.nonzero(is_wait)[0]
+        first_of_agv = ~same
+        last_of_agv = np.r_[~same[1:], True] if len(idx) else same.copy()
+        runs = []
+        if len(w):
+            rid = run_id[w]
+            starts = w[np.r_[True, rid[1:] != rid[:-1]]]
+            ends = w[np.r_[rid[1:] != rid[:-1], True]]
+            for a, b in zip(starts, ends):
+                runs.append((int(agv[a]), int(t0[a]), int(t1[b]), int(fl[a]), int(x[a]), int(y[a]),
+                             bool(first_of_agv[a]), bool(last_of_agv[b])))
+        seen = {int(agv[j]): int(t0[j]) for j in np.nonzero(first_of_agv)[0]}
+        return runs, seen
+
+    def _close(self, a, run):
+        start, end, fi, x, y = run
+        dur = end - start
+        self.longest = max(self.longest, dur)
+        if dur >= STUCK_SEC and (a, start) not in self.reported:
+            self._flag(1, [{'agv': f"AGV_{a}", 'floor': FLOORS[fi] if fi >= 0 else '?', 'cell': [x, y],
+                            'from': _fmt_t(start), 'sec': dur}])
+
+    def reduce(self, partial):
+        runs, seen = partial
+        by_agv = defaultdict(list)
+        for r in runs: by_agv[r[0]].append(r)
+        for a in seen:
+            prev = self.open.pop(a, None)
+            for k, (_, start, end, fi, x, y, at_head, at_tail) in enumerate(by_agv.get(a, [])):
+                # chunk 開頭的等待區段與上一個 chunk 結尾的區段時間/位置相接 -> 合併
+                if k == 0 and at_head and prev and prev[1] == start and prev[2:] == [fi, x, y]:
+                    start = prev[0]; prev = None
+                run = [start, end, fi, x, y]
+                if at_tail: self.open[a] = run
+                else: self._close(a, run)
+            if prev: self._close(a, prev)
+
+    def report(self):
+        # 檔尾仍在等待的區段也先回報；增量稽核時帶到下一次接續，接續後不重複回報
+        for a, run in list(self.open.items()):
+            self._close(a, run)
+            self.carry[a] = run + [run[1] - run[0] >= STUCK_SEC or (a, run[0]) in self.reported]
+        self.open = {}
+        return dict(super().report(), longest_sec=self.longest)
+
+    def get_state(self):
+        return {'open': {str(a): run for a, run in self.carry.items()}}
+
+    def set_state(self, state):
+        for a, (start, end, fi, x, y, reported) in state['open'].items():
+            self.open[int(a)] = [start, end, fi, x, y]
+            if reported: self.reported.add((int(a), start))
+
+
+@register_check
+class CollisionCheck(AuditCheck):
+    """
+    AGV 時空衝突 (engine/collisions)：同一秒同一格 (vertex)、同一秒反向通過同一條邊 (swap)、
+    載貨中的 AGV 進入有靜態料架的格子 (shelf)
+    展開結果依時間窗寫到暫存檔，report 時逐窗檢測，主程序記憶體不隨事件檔長度成長
+    """
+    name = 'collision'
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        self.window_sec = ctx.get('collision_window_sec', WINDOW_SEC)
+        self.detector = CollisionDetector(window_sec=self.window_sec, initial_shelves=ctx.get('initial_shelves'))
+        self.tails = {} # agv -> 最後一筆事件最後佔用的 key (增量稽核時避免與上次重複計算)
+        self.prev_tails = {}
+
+    @staticmethod
+    def map(batch, ctx):
+        rows, cols = GRID_SHAPE
+        m = _types_mask(batch, OCCUPY_TYPES) & (batch['agv'] >= 0) & (batch['floor'] >= 0) & (batch['t0'] >= 0) & (batch['t1'] >= batch['t0'])
+        for c, lim in [('sx', cols), ('ex', cols), ('sy', rows), ('ey', rows)]:
+            m &= (batch[c] >= 0) & (batch[c] < lim)
+        idx = np.nonzero(m)[0]
+        occ = expand_segments(*(batch[c][idx] for c in ['t0', 't1', 'floor', 'agv', 'sx', 'sy', 'ex', 'ey']))
+
+        # 料架操作 (時間, 樓層, x, y, 是否放下) 與每台 AGV 的載卸貨 (依檔案順序)
+        is_add = np.isin(batch['type'], [T[n] for n in SHELF_ADD_TYPES])
+        is_op = m & (is_add | np.isin(batch['type'], [T[n] for n in SHELF_REMOVE_TYPES]))
+        j = np.nonzero(is_op)[0]
+        shelf_ops = list(zip(batch['t0'][j].tolist(), batch['floor'][j].tolist(), batch['sx'][j].tolist(), batch['sy'][j].tolist(), is_add[j].tolist()))
+        agv_ops = list(zip(batch['agv'][j].tolist(), batch['t0'][j].tolist(), batch['t1'][j].tolist(), (~is_add[j]).tolist()))
+
+        # 每台 AGV 最後一筆事件的最後佔用：移動 = 終點 @ t1，原地 = 同格 @ t1 - 1
+        agv = batch['agv'][idx]
+        rev_first = np.unique(agv[::-1], return_index=True)[1]
+        last = idx[len(idx) - 1 - rev_first]
+        hold = (batch['sx'][last] == batch['ex'][last]) & (batch['sy'][last] == batch['ey'][last])
+        t_last = np.where(hold, np.maximum(batch['t1'][last] - 1, batch['t0'][last]), batch['t1'][last])
+        keys = pack_key(t_last, batch['floor'][last].astype(np.int64), batch['ey'][last] * cols + batch['ex'][last])
+        tails = dict(zip(batch['agv'][last].tolist(), keys.tolist()))
+        return occ, shelf_ops, agv_ops, tails
+
+    def reduce(self, partial):
+        occ, shelf_ops, agv_ops, tails = partial
+        if self.prev_tails:
+            key, agv = occ[0], occ[1]
+            keep = np.ones(len(key), dtype=bool)
+            for i in np.nonzero(np.isin(key, list(self.prev_tails.values())))[0]:
+                if self.prev_tails.get(int(agv[i])) == key[i]: keep[i] = False
+            occ = (key[keep], agv[keep]) + tuple(occ[2:])
+        self.tails.update(tails)
+        self.detector.add(*occ)
+        self.detector.add_shelf_ops(shelf_ops)
+        self.detector.add_agv_ops(agv_ops)
+
+    def report(self):
+        res = self.detector.finish(SAMPLE_LIMIT)
+        kinds = {k: res[k]['count'] for k in ('vertex', 'swap', 'shelf')}
+        self.count = sum(kinds.values())
+        self.samples = [dict(s, kind=k) for k in kinds for s in res[k]['samples'][:SAMPLE_LIMIT // len(kinds) + 1]][:SAMPLE_LIMIT]
+        return {'count': self.count, 'samples': self.samples, 'kinds': kinds,
+                'agv_pairs': len(res['pairs']), 'top_pairs': res['pairs'][:SAMPLE_LIMIT]}
+
+    def get_state(self):
+        # 接續料架佔用、載貨狀態與各 AGV 最後佔用；新舊事件之間的同格/對穿不回頭比對
+        return dict(self.detector.final, tails={str(a): k for a, k in {**self.prev_tails, **self.tails}.items()})
+
+    def set_state(self, state):
+        shelves = {f: {tuple(c) for c in state['shelves'].get(f, [])} for f in FLOORS}
+        self.detector = CollisionDetector(window_sec=self.window_sec, initial_shelves=shelves, loaded_since=state['loaded'])
+        self.prev_tails = {int(a): k for a, k in state.get('tails', {}).items()}
+
+
+# ---------------- 執行 ----------------
+
+def _map_chunk(args):
+    path, start, end, classes, ctx = args
+    batch = read_batch(path, start, end)
+    return end, [cls.map(batch, ctx) for cls in classes]
+
+
+def run_audit(path, checks=None, workers=1, chunk_bytes=CHUNK_BYTES, ctx=None, verbose=True, state=None):
+    """
+    單趟稽核：checks 為 CHECK_REGISTRY 的名稱 (預設全部)，workers > 1 時以多個 process 平行處理 chunk
+    state 不為 None 時為增量稽核 (load_state 的結果，{} = 從頭開始)：只處理 state 位置之後新增的完整行，
+    並接續各 check 的跨 chunk 狀態；新狀態放在回傳的 report['_state'] (save_state 寫回)
+    回傳 {check_name: report, '_meta': {...}}
+    """
+    names = list(checks or CHECK_REGISTRY)
+    unknown = [n for n in names if n not in CHECK_REGISTRY]
+    if unknown: raise ValueError(f"未知的 check: {unknown}")
+    ctx = ctx if ctx is not None else build_context()
+    classes = [CHECK_REGISTRY[n] for n in names]
+    instances = [cls(ctx) for cls in classes]
+    start = end = None
+    if state is not None:
+        if state and sorted(state.get('checks', {})) != sorted(names):
+            raise ValueError(f"狀態檔的 check ({sorted(state['checks'])}) 與本次 ({sorted(names)}) 不同")
+        for inst in instances:
+            if state.get('checks', {}).get(inst.name) is not None: inst.set_state(state['checks'][inst.name])
+        start = state.get('offset')
+        end = complete_size(path)
+    chunks = plan_chunks(path, chunk_bytes, start=start, end=end)
+    tasks = [(path, s, e, classes, ctx) for s, e in chunks]
+
+    t_start = time.time()
+    if workers and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = ex.map(_map_chunk, tasks)
+            for k, (_, partials) in enumerate(results):
+                for inst, p in zip(instances, partials): inst.reduce(p)
+                if verbose: print(f"   ... chunk {k + 1}/{len(tasks)}", end='\r')
+    else:
+        for k, task in enumerate(tasks):
+            _, partials = _map_chunk(task)
+            for inst, p in zip(instances, partials): inst.reduce(p)
+            if verbose: print(f"   ... chunk {k + 1}/{len(tasks)}", end='\r')
+
+    report = {inst.name: inst.report() for inst in instances}
+    report['_meta'] = {'events': path, 'bytes': os.path.getsize(path), 'chunks': len(tasks),
+                       'workers': workers, 'elapsed_sec': round(time.time() - t_start, 2)}
+    if state is not None:
+        offset = chunks[-1][1] if chunks else (start if start is not None else _header_end(path))
+        totals = {n: state.get('totals', {}).get(n, 0) + report[n]['count'] for n in names}
+        report['_meta'].update(incremental=True, byte_range=[chunks[0][0] if chunks else offset, offset], totals=totals)
+        report['_state'] = {'version': STATE_VERSION, 'events': os.path.abspath(path), 'offset': offset,
+                            'head': _head_digest(path, offset), 'totals': totals,
+                            'checks': {inst.name: inst.get_state() for inst in instances}}
+    return report
+
+
+def _header_end(path):
+    with open(path, 'rb') as f:
+        f.readline()
+        return f.tell()
+
+
+def _head_digest(path, offset):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(min(offset, HEAD_BYTES))).hexdigest()
+
+
+def load_state(state_path, events_path):
+    """
+    讀增量稽核狀態；狀態不存在、版本不同、事件檔換了或被重寫 (變短 / 檔頭不同) 時回傳 {} (從頭稽核)
+    """
+    if not os.path.exists(state_path): return {}
+    try:
+        with open(state_path, encoding='utf-8') as f: state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    reason = None
+    if state.get('version') != STATE_VERSION: reason = '版本不同'
+    elif state.get('events') != os.path.abspath(events_path): reason = '事件檔路徑不同'
+    elif os.path.getsize(events_path) < state.get('offset', 0): reason = '事件檔變短'
+    elif _head_digest(events_path, state['offset']) != state.get('head'): reason = '事件檔已被重寫'
+    if reason:
+        print(f"⚠️ 增量稽核狀態失效 ({reason})，從頭開始")
+        return {}
+    return state
+
+
+def save_state(state, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def print_report(report):
+    meta = report.get('_meta', {})
+    print(f"\n====== 稽核報告 ({meta.get('chunks')} chunks, {meta.get('elapsed_sec')}s) ======")
+    if meta.get('incremental'):
+        a, b = meta['byte_range']
+        print(f"   (增量) 位元組 {a:,} ~ {b:,}，新增 {b - a:,} bytes；累計違規: {json.dumps(meta['totals'], ensure_ascii=False)}")
+    for name, rep in report.items():
+        if name.startswith('_'): continue
+        extra = {k: v for k, v in rep.items() if k not in ('count', 'samples')}
+        mark = '✅' if rep['count'] == 0 else '❌'
+        print(f"{mark} {name}: {rep['count']}  {json.dumps(extra, ensure_ascii=False) if extra else ''}")
+        for s in rep['samples'][:3]:
+            print(f"      {json.dumps(s, ensure_ascii=False)}")
+
+
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({k: v for k, v in report.items() if k != '_state'}, f, ensure_ascii=False, indent=1)
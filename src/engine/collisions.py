@@ -0,0 +1,308 @@
+import pandas as pd
+import numpy as np
+import os
+import shutil
+import tempfile
+
+# ==========================================
+# 向量化時空碰撞檢測
+#   - 事件段展開成 (時間, 樓層, 格) 佔用，打包成單一 int64 key
+#   - vertex conflict：同 key 有兩台以上 AGV (排序後與前一筆比較)
+#   - swap (edge) conflict：同一秒兩台 AGV 反向通過同一條邊
+#   - shelf clip：載貨中的 AGV 進入有靜態料架的格子
+# 展開結果依時間窗 (預設 1 小時) 寫到暫存檔，逐窗檢測，記憶體用量與事件檔長度無關
+# 座標慣例同事件檔：x = 欄，y = 列；cell = y * cols + x
+# ==========================================
+
+FLOORS = ('2F', '3F')
+GRID_SHAPE = (32, 61)
+N_FLOORS = len(FLOORS)
+N_CELLS = GRID_SHAPE[0] * GRID_SHAPE[1]
+WINDOW_SEC = 3600
+INF_TIME = np.iinfo(np.int64).max // 4
+
+
+def pack_key(t, floor, cell):
+    return (np.asarray(t, dtype=np.int64) * N_FLOORS + floor) * N_CELLS + cell
+
+
+def _fmt_t(t):
+    return str(pd.to_datetime(int(t), unit='s'))
+
+
+def unpack_key(key):
+    """key -> (t, floor, x, y)"""
+    key = np.asarray(key, dtype=np.int64)
+    cell = key % N_CELLS; rest = key // N_CELLS
+    return rest // N_FLOORS, rest % N_FLOORS, cell % GRID_SHAPE[1], cell // GRID_SHAPE[1]
+
+
+def expand_segments(t0, t1, floor, agv, sx, sy, ex, ey):
+    """
+    事件段 -> 佔用 (key, agv) 與通過的有向邊 (edge_key, dir, agv)
+    原地事件佔 [t0, t1) 每一秒；移動事件起點佔 t0、終點佔 t1；
+    相鄰格移動在 [t0, t1) 每一秒記一條邊 (edge_key = 較小格 key * N_CELLS + 較大格，dir = +1 / -1)
+    """
+    cols = GRID_SHAPE[1]
+    t0, t1, floor, agv = (np.asarray(a, dtype=np.int64) for a in (t0, t1, floor, agv))
+    c0 = np.asarray(sy, dtype=np.int64) * cols + np.asarray(sx, dtype=np.int64)
+    c1 = np.asarray(ey, dtype=np.int64) * cols + np.asarray(ex, dtype=np.int64)
+    hold = c0 == c1
+
+    n_hold = np.where(hold, np.maximum(t1 - t0, 1), 0)
+    rep = np.repeat(np.arange(len(t0)), n_hold)
+    step = np.arange(n_hold.sum()) - np.repeat(np.cumsum(n_hold) - n_hold, n_hold)
+    mv = np.nonzero(~hold)[0]
+    key = np.r_[pack_key(t0[rep] + step, floor[rep], c0[rep]), pack_key(t0[mv], floor[mv], c0[mv]), pack_key(t1[mv], floor[mv], c1[mv])]
+    occ_agv = np.r_[agv[rep], agv[mv], agv[mv]]
+
+    dist = np.abs(np.asarray(ex) - np.asarray(sx)) + np.abs(np.asarray(ey) - np.asarray(sy))
+    adj = np.nonzero(~hold & (dist == 1))[0]
+    n_edge = np.maximum(t1[adj] - t0[adj], 1)
+    erep = np.repeat(adj, n_edge)
+    estep = np.arange(n_edge.sum()) - np.repeat(np.cumsum(n_edge) - n_edge, n_edge)
+    lo = np.minimum(c0[erep], c1[erep]); hi = np.maximum(c0[erep], c1[erep])
+    edge_key = pack_key(t0[erep] + estep, floor[erep], lo) * N_CELLS + hi
+    edge_dir = np.where(c0[erep] == lo, 1, -1).astype(np.int64)
+    return key, occ_agv, edge_key, edge_dir, agv[erep]
+
+
+def _run_pairs(key, agv, ok=None):
+    """已依 key 排序：同 key 區段內兩兩配對 -> (idx_a, idx_b)；ok(i, j) 為額外條件"""
+    n = len(key)
+    if n < 2: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    new_run = np.r_[True, key[1:] != key[:-1]]
+    run_start = np.maximum.accumulate(np.where(new_run, np.arange(n), 0))
+    ia, ib = [], []
+    d = 1
+    while True:
+        i = np.nonzero(np.arange(n) - d >= run_start)[0]
+        if len(i) == 0: break
+        j = i - d
+        m = agv[i] != agv[j]
+        if ok is not None: m &= ok(j, i)
+        ia.append(j[m]); ib.append(i[m])
+        d += 1
+    if not ia: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(ia), np.concatenate(ib)
+
+
+def vertex_conflicts(key, agv):
+    """-> (key, agv_a, agv_b)：同一秒同一格的 AGV 配對 (agv_a < agv_b)"""
+    pair = np.unique(np.stack([np.asarray(key, np.int64), np.asarray(agv, np.int64)], axis=1), axis=0) if len(key) else np.zeros((0, 2), np.int64)
+    k, a = pair[:, 0], pair[:, 1]
+    i, j = _run_pairs(k, a)
+    return k[i], np.minimum(a[i], a[j]), np.maximum(a[i], a[j])
+
+
+def swap_conflicts(edge_key, edge_dir, agv):
+    """-> (edge_key, agv_a, agv_b)：同一秒反向通過同一條邊的 AGV 配對"""
+    if len(edge_key) == 0: return (np.zeros(0, np.int64),) * 3
+    trip = np.unique(np.stack([np.asarray(edge_key, np.int64), np.asarray(edge_dir, np.int64), np.asarray(agv, np.int64)], axis=1), axis=0)
+    k, d, a = trip[:, 0], trip[:, 1], trip[:, 2]
+    i, j = _run_pairs(k, a, ok=lambda i, j: d[i] != d[j])
+    return k[i], np.minimum(a[i], a[j]), np.maximum(a[i], a[j])
+
+
+def unpack_edge_key(edge_key):
+    """edge_key -> (t, floor, x0, y0, x1, y1)"""
+    edge_key = np.asarray(edge_key, dtype=np.int64)
+    t, fl, x0, y0 = unpack_key(edge_key // N_CELLS)
+    hi = edge_key % N_CELLS
+    return t, fl, x0, y0, hi % GRID_SHAPE[1], hi // GRID_SHAPE[1]
+
+
+# ---------------- 料架 / 載貨區間 ----------------
+
+def _sorted_intervals(group, start, end):
+    order = np.lexsort((start, group))
+    return np.asarray(group, np.int64)[order], np.asarray(start, np.int64)[order], np.asarray(end, np.int64)[order]
+
+
+def shelf_intervals(ops, initial_shelves):
+    """
+    料架操作 [(t, floor, x, y, is_add), ...] (依時間重播) + 初始料架 {floor: {(x, y)}}
+    -> 各格有料架的區間 (group = floor * N_CELLS + cell, start, end)，依 (group, start) 排序
+    """
+    cols = GRID_SHAPE[1]
+    since = {}
+    for fi, f in enumerate(FLOORS):
+        for x, y in (initial_shelves or {}).get(f, ()): since[fi * N_CELLS + y * cols + x] = -INF_TIME
+    g, s, e = [], [], []
+    for t, fi, x, y, add in sorted(ops, key=lambda op: op[0]):
+        c = fi * N_CELLS + y * cols + x
+        if add:
+            since.setdefault(c, t)
+        elif c in since:
+            g.append(c); s.append(since.pop(c)); e.append(t)
+    for c, t in since.items():
+        g.append(c); s.append(t); e.append(INF_TIME)
+    return _sorted_intervals(g, s, e)
+
+
+def loaded_intervals(agv_ops, loaded_since=None):
+    """
+    每台 AGV 依檔案順序的 [(agv, t0, t1, is_load), ...] -> 載貨區間 (group = agv, start, end)
+    載貨從 LOAD 結束到 UNLOAD 開始 (與舊版 debug_overlap_check 相同)；loaded_since = {agv: t} 為開始時已載貨的 AGV
+    """
+    since = dict(loaded_since or {})
+    g, s, e = [], [], []
+    for a, t0, t1, is_load in agv_ops:
+        if is_load:
+            since[a] = t1
+        elif a in since:
+            g.append(a); s.append(since.pop(a)); e.append(t0)
+    for a, t in since.items():
+        g.append(a); s.append(t); e.append(INF_TIME)
+    return _sorted_intervals(g, s, e)
+
+
+def _in_intervals(group, t, iv):
+    """(group[i], t[i]) 是否落在 iv 的某個 [start, end) 內 (同一 group 的區間互不重疊)"""
+    ig, istart, iend = iv
+    if len(ig) == 0: return np.zeros(len(t), dtype=bool)
+    # group 與時間合成單一遞增 key，一次 searchsorted 找到「開始時間 <= t 的最後一段」
+    span = np.int64(1 << 34)
+    combined = ig * span + np.clip(istart, 0, span - 1)
+    pos = np.searchsorted(combined, group * span + t, side='right') - 1
+    ok = pos >= 0
+    pos = np.maximum(pos, 0)
+    return ok & (ig[pos] == group) & (t < iend[pos])
+
+
+def shelf_clips(key, agv, loaded_iv, shelf_iv):
+    """載貨中的 AGV 佔用有靜態料架的格子 -> (key, agv)"""
+    if len(key) == 0: return key, agv
+    pair = np.unique(np.stack([key, agv], axis=1), axis=0)
+    key, agv = pair[:, 0], pair[:, 1]
+    t, fl, x, y = unpack_key(key)
+    loaded = _in_intervals(agv, t, loaded_iv)
+    key, agv, t, fl, x, y = key[loaded], agv[loaded], t[loaded], fl[loaded], x[loaded], y[loaded]
+    cell = fl * N_CELLS + y * GRID_SHAPE[1] + x
+    hit = _in_intervals(cell, t, shelf_iv)
+    return key[hit], agv[hit]
+
+
+def _final_state(shelf_iv, loaded_iv):
+    """區間 -> 結束時的料架佔用 {floor: [[x, y], ...]} 與仍在載貨的 AGV {agv: 載貨開始時間} (供增量稽核接續)"""
+    g, _, e = shelf_iv
+    cells = g[e == INF_TIME]
+    shelves = {f: [] for f in FLOORS}
+    for c in cells.tolist():
+        fi, cell = divmod(c, N_CELLS)
+        shelves[FLOORS[fi]].append([cell % GRID_SHAPE[1], cell // GRID_SHAPE[1]])
+    a, s, e = loaded_iv
+    open_ = e == INF_TIME
+    return {'shelves': shelves, 'loaded': {str(k): int(t) for k, t in zip(a[open_].tolist(), s[open_].tolist())}}
+
+
+# ---------------- 分時間窗的檢測器 ----------------
+
+def _concat(parts, width):
+    if not parts: return [np.zeros(0, dtype=np.int64)] * width
+    return [np.concatenate(cols) for cols in zip(*parts)]
+
+
+class CollisionDetector:
+    """
+    add() 接收展開後的佔用/邊 (任意時間順序)，依時間窗附加寫入暫存檔；
+    finish() 逐窗載入檢測，回傳衝突陣列與 AGV 配對統計
+    料架檢查需另外以 add_shelf_ops / add_agv_ops 提供料架操作與每台 AGV 的載卸貨順序
+    """
+    def __init__(self, window_sec=WINDOW_SEC, spill_dir=None, initial_shelves=None, loaded_since=None):
+        self.window_sec = int(window_sec)
+        self.own_dir = spill_dir is None
+        self.dir = spill_dir or tempfile.mkdtemp(prefix='collisions_')
+        os.makedirs(self.dir, exist_ok=True)
+        self.windows = set()
+        self.initial_shelves = initial_shelves
+        self.loaded_since = {int(a): int(t) for a, t in (loaded_since or {}).items()}
+        self.shelf_ops = []
+        self.agv_ops = []
+        self.triples = 0
+        self.final = None
+
+    def _spill(self, prefix, cols, t):
+        if len(t) == 0: return
+        w = t // self.window_sec
+        order = np.argsort(w, kind='stable')
+        w = w[order]
+        data = np.stack([c[order] for c in cols], axis=1).astype(np.int64)
+        bounds = np.nonzero(np.r_[True, w[1:] != w[:-1], True])[0]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            win = int(w[a])
+            self.windows.add(win)
+            with open(os.path.join(self.dir, f"{prefix}_{win}.bin"), 'ab') as f: f.write(data[a:b].tobytes())
+
+    def add(self, key, agv, edge_key, edge_dir, edge_agv):
+        self.triples += len(key) + len(edge_key)
+        self._spill('v', [key, agv], unpack_key(key)[0])
+        self._spill('e', [edge_key, edge_dir, edge_agv], unpack_key(edge_key // N_CELLS)[0])
+
+    def add_shelf_ops(self, ops):
+        self.shelf_ops.extend(ops)
+
+    def add_agv_ops(self, ops):
+        self.agv_ops.extend(ops)
+
+    def _load(self, prefix, win, width):
+        path = os.path.join(self.dir, f"{prefix}_{win}.bin")
+        if not os.path.exists(path): return np.zeros((0, width), dtype=np.int64)
+        return np.fromfile(path, dtype=np.int64).reshape(-1, width)
+
+    def iter_windows(self):
+        """逐時間窗檢測 -> (win, vertex, swap, shelf)，各為 (key, agv_a, agv_b) / (key, agv)"""
+        check_shelf = bool(self.agv_ops or self.loaded_since)
+        shelf_iv = shelf_intervals(self.shelf_ops, self.initial_shelves)
+        loaded_iv = loaded_intervals(self.agv_ops, self.loaded_since)
+        self.final = _final_state(shelf_iv, loaded_iv)
+        for win in sorted(self.windows):
+            v = self._load('v', win, 2); e = self._load('e', win, 3)
+            vertex = vertex_conflicts(v[:, 0], v[:, 1])
+            swap = swap_conflicts(e[:, 0], e[:, 1], e[:, 2])
+            shelf = shelf_clips(v[:, 0], v[:, 1], loaded_iv, shelf_iv) if check_shelf else (np.zeros(0, np.int64),) * 2
+            yield win, vertex, swap, shelf
+
+    def finish(self, sample_limit=10):
+        """
+        -> {'vertex' / 'swap' / 'shelf': {'count', 'samples'}, 'pairs': [...], 'windows', 'triples'}
+        pairs 依衝突次數排序：每對 AGV 的 vertex / swap 次數與第一次、最後一次發生時間
+        """
+        found = {'vertex': [], 'swap': [], 'shelf': []}
+        n_windows = len(self.windows)
+        try:
+            for win, vertex, swap, shelf in self.iter_windows():
+                found['vertex'].append(vertex); found['swap'].append(swap); found['shelf'].append(shelf)
+        finally:
+            self.close()
+        vk, va, vb = _concat(found['vertex'], 3)
+        sk, sa, sb = _concat(found['swap'], 3)
+        ck, ca = _concat(found['shelf'], 2)
+
+        samples = {}
+        t, fl, x, y = unpack_key(vk[:sample_limit])
+        samples['vertex'] = [{'time': _fmt_t(t_), 'floor': FLOORS[f_], 'cell': [int(x_), int(y_)], 'agvs': [f"AGV_{a_}", f"AGV_{b_}"]}
+                             for t_, f_, x_, y_, a_, b_ in zip(t, fl, x, y, va, vb)]
+        t, fl, x0, y0, x1, y1 = unpack_edge_key(sk[:sample_limit])
+        samples['swap'] = [{'time': _fmt_t(t_), 'floor': FLOORS[f_], 'edge': [[int(p), int(q)], [int(r), int(u)]], 'agvs': [f"AGV_{a_}", f"AGV_{b_}"]}
+                           for t_, f_, p, q, r, u, a_, b_ in zip(t, fl, x0, y0, x1, y1, sa, sb)]
+        t, fl, x, y = unpack_key(ck[:sample_limit])
+        samples['shelf'] = [{'time': _fmt_t(t_), 'floor': FLOORS[f_], 'cell': [int(x_), int(y_)], 'agv': f"AGV_{a_}"}
+                            for t_, f_, x_, y_, a_ in zip(t, fl, x, y, ca)]
+
+        df = pd.DataFrame({'a': np.r_[va, sa], 'b': np.r_[vb, sb],
+                           't': np.r_[unpack_key(vk)[0], unpack_key(sk // N_CELLS)[0]],
+                           'vertex': np.r_[np.ones(len(vk), np.int64), np.zeros(len(sk), np.int64)]})
+        df['swap'] = 1 - df['vertex']
+        g = df.groupby(['a', 'b'], sort=False).agg(vertex=('vertex', 'sum'), swap=('swap', 'sum'), first=('t', 'min'), last=('t', 'max'))
+        g = g.assign(total=g['vertex'] + g['swap']).sort_values('total', ascending=False, kind='stable')
+        pairs = [{'agvs': [f"AGV_{a}", f"AGV_{b}"], 'vertex': int(v), 'swap': int(w), 'first': _fmt_t(t0), 'last': _fmt_t(t1)}
+                 for (a, b), v, w, t0, t1 in zip(g.index, g['vertex'], g['swap'], g['first'], g['last'])]
+        return {'vertex': {'count': len(vk), 'samples': samples['vertex']},
+                'swap': {'count': len(sk), 'samples': samples['swap']},
+                'shelf': {'count': len(ck), 'samples': samples['shelf']},
+                'pairs': pairs, 'windows': n_windows, 'triples': self.triples}
+
+    def close(self):
+        if self.own_dir and os.path.isdir(self.dir): shutil.rmtree(self.dir, ignore_errors=True)
+        self.windows = set()
@@ -1,6 +1,7 @@
-import pandas as pd
 import os
 
+from engine.loaders import load_parameters
+
 class SimConfig:
     def __init__(self, base_dir):
         self.params = {}
@@ -14,37 +15,8 @@ class SimConfig:
             return
 
         try:
-            # 強健讀取 (utf-8 或 cp950)
-            try:
-                df = pd.read_csv(path, encoding='utf-8')
-            except:
-                df = pd.read_csv(path, encoding='cp950')
-
-            # 轉為字典: {parameter_name: parameter_value}
-            # 依據 CSV 欄位: parameter_name, parameter_value, data_type...
-            for _, row in df.iterrows():
-                name = str(row['parameter_name']).strip()
-                val_str = str(row['parameter_value']).strip()
-                dtype = str(row['data_type']).strip().lower()
-
-                # 型別轉換
-                if val_str.lower() == 'nan' or val_str == '':
-                    val = None
-                elif dtype in ['integer', 'int']:
-                    try:
-                        val = int(float(val_str))
-                    except:
-                        val = 0
-                elif dtype == 'float':
-                    try:
-                        val = float(val_str)
-                    except:
-                        val = 0.0
-                else:
-                    val = val_str
-                
-                self.params[name] = val
-            
+            # 向量化型別轉換 (規則見 engine/loaders.load_parameters)
+            self.params.update(load_parameters(path))
             print(f"⚙️ 系統參數已載入: {len(self.params)} 筆")
 
         except Exception as e:
@@ -0,0 +1,646 @@
+import pandas as pd
+import numpy as np
+import os
+import re
+import json
+import base64
+import struct
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+# ==========================================
+# 事件儲存 (取代把全部事件 JSON 內嵌進 dashboard HTML)
+# 依時間切成 chunk，每個 chunk 為一個精簡的二進位檔 (欄位式 typed array)，
+# 前端只抓取播放游標附近的 chunk，並在瀏覽器端以 LRU 快取控制記憶體。
+#
+# 每個 chunk 開頭帶一個 keyframe (chunk 起點的完整狀態)，跳轉時只需
+# 解碼一個 keyframe + 重播該 chunk 內的事件；chunk 長度依事件密度調整。
+#
+# chunk 二進位格式 (little-endian)：
+#   header   : magic 'EVC2' | version u16 | reserved u16 | n u32 | kf_len u32 | meta_len u32   (20 bytes)
+#   keyframe : station_text u32[S] | agv_x i16[A] | agv_y i16[A]
+#              agv_floor u8[A] | agv_flags u8[A] | agv_color u8[A]
+#              shelf bitmap u8[B] x 樓層數 (格子 y*cols+x，位元低位在前) | (補齊到 4 bytes)
+#   columns  : start i32[n] | end i32[n] | text u32[n]     (秒數相對於 manifest.base_time)
+#              obj u16[n] | sx i16[n] | sy i16[n] | ex i16[n] | ey i16[n]
+#              floor u8[n] | type u8[n] | (補齊到 4 bytes)
+#   meta     : UTF-8 JSON {"t": [chunk 內文字表]}
+#   A = manifest.agv_ids 數量, S = manifest.station_ids 數量, B = ceil(rows*cols/8)
+# ==========================================
+
+CHUNK_MAGIC = b'EVC2'
+CHUNK_VERSION = 2
+HEADER_FMT = '<4sHHIII'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+FLOORS = ['2F', '3F']
+EVENT_COLUMNS = ['start_ts', 'end_ts', 'floor', 'obj_id', 'sx', 'sy', 'ex', 'ey', 'type', 'text']
+MANIFEST_FILE = 'manifest.json'
+# 物件索引 (供伺服器查詢單一 AGV / 工作站，不必解碼整段時間的全部事件)
+#   obj_perm.bin    : u32[total_events]，每個 chunk 內依物件代碼穩定排序後的列位置 (chunk k 佔 [i0, i0+n))
+#   obj_offsets.bin : u32[n_chunks, n_objects+1]，chunk 內各物件在排序後的起訖位置
+OBJ_PERM_FILE = 'obj_perm.bin'
+OBJ_OFFSETS_FILE = 'obj_offsets.bin'
+GRID_SHAPE = (32, 61)
+
+# keyframe 間距：每段約 TARGET_EVENTS 筆事件，且介於 MIN_SPAN ~ MAX_SPAN 秒
+TARGET_EVENTS = 4000
+MIN_SPAN = 30
+MAX_SPAN = 900
+
+AGV_FLAG_VISIBLE = 1
+AGV_FLAG_LOADED = 2
+AGV_FLAG_RESCUE = 4
+# 與前端 processEventLogic 的顏色規則一致
+AGV_COLORS = ['#00e5ff', '#d500f9', '#009688', 'orange', 'green', 'red']
+
+# ------------------------------------------
+# LOD 播放串流 (高倍速播放時取代逐筆事件)
+# 每個解析度 (秒/格) 一組取樣檔，每檔 LOD_SAMPLES_PER_FILE 格；
+# 料架位元圖每 LOD_BITMAP_STRIDE 秒模擬時間存一份 (各解析度共用同一組時間點)
+#
+# LOD 檔格式 (little-endian)：
+#   header : magic 'LOD1' | version u16 | res u16 | n u32 | t0 u32 (相對 base_time) | nb u32 | meta_len u32   (24 bytes)
+#   body   : station_text u32[n*S] | agv_x i16[n*A] | agv_y i16[n*A] | shelf_count u16[n*F]
+#            agv_floor u8[n*A] | agv_flags u8[n*A] | agv_color u8[n*A]
+#            shelf bitmap u8[nb*F*B] | (補齊到 4 bytes)
+#   meta   : UTF-8 JSON {"t": [檔內文字表]}
+#   陣列皆為「取樣為列」排列；F = manifest.shelf_floors 數量
+# ------------------------------------------
+LOD_MAGIC = b'LOD1'
+LOD_VERSION = 1
+LOD_HEADER_FMT = '<4sHHIIII'
+LOD_HEADER_SIZE = struct.calcsize(LOD_HEADER_FMT)
+LOD_LEVELS = (1, 10, 60)
+LOD_SAMPLES_PER_FILE = 600
+LOD_BITMAP_STRIDE = 60
+
+SHELF_REMOVE_TYPES = ('SHELF_LOAD', 'SHUFFLE_LOAD')
+SHELF_ADD_TYPES = ('SHELF_UNLOAD', 'SHUFFLE_UNLOAD')
+
+
+def normalize_obj_id(val):
+    val = str(val).strip()
+    if val.isdigit():
+        return f"AGV_{int(val)}"
+    if val.upper().startswith('AGV'):
+        nums = re.findall(r'\d+', val)
+        if nums:
+            return f"AGV_{int(nums[0])}"
+    return val
+
+
+def load_events(events_path):
+    """
+    simulation_events.csv -> 排序好的事件 DataFrame (欄位同 EVENT_COLUMNS，時間為 epoch 秒)
+    obj_id 正規化只對不重複值做一次 (AGV 數量遠少於事件數)
+    """
+    df = pd.read_csv(events_path, on_bad_lines='skip', engine='python')
+    df['start_ts'] = pd.to_datetime(df['start_time'], errors='coerce')
+    df['end_ts'] = pd.to_datetime(df['end_time'], errors='coerce')
+    df = df.dropna(subset=['start_ts', 'end_ts'])
+    df = df[df['start_ts'].dt.year > 2020]
+    if df.empty: return df.reindex(columns=EVENT_COLUMNS)
+
+    uniq = pd.unique(df['obj_id'].astype(str))
+    df['obj_id'] = df['obj_id'].astype(str).map({u: normalize_obj_id(u) for u in uniq})
+    df['start_ts'] = df['start_ts'].astype('datetime64[s]').astype('int64')
+    df['end_ts'] = df['end_ts'].astype('datetime64[s]').astype('int64')
+    df['text'] = df['text'].fillna('').astype(str)
+    for c in ['sx', 'sy', 'ex', 'ey']:
+        df[c] = pd.to_numeric(df[c], errors='coerce')
+    df = df.sort_values('start_ts', kind='stable').reset_index(drop=True)
+    return df[EVENT_COLUMNS]
+
+
+def chunk_bounds(start_ts, target_events=TARGET_EVENTS, min_span=MIN_SPAN, max_span=MAX_SPAN):
+    """
+    依事件密度切分 keyframe 區間，回傳每個 chunk 的起始時間
+    start_ts: 已排序的事件起始時間 (秒)；繁忙時段切得較密，空檔直接跳到下一筆事件
+    """
+    ts = np.asarray(start_ts, dtype=np.int64)
+    if len(ts) == 0: return []
+    starts = [int(ts[0])]
+    while True:
+        t0 = starts[-1]
+        i0 = int(np.searchsorted(ts, t0, side='left'))
+        t_dense = int(ts[i0 + target_events]) if i0 + target_events < len(ts) else t0 + max_span
+        t1 = max(t0 + min_span, min(t0 + max_span, t_dense))
+        j = int(np.searchsorted(ts, t1, side='left'))
+        if j >= len(ts): break
+        starts.append(max(t1, int(ts[j])))
+    return starts
+
+
+def _shelf_ops(df):
+    """
+    料架搬移事件 -> [(起始時間, 樓層, "x,y", 是否為取走)]，依事件順序
+    只走訪取放料架事件，不需逐筆掃過全部 AGV_MOVE
+    """
+    mask = df['type'].isin(SHELF_REMOVE_TYPES + SHELF_ADD_TYPES).to_numpy()
+    sub = df.loc[mask, ['start_ts', 'floor', 'sx', 'sy', 'ex', 'ey', 'type']]
+    ops = []
+    for t, floor, sx, sy, ex, ey, type_ in sub.to_numpy(dtype=object):
+        if type_ in SHELF_REMOVE_TYPES: ops.append((t, floor, f"{_fmt_coord(sx)},{_fmt_coord(sy)}", True))
+        else: ops.append((t, floor, f"{_fmt_coord(ex)},{_fmt_coord(ey)}", False))
+    return ops
+
+
+def _apply_shelf_op(curr, op):
+    _, floor, key, remove = op
+    if floor in curr:
+        if remove: curr[floor].discard(key)
+        else: curr[floor].add(key)
+
+
+def _shelf_states(df, times, initial_shelf_sets, side='left'):
+    """
+    各時間點的料架位置集合 {floor: {"x,y"}}
+    side='left': 只含起始時間 < t 的事件 (keyframe)；'right': 含 <= t (LOD 取樣)
+    """
+    curr = {f: {f"{x},{y}" for x, y in initial_shelf_sets.get(f, ())} for f in FLOORS}
+    ops = _shelf_ops(df)
+    ends = np.searchsorted(np.array([op[0] for op in ops], dtype=np.int64), np.asarray(times, dtype=np.int64), side=side)
+    states = []
+    j = 0
+    for end in ends:
+        while j < end:
+            _apply_shelf_op(curr, ops[j])
+            j += 1
+        states.append({f: set(curr[f]) for f in FLOORS})
+    return states
+
+
+def _shelf_counts(df, times, initial_shelf_sets, side='right'):
+    """各時間點每層的料架數 (len(FLOORS), len(times))，由逐事件計數 + searchsorted 取得"""
+    curr = {f: {f"{x},{y}" for x, y in initial_shelf_sets.get(f, ())} for f in FLOORS}
+    ops = _shelf_ops(df)
+    table = np.empty((len(ops) + 1, len(FLOORS)), dtype=np.int64)
+    table[0] = [len(curr[f]) for f in FLOORS]
+    for j, op in enumerate(ops):
+        _apply_shelf_op(curr, op)
+        table[j + 1] = [len(curr[f]) for f in FLOORS]
+    idx = np.searchsorted(np.array([op[0] for op in ops], dtype=np.int64), np.asarray(times, dtype=np.int64), side=side)
+    return table[idx].T
+
+
+def pack_shelves(keys, grid_shape=GRID_SHAPE):
+    """{"x,y"} -> 佔用位元圖 (uint8，格子索引 y*cols+x，超出地圖範圍的忽略)"""
+    rows, cols = grid_shape
+    bits = np.zeros(rows * cols, dtype=np.uint8)
+    for key in keys:
+        try: x, y = (int(float(v)) for v in key.split(','))
+        except ValueError: continue
+        if 0 <= x < cols and 0 <= y < rows: bits[y * cols + x] = 1
+    return np.packbits(bits, bitorder='little')
+
+
+def unpack_shelves(packed, grid_shape=GRID_SHAPE):
+    """佔用位元圖 -> {(x, y)}"""
+    rows, cols = grid_shape
+    idx = np.flatnonzero(np.unpackbits(np.asarray(packed, dtype=np.uint8), count=rows * cols, bitorder='little'))
+    return {(int(i % cols), int(i // cols)) for i in idx}
+
+
+def _last_before(ts, starts, side='left'):
+    # 每個時間點之前最後一筆事件的位置 (-1 表示尚無事件)
+    return np.searchsorted(ts, starts, side=side) - 1
+
+
+def _agv_states(df, starts, agv_ids, floor_codes, ex, ey, side='left'):
+    """
+    各時間點的 AGV 狀態 (等同依序播放到該時間點的結果)
+    位置取最後一筆事件的終點；載貨 / 救援旗標取最後一次取放料架事件
+    回傳 dict of (len(starts), len(agv_ids)) 陣列
+    """
+    shape = (len(starts), len(agv_ids))
+    out = {'x': np.full(shape, -1, dtype=np.int16), 'y': np.full(shape, -1, dtype=np.int16),
+           'floor': np.zeros(shape, dtype=np.uint8), 'flags': np.zeros(shape, dtype=np.uint8),
+           'color': np.zeros(shape, dtype=np.uint8)}
+    starts = np.asarray(starts, dtype=np.int64)
+    ts_all = df['start_ts'].to_numpy()
+    types = df['type'].astype(str).to_numpy()
+    groups = df.groupby('obj_id', sort=False).indices
+
+    for a, agv in enumerate(agv_ids):
+        rows = groups.get(agv)
+        if rows is None: continue
+        t = types[rows]
+        last = _last_before(ts_all[rows], starts, side)
+        has = last >= 0
+        pick = rows[np.maximum(last, 0)]
+        out['x'][:, a] = np.where(has, ex[pick], -1)
+        out['y'][:, a] = np.where(has, ey[pick], -1)
+        out['floor'][:, a] = np.where(has, floor_codes[pick], 0)
+
+        shelf_rows = rows[np.isin(t, SHELF_REMOVE_TYPES + SHELF_ADD_TYPES)]
+        li = _last_before(ts_all[shelf_rows], starts, side)
+        loaded = (li >= 0) & np.isin(types[shelf_rows][np.maximum(li, 0)], SHELF_REMOVE_TYPES) if len(shelf_rows) else np.zeros(len(starts), dtype=bool)
+        shuffle_rows = rows[np.isin(t, ('SHUFFLE_LOAD', 'SHUFFLE_UNLOAD'))]
+        si = _last_before(ts_all[shuffle_rows], starts, side)
+        rescue = (si >= 0) & (types[shuffle_rows][np.maximum(si, 0)] == 'SHUFFLE_LOAD') if len(shuffle_rows) else np.zeros(len(starts), dtype=bool)
+
+        out['flags'][:, a] = has * AGV_FLAG_VISIBLE + loaded * AGV_FLAG_LOADED + rescue * AGV_FLAG_RESCUE
+        last_type = pd.Series(types[pick])
+        color = np.select([last_type.eq('YIELD'), last_type.eq('PARKING'), last_type.str.contains('TELE'), rescue, loaded],
+                          [3, 4, 5, 2, 1], default=0)
+        out['color'][:, a] = np.where(has, color, 0)
+    return out
+
+
+def _station_codes(df, starts, station_ids, side='left'):
+    """
+    各時間點每個工作站最後一筆 STATION_STATUS 的文字代碼
+    回傳 (代碼陣列 (len(starts), len(station_ids))，-1 表示尚未有狀態, 文字表)
+    """
+    out = np.full((len(starts), len(station_ids)), -1, dtype=np.int32)
+    sub = df[df['type'] == 'STATION_STATUS']
+    codes, uniq = pd.factorize(sub['text'].to_numpy(dtype=object))
+    groups = sub.groupby('obj_id', sort=False).indices
+    ts_sub = sub['start_ts'].to_numpy()
+    for s_idx, sid in enumerate(station_ids):
+        rows = groups.get(sid)
+        if rows is None: continue
+        last = _last_before(ts_sub[rows], np.asarray(starts, dtype=np.int64), side)
+        out[:, s_idx] = np.where(last >= 0, codes[rows[np.maximum(last, 0)]], -1)
+    return out, np.asarray(uniq, dtype=object)
+
+
+def _station_texts(df, starts, station_ids, side='left'):
+    """各時間點每個工作站最後一筆 STATION_STATUS 的文字 ('' 表示尚未有狀態)"""
+    codes, uniq = _station_codes(df, starts, station_ids, side)
+    # 代碼 -1 對應到補在最後的空字串
+    return np.append(uniq, '')[codes]
+
+
+def _fmt_coord(v):
+    # 與前端 key 格式一致 (整數座標不帶小數點)
+    try:
+        fv = float(v)
+        return str(int(fv)) if fv.is_integer() else str(fv)
+    except (TypeError, ValueError):
+        return str(v)
+
+
+def encode_keyframe(kf):
+    """kf: station_text / agv_x / agv_y / agv_floor / agv_flags / agv_color / shelves (各樓層位元圖)"""
+    parts = [np.ascontiguousarray(kf['station_text'], dtype='<u4').tobytes()]
+    for name, dt in [('agv_x', '<i2'), ('agv_y', '<i2'), ('agv_floor', 'u1'), ('agv_flags', 'u1'), ('agv_color', 'u1')]:
+        parts.append(np.ascontiguousarray(kf[name], dtype=dt).tobytes())
+    parts += [np.ascontiguousarray(b, dtype='u1').tobytes() for b in kf['shelves']]
+    body = b''.join(parts)
+    return body + b'\0' * (-len(body) % 4)
+
+
+def decode_keyframe(buf, offset, n_agv, n_station, n_floor, grid_shape=GRID_SHAPE):
+    kf = {}
+    off = offset
+    for name, dt, size, n in [('station_text', '<u4', 4, n_station), ('agv_x', '<i2', 2, n_agv), ('agv_y', '<i2', 2, n_agv),
+                              ('agv_floor', 'u1', 1, n_agv), ('agv_flags', 'u1', 1, n_agv), ('agv_color', 'u1', 1, n_agv)]:
+        kf[name] = np.frombuffer(buf, dtype=dt, count=n, offset=off)
+        off += size * n
+    nbytes = (grid_shape[0] * grid_shape[1] + 7) // 8
+    kf['shelves'] = []
+    for _ in range(n_floor):
+        kf['shelves'].append(np.frombuffer(buf, dtype='u1', count=nbytes, offset=off))
+        off += nbytes
+    return kf
+
+
+def encode_chunk(cols, meta, kf_bytes=b''):
+    """cols: dict of numpy arrays (同一 chunk)；kf_bytes: encode_keyframe 的結果；回傳 bytes"""
+    n = len(cols['start'])
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    parts = [struct.pack(HEADER_FMT, CHUNK_MAGIC, CHUNK_VERSION, 0, n, len(kf_bytes), len(meta_bytes)), kf_bytes]
+    for name, dt in [('start', '<i4'), ('end', '<i4'), ('text', '<u4'),
+                     ('obj', '<u2'), ('sx', '<i2'), ('sy', '<i2'), ('ex', '<i2'), ('ey', '<i2'),
+                     ('floor', 'u1'), ('type', 'u1')]:
+        parts.append(np.ascontiguousarray(cols[name], dtype=dt).tobytes())
+    body = b''.join(parts)
+    body += b'\0' * (-len(body) % 4)
+    return body + meta_bytes
+
+
+def decode_chunk(buf):
+    """bytes -> (dict of numpy arrays, meta, keyframe 原始位元組區段 (offset, length))；供 Python 端讀取"""
+    magic, version, _, n, kf_len, meta_len = struct.unpack_from(HEADER_FMT, buf, 0)
+    if magic != CHUNK_MAGIC: raise ValueError("不是有效的事件 chunk 檔")
+    off = HEADER_SIZE + kf_len
+    cols = {}
+    for name, dt, size in [('start', '<i4', 4), ('end', '<i4', 4), ('text', '<u4', 4),
+                           ('obj', '<u2', 2), ('sx', '<i2', 2), ('sy', '<i2', 2), ('ex', '<i2', 2), ('ey', '<i2', 2),
+                           ('floor', 'u1', 1), ('type', 'u1', 1)]:
+        cols[name] = np.frombuffer(buf, dtype=dt, count=n, offset=off)
+        off += size * n
+    off += -off % 4
+    meta = json.loads(bytes(buf[off:off + meta_len]).decode('utf-8'))
+    return cols, meta, (HEADER_SIZE, kf_len)
+
+
+def encode_lod(res, t0_rel, cols, bitmaps, texts):
+    """cols: st_text / agv_x / agv_y / shelf_count / agv_floor / agv_flags / agv_color (取樣為列的 2D 陣列)"""
+    n = len(cols['agv_x'])
+    meta_bytes = json.dumps({'t': texts}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    parts = [struct.pack(LOD_HEADER_FMT, LOD_MAGIC, LOD_VERSION, res, n, t0_rel, len(bitmaps), len(meta_bytes))]
+    for name, dt in [('st_text', '<u4'), ('agv_x', '<i2'), ('agv_y', '<i2'), ('shelf_count', '<u2'),
+                     ('agv_floor', 'u1'), ('agv_flags', 'u1'), ('agv_color', 'u1')]:
+        parts.append(np.ascontiguousarray(cols[name], dtype=dt).tobytes())
+    parts += [b.tobytes() for floor_bitmaps in bitmaps for b in floor_bitmaps]
+    body = b''.join(parts)
+    body += b'\0' * (-len(body) % 4)
+    return body + meta_bytes
+
+
+def decode_lod(buf, n_agv, n_station, n_floor, grid_shape=GRID_SHAPE):
+    """LOD 檔 bytes -> dict (2D 陣列皆為取樣為列；shelves 為 [位元圖][樓層])"""
+    magic, version, res, n, t0_rel, nb, meta_len = struct.unpack_from(LOD_HEADER_FMT, buf, 0)
+    if magic != LOD_MAGIC: raise ValueError("不是有效的 LOD 檔")
+    out = {'res': res, 't0': t0_rel, 'n': n}
+    off = LOD_HEADER_SIZE
+    for name, dt, width in [('st_text', '<u4', n_station), ('agv_x', '<i2', n_agv), ('agv_y', '<i2', n_agv),
+                            ('shelf_count', '<u2', n_floor), ('agv_floor', 'u1', n_agv), ('agv_flags', 'u1', n_agv),
+                            ('agv_color', 'u1', n_agv)]:
+        arr = np.frombuffer(buf, dtype=dt, count=n * width, offset=off)
+        out[name] = arr.reshape(n, width)
+        off += arr.nbytes
+    nbytes = (grid_shape[0] * grid_shape[1] + 7) // 8
+    out['shelves'] = np.frombuffer(buf, dtype='u1', count=nb * n_floor * nbytes, offset=off).reshape(nb, n_floor, nbytes)
+    off += nb * n_floor * nbytes
+    off += -off % 4
+    out['texts'] = json.loads(bytes(buf[off:off + meta_len]).decode('utf-8'))['t']
+    return out
+
+
+def _write_lod(out_dir, df, initial_shelf_sets, grid_shape, agv_ids, station_ids, floor_codes, coords,
+               min_time, max_time, levels, js_wrappers):
+    """
+    輸出各解析度的 LOD 取樣檔；取樣值 = 依序播放到該秒 (含) 的狀態，與 keyframe 規則相同
+    另附每格的料架數 / 工作站狀態，前端高倍速時不再逐筆處理事件
+    回傳 manifest['lod']
+    """
+    # 料架位元圖：各解析度共用，每 LOD_BITMAP_STRIDE 秒一份
+    bm_times = np.arange(min_time, max_time + LOD_BITMAP_STRIDE, LOD_BITMAP_STRIDE, dtype=np.int64)
+    bitmaps = [[pack_shelves(st[f], grid_shape) for f in FLOORS]
+               for st in _shelf_states(df, bm_times, initial_shelf_sets, side='right')]
+
+    out = []
+    for res in levels:
+        if LOD_BITMAP_STRIDE % res or (LOD_SAMPLES_PER_FILE * res) % LOD_BITMAP_STRIDE:
+            raise ValueError(f"LOD 解析度 {res}s 需整除 {LOD_BITMAP_STRIDE}s")
+        times = np.arange(min_time, max_time + res, res, dtype=np.int64)
+        agvs = _agv_states(df, times, agv_ids, floor_codes, coords['ex'], coords['ey'], side='right')
+        st_codes, st_uniq = _station_codes(df, times, station_ids, side='right')
+        counts = _shelf_counts(df, times, initial_shelf_sets, side='right').T
+
+        per_bitmap = LOD_BITMAP_STRIDE // res
+        n_files = (len(times) + LOD_SAMPLES_PER_FILE - 1) // LOD_SAMPLES_PER_FILE
+        total_bytes = 0
+        for k in range(n_files):
+            lo, hi = k * LOD_SAMPLES_PER_FILE, min(len(times), (k + 1) * LOD_SAMPLES_PER_FILE)
+            # 檔內文字表：索引 0 為空字串 (尚無狀態)，代碼 +1 後查表重編
+            codes = st_codes[lo:hi]
+            used = np.unique(codes[codes >= 0])
+            texts = [''] + [str(st_uniq[c]) for c in used]
+            lut = np.zeros(len(st_uniq) + 1, dtype=np.int64)
+            lut[used + 1] = np.arange(1, len(used) + 1)
+            cols = {'st_text': lut[codes + 1],
+                    'agv_x': agvs['x'][lo:hi], 'agv_y': agvs['y'][lo:hi], 'shelf_count': counts[lo:hi],
+                    'agv_floor': agvs['floor'][lo:hi], 'agv_flags': agvs['flags'][lo:hi], 'agv_color': agvs['color'][lo:hi]}
+            b_lo, b_hi = lo // per_bitmap, (hi - 1) // per_bitmap + 1
+            payload = encode_lod(res, int(times[lo] - min_time), cols, bitmaps[b_lo:b_hi], texts)
+
+            name = f"lod{res}_{k:05d}"
+            with open(os.path.join(out_dir, name + '.bin'), 'wb') as f: f.write(payload)
+            if js_wrappers:
+                with open(os.path.join(out_dir, name + '.js'), 'w', encoding='ascii') as f:
+                    f.write(f"window.__onLodChunk({res},{k},\"{base64.b64encode(payload).decode('ascii')}\");\n")
+            total_bytes += len(payload)
+        out.append({'res': res, 'n': int(len(times)), 'files': n_files, 'bytes': total_bytes})
+    return {'samples_per_file': LOD_SAMPLES_PER_FILE, 'bitmap_stride': LOD_BITMAP_STRIDE, 'levels': out}
+
+
+def write_event_store(out_dir, df, initial_shelf_sets, grid_shape=GRID_SHAPE, target_events=TARGET_EVENTS,
+                      min_span=MIN_SPAN, max_span=MAX_SPAN, lod_levels=LOD_LEVELS, js_wrappers=True):
+    """
+    將事件寫成 chunk 檔 + manifest
+    每個 chunk 起點附 keyframe；manifest 的 i0 為該 keyframe 對應的全域事件位置
+    lod_levels: 另外輸出的 LOD 取樣解析度 (秒)，空值則不輸出
+    js_wrappers: 另外輸出 .js 包裝檔 (base64)，讓直接以 file:// 開啟的 HTML 也能用 <script> 載入
+    回傳 manifest (dict)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for fn in os.listdir(out_dir):
+        if fn.startswith(('chunk_', 'lod', 'obj_')) or fn == MANIFEST_FILE: os.remove(os.path.join(out_dir, fn))
+
+    min_time = int(df['start_ts'].min())
+    max_time = int(df['end_ts'].max())
+    ts = df['start_ts'].to_numpy()
+    starts = chunk_bounds(ts, target_events, min_span, max_span)
+
+    # 全域查表：樓層 / 物件 / 事件類型 (前端以索引還原)
+    floors = FLOORS + sorted(set(df['floor'].astype(str).unique()) - set(FLOORS))
+    floor_codes = pd.Categorical(df['floor'].astype(str), categories=floors).codes.astype(np.uint8)
+    obj_codes, objects = pd.factorize(df['obj_id'], sort=True)
+    type_codes, types = pd.factorize(df['type'].astype(str), sort=True)
+    if len(objects) > 0xFFFF or len(types) > 0xFF:
+        raise ValueError("物件或事件類型數量超出 chunk 格式上限")
+    agv_ids = sorted(o for o in objects if str(o).startswith('AGV'))
+    station_ids = [o for o in pd.unique(df['obj_id']) if str(o).startswith('WS_')]
+
+    coords = {c: df[c].fillna(-1).round().astype(np.int64).clip(-32768, 32767).to_numpy() for c in ['sx', 'sy', 'ex', 'ey']}
+    start_rel = (ts - min_time).astype(np.int64)
+    end_rel = (df['end_ts'].to_numpy() - min_time).astype(np.int64)
+    texts = df['text'].to_numpy(dtype=object)
+
+    shelves = _shelf_states(df, starts, initial_shelf_sets)
+    agvs = _agv_states(df, starts, agv_ids, floor_codes, coords['ex'], coords['ey'])
+    st_texts = _station_texts(df, starts, station_ids)
+    cut = np.searchsorted(ts, starts, side='left').tolist() + [len(df)]
+
+    chunks = []
+    obj_perm = np.empty(len(df), dtype=np.uint32)
+    obj_offsets = np.empty((len(starts), len(objects) + 1), dtype=np.uint32)
+    for k, t0 in enumerate(starts):
+        lo, hi = cut[k], cut[k + 1]
+        order = np.argsort(obj_codes[lo:hi], kind='stable')
+        obj_perm[lo:hi] = order
+        obj_offsets[k] = np.searchsorted(obj_codes[lo:hi][order], np.arange(len(objects) + 1), side='left')
+        # chunk 內文字表：索引 0 固定為空字串，keyframe 的工作站狀態也放在同一張表
+        t_codes, t_uniq = pd.factorize(np.concatenate([texts[lo:hi], st_texts[k]]))
+        t_list = [''] + [str(u) for u in t_uniq if u != '']
+        pos = {u: i for i, u in enumerate(t_list)}
+        if len(t_uniq): t_codes = np.array([pos[str(u)] for u in t_uniq], dtype=np.int64)[t_codes]
+        cols = {'start': start_rel[lo:hi], 'end': end_rel[lo:hi], 'text': t_codes[:hi - lo],
+                'obj': obj_codes[lo:hi], 'floor': floor_codes[lo:hi], 'type': type_codes[lo:hi]}
+        cols.update({c: coords[c][lo:hi] for c in coords})
+        kf = {'station_text': t_codes[hi - lo:],
+              'agv_x': agvs['x'][k], 'agv_y': agvs['y'][k], 'agv_floor': agvs['floor'][k],
+              'agv_flags': agvs['flags'][k], 'agv_color': agvs['color'][k],
+              'shelves': [pack_shelves(shelves[k][f], grid_shape) for f in FLOORS]}
+        payload = encode_chunk(cols, {'t': t_list}, encode_keyframe(kf))
+
+        name = f"chunk_{k:05d}"
+        with open(os.path.join(out_dir, name + '.bin'), 'wb') as f: f.write(payload)
+        if js_wrappers:
+            with open(os.path.join(out_dir, name + '.js'), 'w', encoding='ascii') as f:
+                f.write(f"window.__onEventChunk({k},\"{base64.b64encode(payload).decode('ascii')}\");\n")
+        t1 = starts[k + 1] if k + 1 < len(starts) else max_time + 1
+        chunks.append({'k': k, 't0': t0, 't1': t1, 'i0': lo, 'n': hi - lo, 'file': name, 'bytes': len(payload)})
+
+    obj_perm.tofile(os.path.join(out_dir, OBJ_PERM_FILE))
+    obj_offsets.tofile(os.path.join(out_dir, OBJ_OFFSETS_FILE))
+
+    manifest = {
+        'version': CHUNK_VERSION,
+        'base_time': min_time,
+        'min_time': min_time,
+        'max_time': max_time,
+        'grid': list(grid_shape),
+        'floors': floors,
+        'shelf_floors': FLOORS,
+        'objects': [str(o) for o in objects],
+        'types': [str(t) for t in types],
+        'agv_ids': [str(a) for a in agv_ids],
+        'agv_colors': AGV_COLORS,
+        'station_ids': [str(s) for s in station_ids],
+        'total_events': int(len(df)),
+        # 事件最長持續秒數：時間區間查詢需往前多看這麼久，才找得到跨入區間的長事件
+        'max_duration': int((df['end_ts'] - df['start_ts']).max()),
+        'chunks': chunks,
+        'lod': _write_lod(out_dir, df, initial_shelf_sets, grid_shape, agv_ids, station_ids, floor_codes, coords,
+                          min_time, max_time, lod_levels, js_wrappers) if lod_levels else None,
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return manifest
+
+
+class EventStore:
+    """
+    Python 端讀取 event store (只依 manifest 讀入需要的 chunk)
+    解碼後的 chunk 以 LRU 快取 (可被多執行緒共用)，物件索引以 memmap 讀取
+    """
+    CACHE_SIZE = 64
+
+    def __init__(self, store_dir):
+        self.dir = store_dir
+        with open(os.path.join(store_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.chunks = self.manifest['chunks']
+        self._t0s = [c['t0'] for c in self.chunks]
+        self._obj_code = {o: i for i, o in enumerate(self.manifest['objects'])}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._perm = self._offsets = None
+        if os.path.exists(os.path.join(store_dir, OBJ_OFFSETS_FILE)):
+            self._perm = np.memmap(os.path.join(store_dir, OBJ_PERM_FILE), dtype=np.uint32, mode='r')
+            self._offsets = np.memmap(os.path.join(store_dir, OBJ_OFFSETS_FILE), dtype=np.uint32, mode='r',
+                                      shape=(len(self.chunks), len(self.manifest['objects']) + 1))
+
+    def chunk_index(self, t):
+        return max(0, bisect_right(self._t0s, t) - 1)
+
+    def read_chunk(self, k):
+        """回傳 (事件欄位 dict, chunk 文字表)"""
+        with self._lock:
+            if k in self._cache:
+                self._cache.move_to_end(k)
+                return self._cache[k]
+        with open(os.path.join(self.dir, self.chunks[k]['file'] + '.bin'), 'rb') as f:
+            cols, meta, _ = decode_chunk(f.read())
+        with self._lock:
+            self._cache[k] = (cols, meta['t'])
+            while len(self._cache) > self.CACHE_SIZE: self._cache.popitem(last=False)
+        return cols, meta['t']
+
+    def read_lod(self, res, k):
+        """解析度 res 秒的第 k 個 LOD 檔 (decode_lod 的結果)"""
+        m = self.manifest
+        with open(os.path.join(self.dir, f"lod{res}_{k:05d}.bin"), 'rb') as f:
+            return decode_lod(f.read(), len(m['agv_ids']), len(m['station_ids']), len(m['shelf_floors']), tuple(m['grid']))
+
+    def read_keyframe(self, k):
+        """chunk k 起點的完整狀態：shelves {floor: {(x, y)}} / agvs {id: dict} / stations {id: 狀態文字}"""
+        m = self.manifest
+        with open(os.path.join(self.dir, self.chunks[k]['file'] + '.bin'), 'rb') as f:
+            buf = f.read()
+        _, meta, (off, _) = decode_chunk(buf)
+        kf = decode_keyframe(buf, off, len(m['agv_ids']), len(m['station_ids']), len(m['shelf_floors']), tuple(m['grid']))
+        agvs = {aid: {'floor': m['floors'][kf['agv_floor'][i]], 'x': int(kf['agv_x'][i]), 'y': int(kf['agv_y'][i]),
+                      'visible': bool(kf['agv_flags'][i] & AGV_FLAG_VISIBLE), 'loaded': bool(kf['agv_flags'][i] & AGV_FLAG_LOADED),
+                      'rescue': bool(kf['agv_flags'][i] & AGV_FLAG_RESCUE), 'color': m['agv_colors'][kf['agv_color'][i]]}
+                for i, aid in enumerate(m['agv_ids'])}
+        return {'shelves': {f: unpack_shelves(kf['shelves'][i], tuple(m['grid'])) for i, f in enumerate(m['shelf_floors'])},
+                'agvs': agvs,
+                'stations': {sid: meta['t'][kf['station_text'][i]] for i, sid in enumerate(m['station_ids'])}}
+
+    def chunks_in_range(self, t0, t1):
+        """與 [t0, t1] 有交集的 chunk 索引 (以事件起始時間分區)"""
+        return range(self.chunk_index(t0), self.chunk_index(t1) + 1)
+
+    def _frame(self, k, rows=None):
+        """chunk k 的事件 (可只取部分列) -> DataFrame (欄位同 EVENT_COLUMNS，時間為 epoch 秒)"""
+        m = self.manifest
+        cols, texts = self.read_chunk(k)
+        if rows is None: rows = slice(None)
+        base = m['base_time']
+        return pd.DataFrame({
+            'start_ts': cols['start'][rows].astype(np.int64) + base,
+            'end_ts': cols['end'][rows].astype(np.int64) + base,
+            'floor': np.asarray(m['floors'], dtype=object)[cols['floor'][rows]],
+            'obj_id': np.asarray(m['objects'], dtype=object)[cols['obj'][rows]],
+            'sx': cols['sx'][rows], 'sy': cols['sy'][rows], 'ex': cols['ex'][rows], 'ey': cols['ey'][rows],
+            'type': np.asarray(m['types'], dtype=object)[cols['type'][rows]],
+            'text': np.asarray(texts, dtype=object)[cols['text'][rows]],
+        }, columns=EVENT_COLUMNS)
+
+    def _object_rows(self, k, obj_id):
+        # 物件索引：chunk k 中屬於 obj_id 的列 (依時間順序)；沒有索引檔時退回整段篩選
+        code = self._obj_code.get(obj_id)
+        if code is None: return np.array([], dtype=np.int64)
+        if self._offsets is None:
+            return np.flatnonzero(self.read_chunk(k)[0]['obj'] == code)
+        lo, hi = int(self._offsets[k, code]), int(self._offsets[k, code + 1])
+        i0 = self.chunks[k]['i0']
+        return np.asarray(self._perm[i0 + lo:i0 + hi], dtype=np.int64)
+
+    def query(self, t0, t1, floor=None, obj_id=None, types=None, limit=None):
+        """
+        與時間區間 [t0, t1] 重疊的事件 (start <= t1 且 end >= t0)
+        floor / obj_id / types 為選用篩選；limit 為回傳筆數上限
+        回傳 (DataFrame, 是否因 limit 截斷)
+        """
+        t0, t1 = int(t0), int(t1)
+        frames, total = [], 0
+        first = self.chunk_index(t0 - self.manifest.get('max_duration', 0))
+        for k in range(first, self.chunk_index(t1) + 1):
+            if obj_id is not None:
+                rows = self._object_rows(k, obj_id)
+                if not len(rows): continue
+                df = self._frame(k, rows)
+            else:
+                df = self._frame(k)
+            mask = (df['start_ts'] <= t1) & (df['end_ts'] >= t0)
+            if floor is not None: mask &= df['floor'] == floor
+            if types is not None: mask &= df['type'].isin(types)
+            df = df[mask]
+            if df.empty: continue
+            frames.append(df)
+            total += len(df)
+            if limit is not None and total > limit: break
+        out = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=EVENT_COLUMNS)
+        truncated = limit is not None and len(out) > limit
+        return (out.iloc[:limit] if truncated else out), truncated
+
+    def trajectory(self, agv_id, t0=None, t1=None, limit=None):
+        """單一 AGV 的事件軌跡 (只讀該 AGV 出現的 chunk 列)"""
+        m = self.manifest
+        return self.query(m['min_time'] if t0 is None else t0, m['max_time'] if t1 is None else t1,
+                          obj_id=agv_id, limit=limit)
+
+    def station_timeline(self, station_id, t0=None, t1=None, limit=None):
+        """單一工作站的 STATION_STATUS 時間軸"""
+        m = self.manifest
+        return self.query(m['min_time'] if t0 is None else t0, m['max_time'] if t1 is None else t1,
+                          obj_id=station_id, types=['STATION_STATUS'], limit=limit)
+
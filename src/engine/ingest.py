@@ -0,0 +1,176 @@
+import pandas as pd
+import numpy as np
+import os
+import hashlib
+import pickle
+
+# ==========================================
+# 統一資料匯入層
+# 1. 編碼偵測：只讀檔頭一段位元組判斷一次，不再整檔重讀多次
+# 2. 宣告式 schema：欄位型別集中定義 (FRCD / PARTCUSTID / ROUTECD 為 category)
+# 3. 快取：以檔案內容 sha1 為 key，將型別化後的 DataFrame 存成二進位檔
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TRX_DIR = os.path.join(BASE_DIR, 'data', 'transaction')
+CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'ingest')
+
+ENCODINGS = ['utf-8', 'cp950', 'big5', 'gbk']
+SAMPLE_BYTES = 256 * 1024
+# schema 或解析邏輯變更時遞增，使舊快取失效
+SCHEMA_VERSION = 2
+
+# 欄位型別: category (去空白後轉類別) / str (去空白) / num (數值，整數欄維持 int) / int (固定 nullable Int64) / datetime
+# derived: 由多個欄位組合出的時間欄 (新增在最後一欄，與舊流程一致)
+SCHEMAS = {
+    'historical_orders': {
+        'file': os.path.join(TRX_DIR, 'historical_orders_ex.csv'),
+        'columns': {'FRCD': 'category', 'PARTNO': 'str', 'ROUTECD': 'category', 'PARTCUSTID': 'category',
+                    'QTY': 'int', 'DATE': 'str', 'TIME': 'str'}, # QTY 型別固定，串流模式各批寫出的格式才會一致
+        'derived': {'datetime': ('DATE', 'TIME')},
+    },
+    'wave_orders': {
+        'file': os.path.join(TRX_DIR, 'wave_orders.csv'),
+        'columns': {'FRCD': 'category', 'PARTNO': 'str', 'ROUTECD': 'category', 'PARTCUSTID': 'category',
+                    'QTY': 'num', 'DATE': 'str', 'TIME': 'str', 'datetime': 'datetime',
+                    'WAVE_ID': 'category', 'WAVE_DEADLINE': 'datetime', 'IS_ROLLOVER': 'num'},
+    },
+    'receiving': {
+        'file': os.path.join(TRX_DIR, 'historical_receiving_ex.csv'),
+        'columns': {'FRCD': 'category', 'PARTNO': 'str', 'QTY': 'num', 'DATE': 'str', 'TIME': 'str'},
+        'derived': {'datetime': ('DATE', 'TIME')},
+    },
+}
+
+
+def sniff_encoding(path, sample_bytes=SAMPLE_BYTES):
+    """
+    讀取檔頭 sample_bytes 判斷編碼：有 UTF-8 BOM 直接判定；否則依序試解碼
+    (樣本截到最後一個換行，避免多位元組字元被切半誤判)
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+        at_eof = not f.read(1)
+
+    if sample.startswith(b'\xef\xbb\xbf'): return 'utf-8-sig'
+    if not at_eof and b'\n' in sample:
+        sample = sample[:sample.rindex(b'\n') + 1]
+
+    for enc in ENCODINGS:
+        try:
+            sample.decode(enc)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"無法判斷檔案編碼 {os.path.basename(path)}")
+
+
+def read_csv(path, encoding=None, **kwargs):
+    """
+    以偵測到的編碼讀取 CSV；若檔頭樣本是純 ASCII 而後段才出現中文，
+    第一次解碼失敗時才退回其餘候選編碼 (一般情況只讀一次)
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"找不到檔案: {path}")
+    enc = encoding or sniff_encoding(path)
+    candidates = [enc] + [e for e in ENCODINGS if e != enc and not (enc == 'utf-8-sig' and e == 'utf-8')]
+    for e in candidates:
+        try:
+            return pd.read_csv(path, encoding=e, **kwargs)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"無法讀取檔案 {os.path.basename(path)}，請確認編碼")
+
+
+def _clean_columns(df):
+    # 去除欄名空白與殘留 BOM
+    df.columns = [str(c).replace('﻿', '').strip() for c in df.columns]
+    return df
+
+
+def _parse_datetime(values, fmt):
+    """先以固定格式快速解析，失敗的少數值再交給 pandas 自動推斷 (語意同舊版 errors='coerce')"""
+    out = pd.to_datetime(values, format=fmt, errors='coerce')
+    retry = out.isna() & values.notna()
+    if retry.any():
+        out[retry] = pd.to_datetime(values[retry], errors='coerce')
+    return out
+
+
+def apply_schema(df, name):
+    """依 schema 轉型 (串流模式可對每個 chunk 個別套用)；原始欄位以 str 讀入"""
+    schema = SCHEMAS[name]
+    df = _clean_columns(df)
+    for col, kind in schema['columns'].items():
+        if col not in df.columns: continue
+        s = df[col]
+        if kind == 'category':
+            df[col] = s.str.strip().astype('category')
+        elif kind == 'str':
+            df[col] = s.str.strip()
+        elif kind == 'num':
+            num = pd.to_numeric(s, errors='coerce')
+            # 皆為整數時維持整數 (有空值時用 nullable Int64，避免 216 被寫回成 216.0)
+            if (num.dropna() % 1 == 0).all():
+                num = num.astype(np.int64) if num.notna().all() else num.astype('Int64')
+            df[col] = num
+        elif kind == 'int':
+            # 型別不隨資料 (或 chunk) 內容變動；非整數視同無效值 (與 errors='coerce' 相同處理)
+            num = pd.to_numeric(s, errors='coerce')
+            bad = num.notna() & (num % 1 != 0)
+            if bad.any():
+                print(f"⚠️ [Ingest] {col} 有 {int(bad.sum())} 筆非整數，視為空值")
+                num = num.mask(bad)
+            df[col] = num.astype('Int64')
+        elif kind == 'datetime':
+            df[col] = _parse_datetime(s, '%Y-%m-%d %H:%M:%S')
+    for col, (date_col, time_col) in schema.get('derived', {}).items():
+        if date_col in df.columns and time_col in df.columns:
+            df[col] = _parse_datetime(df[date_col] + ' ' + df[time_col], '%Y/%m/%d %H:%M:%S')
+    return df
+
+
+def file_sha1(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block: break
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_table(name, path=None, use_cache=True):
+    """
+    讀取交易資料表 (已套用 schema)
+    name: SCHEMAS 的 key；path 省略時使用 schema 預設檔案
+    快取檔: cache/ingest/{name}_{sha1}.pkl，檔案內容不變時直接載入型別化結果
+    """
+    path = path or SCHEMAS[name]['file']
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"找不到檔案: {path}")
+
+    cache_path = None
+    if use_cache:
+        digest = hashlib.sha1(f"{SCHEMA_VERSION}:{name}:{file_sha1(path)}".encode()).hexdigest()
+        cache_path = os.path.join(CACHE_DIR, f"{name}_{digest[:16]}.pkl")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f: return pickle.load(f)
+            except Exception:
+                pass # 快取損毀時重新解析
+
+    df = apply_schema(read_csv(path, dtype=str, low_memory=False), name)
+
+    if cache_path:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # 同名表只保留最新一份快取
+            for fn in os.listdir(CACHE_DIR):
+                if fn.startswith(f"{name}_") and fn.endswith('.pkl'): os.remove(os.path.join(CACHE_DIR, fn))
+            tmp = cache_path + '.tmp'
+            with open(tmp, 'wb') as f: pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            print(f"⚠️ 無法寫入匯入快取: {e}")
+    return df
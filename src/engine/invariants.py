@@ -0,0 +1,133 @@
+import numpy as np
+from collections import defaultdict, Counter
+
+# ==========================================
+# 模擬中的線上不變量檢查 (step4 runner 可選)
+# 取代「跑完後掃整份 simulation_events.csv」才發現碰撞 / 穿牆 / 瞬移：
+#   write_move / write_move_events -> on_path   每一步 O(1)：出界、牆、非相鄰步、同格 (vertex)、對穿 (edge)
+#   _lock_spot                     -> on_lock   預約鎖定的每一秒：與他車實際路徑或預約重疊 (lock)
+#   SHELF_LOAD / SHELF_UNLOAD      -> on_shelf  從空格取料架 (phantom) / 卸到已有料架的格子 (double)
+# 佔用索引以 {floor: {t: {pos: agv}}} 保存，prune() 丟掉所有 AGV 都已走過的時間
+# strict 模式在第一個違規時丟出 InvariantViolation 中止模擬
+# 座標慣例同 runner：pos = (row, col)
+# ==========================================
+
+KINDS = ('bounds', 'wall', 'jump', 'vertex', 'edge', 'lock', 'shelf_phantom', 'shelf_double')
+# 預約重疊只代表規劃時違反了預約表 (例如 A* 只看 60 秒內的預約)，不一定是實體碰撞，strict 預設不中止
+STRICT_KINDS = ('bounds', 'wall', 'jump', 'vertex', 'edge', 'shelf_phantom', 'shelf_double')
+SAMPLE_LIMIT = 20
+
+
+class InvariantViolation(RuntimeError):
+    def __init__(self, record):
+        super().__init__(f"[{record['kind']}] {record}")
+        self.record = record
+
+
+class InvariantMonitor:
+    def __init__(self, grids, shelf_occupancy=None, strict=False, sample_limit=SAMPLE_LIMIT):
+        """
+        grids: {floor: 2D grid (-1 = 牆)}；shelf_occupancy: runner 的 {floor: set(pos)} (直接引用，不複製)
+        strict: True = STRICT_KINDS 任一違規即中止；也可傳入 kind 的集合
+        """
+        self.shape = {f: np.asarray(g).shape[:2] for f, g in grids.items()}
+        self.walls = {}
+        for f, g in grids.items():
+            rr, cc = np.nonzero(np.asarray(g) == -1)
+            self.walls[f] = set(zip(rr.tolist(), cc.tolist()))
+        self.shelves = shelf_occupancy if shelf_occupancy is not None else {}
+        self.strict = set(STRICT_KINDS if strict is True else (strict or ()))
+        self.sample_limit = sample_limit
+        self.occ = {f: defaultdict(dict) for f in grids}   # t -> {pos: agv} (實際路徑)
+        self.locks = {f: defaultdict(dict) for f in grids} # t -> {pos: agv} (預約鎖定)
+        self.edges = {f: defaultdict(dict) for f in grids} # t -> {(from, to): agv}
+        self.counts = Counter()
+        self.samples = []
+        self.steps = 0
+        self.on_stop = None # strict 中止前呼叫 (例如 flush 事件檔)
+
+    def _flag(self, kind, floor, t, agv, pos, **detail):
+        self.counts[kind] += 1
+        rec = dict(kind=kind, floor=floor, t=int(t), agv=str(agv), pos=tuple(pos), **detail)
+        if len(self.samples) < self.sample_limit: self.samples.append(rec)
+        if kind in self.strict:
+            if self.on_stop: self.on_stop()
+            raise InvariantViolation(rec)
+
+    def _cell_ok(self, floor, agv, pos, t):
+        rows, cols = self.shape[floor]
+        if not (0 <= pos[0] < rows and 0 <= pos[1] < cols):
+            self._flag('bounds', floor, t, agv, pos); return False
+        if pos in self.walls[floor]:
+            self._flag('wall', floor, t, agv, pos); return False
+        return True
+
+    def on_path(self, floor, agv, path):
+        """path: [(pos, t), ...]；每一步檢查格子合法性、相鄰性、同格與對穿"""
+        if floor not in self.shape or not path: return
+        agv = str(agv)
+        occ = self.occ[floor]; locks = self.locks[floor]; edges = self.edges[floor]
+        prev = None
+        for pos, t in path:
+            self.steps += 1
+            if self._cell_ok(floor, agv, pos, t):
+                if prev is not None:
+                    p_pos, p_t = prev
+                    if abs(pos[0] - p_pos[0]) + abs(pos[1] - p_pos[1]) > 1 or t - p_t < 1:
+                        self._flag('jump', floor, t, agv, pos, prev=tuple(p_pos), prev_t=int(p_t))
+                    elif pos != p_pos:
+                        step_edges = edges[p_t]
+                        other = step_edges.get((pos, p_pos))
+                        if other is not None and other != agv:
+                            self._flag('edge', floor, t, agv, pos, other=other, prev=tuple(p_pos))
+                        step_edges[(p_pos, pos)] = agv
+                cell = occ[t]
+                other = cell.setdefault(pos, agv)
+                if other != agv:
+                    self._flag('vertex', floor, t, agv, pos, other=other)
+                else:
+                    other = locks[t].get(pos) if t in locks else None
+                    if other is not None and other != agv: self._flag('lock', floor, t, agv, pos, other=other)
+            prev = (pos, t)
+
+    def on_lock(self, floor, agv, pos, start_t, end_t):
+        """預約鎖定 [start_t, end_t) 每一秒"""
+        if floor not in self.shape: return
+        agv = '?' if agv is None else str(agv)
+        if not self._cell_ok(floor, agv, pos, start_t): return
+        occ = self.occ[floor]; locks = self.locks[floor]
+        for t in range(int(start_t), int(end_t)):
+            self.steps += 1
+            other = locks[t].setdefault(pos, agv)
+            if other == agv and t in occ: other = occ[t].get(pos, agv)
+            if other != agv and agv != '?' and other != '?':
+                self._flag('lock', floor, t, agv, pos, other=other)
+
+    def on_shelf(self, floor, agv, pos, t, load):
+        """SHELF_LOAD (load=True) / SHELF_UNLOAD 前呼叫：以 runner 目前的料架佔用判斷"""
+        if floor not in self.shape or not self._cell_ok(floor, agv, pos, t): return
+        occupied = pos in self.shelves.get(floor, ())
+        if load and not occupied: self._flag('shelf_phantom', floor, t, agv, pos)
+        elif not load and occupied: self._flag('shelf_double', floor, t, agv, pos)
+
+    def prune(self, floor, before_t):
+        """丟掉 before_t 之前的索引 (所有 AGV 都已不會再寫入的時間)"""
+        for table in (self.occ, self.locks, self.edges):
+            tab = table.get(floor)
+            if not tab: continue
+            for t in [t for t in tab if t < before_t]: del tab[t]
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def summary_line(self, top=3):
+        if not self.counts: return "✅ 0"
+        return " | ".join(f"{k}:{v}" for k, v in self.counts.most_common(top))
+
+    def report(self):
+        return {'steps': self.steps, 'counts': {k: self.counts.get(k, 0) for k in KINDS}, 'samples': self.samples}
+
+    def print_report(self):
+        print(f"🛡️ 不變量檢查: {self.steps} 步, 違規 {self.total()}  ({self.summary_line(len(KINDS))})")
+        for rec in self.samples[:5]:
+            print(f"      {rec}")
@@ -0,0 +1,108 @@
+import numpy as np
+
+from engine.agv_index import bfs_distance_map, UNREACHABLE
+
+# ==========================================
+# 庫存儲位索引 (part -> cells -> 料架座標)
+# 取代補 LOC 時一律拿 inventory_map[part][0]：同一料號放在多個料架 / 樓層時，
+# 選「料架到指定工作站 BFS 步數最短」的儲位
+#   _table(part)   料號的所有 cell x 所有工作站 步數矩陣 (跨樓層 = UNREACHABLE)，依料號快取
+#   choose()       單筆；station 可為 站 id / {floor: 站 id} / None (最近的任一站)
+#   choose_many()  批次：相同 (料號, 目標站) 只算一次，供預處理整批補 LOC
+# cell -> 料架 id 取自座標表的 cell_id / shelf_id 對應 (step1 產出)，不用字串前綴猜；
+# 座標取自目前的 shelf_coords，料架被搬動後呼叫 invalidate()。
+# 全部不可達或無座標時退回檔案中的第一個儲位 (與舊版相同)；庫存儲位完全對不到料架座標時印出警告
+# ==========================================
+
+LOW_RESOLUTION = 0.5 # 可解析比例低於此值時警告
+
+
+class InventoryIndex:
+    def __init__(self, inventory_map, shelf_coords, grids, stations, cell_shelf=None):
+        """
+        inventory_map: {part: [cell, ...]}；grids: {floor: grid}
+        stations: {station_id: {'floor', 'pos'}}
+        cell_shelf: {cell_id: shelf_id} (loaders.load_cell_shelf_map)
+        """
+        self.inventory = inventory_map
+        self.shelf_coords = shelf_coords
+        self.cell_shelf = cell_shelf or {}
+        self.grids = grids
+        self.station_ids = list(stations.keys())
+        self.st_col = {s: j for j, s in enumerate(self.station_ids)}
+        self.st_floor = [stations[s]['floor'] for s in self.station_ids]
+        self.st_pos = [stations[s]['pos'] for s in self.station_ids]
+        self._dmaps = {}
+        self._tables = {}  # part -> 步數矩陣 [n_cells, n_stations]
+        self._choice = {}  # (part, cols) -> cell
+        self.check()
+
+    def _shelf_info(self, cell):
+        info = self.shelf_coords.get(self.cell_shelf.get(cell))
+        return info if info and info.get('pos') is not None else None
+
+    def resolution(self):
+        """(可對到料架座標的庫存儲位數, 庫存儲位總數)"""
+        cells = {c for cs in self.inventory.values() for c in cs}
+        return sum(1 for c in cells if self._shelf_info(c) is not None), len(cells)
+
+    def check(self):
+        hit, total = self.resolution()
+        if not total: return hit, total
+        rate = hit / total
+        if hit == 0:
+            print(f"🚨 [InventoryIndex] {total} 個庫存儲位沒有任何一個對得到料架座標 (cell -> shelf 對應 {len(self.cell_shelf)} 筆)！"
+                  f" 最近儲位選擇失效，一律退回第一個儲位；請用 step1 重建含 cell_id 的 shelf_coordinate_map.csv")
+        elif rate < LOW_RESOLUTION:
+            print(f"⚠️ [InventoryIndex] 只有 {hit}/{total} ({rate:.1%}) 個庫存儲位對得到料架座標")
+        return hit, total
+
+    def _dmap(self, j):
+        dist = self._dmaps.get(j)
+        if dist is None: dist = self._dmaps[j] = bfs_distance_map(self.grids[self.st_floor[j]], self.st_pos[j])
+        return dist
+
+    def _table(self, part):
+        table = self._tables.get(part)
+        if table is not None: return table
+        cells = self.inventory.get(part) or []
+        table = np.full((len(cells), len(self.station_ids)), UNREACHABLE, dtype=np.int64)
+        for i, cell in enumerate(cells):
+            info = self._shelf_info(cell)
+            if info is None: continue
+            r, c = int(info['pos'][0]), int(info['pos'][1])
+            for j, fl in enumerate(self.st_floor):
+                if fl != info.get('floor') or fl not in self.grids: continue
+                dist = self._dmap(j)
+                if 0 <= r < dist.shape[0] and 0 <= c < dist.shape[1]: table[i, j] = dist[r, c]
+        self._tables[part] = table
+        return table
+
+    def _cols(self, station):
+        if station is None: return tuple(range(len(self.station_ids)))
+        if isinstance(station, dict): return tuple(sorted(self.st_col[s] for s in station.values() if s in self.st_col))
+        return (self.st_col[station],) if station in self.st_col else ()
+
+    def choose(self, part, station=None):
+        """回傳最佳 cell (料號無庫存則 None)"""
+        cols = self._cols(station)
+        key = (part, cols)
+        if key in self._choice: return self._choice[key]
+        cells = self.inventory.get(part) or []
+        if not cells:
+            best = None
+        else:
+            table = self._table(part)
+            d = table[:, list(cols)].min(axis=1) if cols else np.full(len(cells), UNREACHABLE)
+            best = cells[int(np.argmin(d))] # 同分取檔案中較前者；全不可達時即第一個
+        self._choice[key] = best
+        return best
+
+    def choose_many(self, parts, stations=None):
+        """parts 與 stations 等長 (stations=None 表示全部找最近的任一站)，回傳 cell list"""
+        if stations is None: stations = [None] * len(parts)
+        return [self.choose(p, s) for p, s in zip(parts, stations)]
+
+    def invalidate(self):
+        """料架座標改變後清除快取"""
+        self._tables.clear(); self._choice.clear()
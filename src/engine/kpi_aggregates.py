@@ -0,0 +1,151 @@
+import pandas as pd
+import numpy as np
+
+# ==========================================
+# dashboard 面板用的 KPI 時間分桶彙總 (離線向量化計算)
+# 以固定時間桶 (預設 1 分鐘) 為軸，前端以 floor((t - t0) / step) 直接取值，
+# 每格更新不再掃描 KPI / 事件陣列。
+#
+# 數值定義 (edge[m] = t0 + m * step)：
+#   done / delayed / recv_today : 完成時間 <= edge[m] 的累計筆數
+#   waves.cum                   : 各波次在 [m0, m0 + len) 區間的累計完成數 (之後維持最後值)
+#   active_waves                : 第 m 桶進行中的波次 (CSR: ids[off[m]:off[m+1]])
+#   station_busy / floor_busy   : [edge[m], edge[m] + step) 內工作站非 WHITE 狀態的時間比例 (%)
+#   active_agv                  : [edge[m], edge[m] + step) 內有非 PARKING 事件的 AGV 數
+# ==========================================
+
+BUCKET_SEC = 60
+IDLE_COLOR = 'WHITE'
+
+
+def load_kpi(path):
+    """simulation_kpi.csv -> DataFrame (finish_ts 為 epoch 秒，依完成時間排序)"""
+    df = pd.read_csv(path, on_bad_lines='skip', engine='python')
+    df['finish_ts'] = pd.to_datetime(df['finish_time'], errors='coerce')
+    df = df.dropna(subset=['finish_ts'])
+    df['finish_ts'] = df['finish_ts'].astype('datetime64[s]').astype('int64')
+    df['wave_id'] = df['wave_id'].astype(str)
+    df['total_in_wave'] = pd.to_numeric(df['total_in_wave'], errors='coerce').fillna(0).astype(np.int64)
+    return df.sort_values('finish_ts', kind='stable').reset_index(drop=True)
+
+
+def bucket_edges(t_start, t_end, step=BUCKET_SEC):
+    t0 = int(t_start) - int(t_start) % step
+    return t0 + step * np.arange((int(t_end) - t0) // step + 1, dtype=np.int64)
+
+
+def _cum_at(sorted_ts, edges):
+    # 每個桶邊界之前 (含) 的累計筆數
+    return np.searchsorted(sorted_ts, edges, side='right').astype(np.int64)
+
+
+def _wave_progress(df_out, edges):
+    """各波次累計完成曲線 (只保留首筆到末筆完成之間) 與每桶進行中的波次 (CSR)"""
+    n = len(edges)
+    if df_out.empty:
+        return {'ids': [], 'total': [], 'm0': [], 'cum': []}, {'off': [0] * (n + 1), 'ids': []}
+
+    totals = df_out.groupby('wave_id', sort=True)['total_in_wave'].max()
+    groups = df_out.groupby('wave_id', sort=True)['finish_ts']
+    ids, m0s, cums, spans = [], [], [], []
+    for w, (wid, fin) in enumerate(groups):
+        f = np.sort(fin.to_numpy())
+        a = min(int(np.searchsorted(edges, f[0], side='left')), n - 1)
+        b = min(int(np.searchsorted(edges, f[-1], side='left')), n - 1)
+        cum = np.searchsorted(f, edges[a:b + 1], side='right')
+        ids.append(wid)
+        m0s.append(a)
+        cums.append(cum.tolist())
+        # 完成數達到總數後即不再列為進行中；未完成的波次持續到最後
+        end = b if cum[-1] >= totals[wid] else n - 1
+        spans.append((a, end))
+
+    starts = np.array([s[0] for s in spans], dtype=np.int64)
+    lens = np.array([s[1] - s[0] + 1 for s in spans], dtype=np.int64)
+    wave_idx = np.repeat(np.arange(len(spans)), lens)
+    minute = np.repeat(starts, lens) + (np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens))
+    order = np.lexsort((wave_idx, minute))
+    off = np.searchsorted(minute[order], np.arange(n + 1), side='left')
+    waves = {'ids': ids, 'total': [int(totals[w]) for w in ids], 'm0': m0s, 'cum': cums}
+    return waves, {'off': off.tolist(), 'ids': wave_idx[order].tolist()}
+
+
+def _busy_seconds(starts, ends, t):
+    """區間聯集未合併時的累計佔用秒數 B(t) = sum(clip(t - s, 0, e - s))，以前綴和向量化"""
+    s = np.sort(starts); e = np.sort(ends)
+    cs = np.r_[0, np.cumsum(s)]; ce = np.r_[0, np.cumsum(e)]
+    ks = np.searchsorted(s, t, side='left'); ke = np.searchsorted(e, t, side='left')
+    return (t * ks - cs[ks]) - (t * ke - ce[ke])
+
+
+def _station_busy(df_events, station_ids, edges, step):
+    sub = df_events[df_events['type'] == 'STATION_STATUS']
+    color = sub['text'].astype(str).str.split('|').str[0]
+    sub = sub[(color != IDLE_COLOR) & (color != '')]
+    groups = sub.groupby('obj_id', sort=False).indices
+    ts = sub['start_ts'].to_numpy(np.int64)
+    te = sub['end_ts'].to_numpy(np.int64)
+    out = np.zeros((len(station_ids), len(edges)), dtype=np.int64)
+    bounds = np.r_[edges, edges[-1] + step]
+    for i, sid in enumerate(station_ids):
+        rows = groups.get(sid)
+        if rows is None: continue
+        b = _busy_seconds(ts[rows], np.maximum(te[rows], ts[rows]), bounds)
+        out[i] = np.clip(np.rint(np.diff(b) * 100 / step), 0, 100)
+    return out
+
+
+def _active_agvs(df_events, edges, step):
+    sub = df_events[df_events['obj_id'].astype(str).str.startswith('AGV') & (df_events['type'] != 'PARKING')]
+    n = len(edges)
+    if sub.empty: return np.zeros(n, dtype=np.int64)
+    codes, uniq = pd.factorize(sub['obj_id'])
+    s = sub['start_ts'].to_numpy(np.int64)
+    e = np.maximum(sub['end_ts'].to_numpy(np.int64) - 1, s)
+    a = np.clip((s - edges[0]) // step, 0, n)
+    b = np.clip((e - edges[0]) // step, -1, n - 1)
+    keep = b >= a
+    # 每台 AGV 一列差分陣列，累加後 > 0 代表該桶有活動
+    diff = np.zeros((len(uniq), n + 1), dtype=np.int64)
+    np.add.at(diff, (codes[keep], a[keep]), 1)
+    np.add.at(diff, (codes[keep], b[keep] + 1), -1)
+    return (np.cumsum(diff, axis=1)[:, :n] > 0).sum(axis=0)
+
+
+def build_kpi_aggregates(df_kpi, df_events, station_ids, t_start, t_end, step=BUCKET_SEC):
+    """
+    df_kpi: load_kpi 的結果 (可為 None)；df_events: event_store.load_events 的結果
+    回傳可直接 json.dumps 的 dict (皆為整數陣列)
+    """
+    edges = bucket_edges(t_start, t_end, step)
+    if df_kpi is None: df_kpi = pd.DataFrame(columns=['finish_ts', 'type', 'wave_id', 'is_delayed', 'total_in_wave'])
+    fin = df_kpi['finish_ts'].to_numpy(np.int64)
+    is_recv = (df_kpi['type'] == 'RECEIVING').to_numpy()
+    is_late = (df_kpi['is_delayed'] == 'Y').to_numpy()
+
+    # 進貨：當日累計 = 累計至邊界 - 累計至當日 00:00 之前
+    f_recv = fin[is_recv]
+    day_start = edges - edges % 86400
+    recv_today = _cum_at(f_recv, edges) - np.searchsorted(f_recv, day_start, side='left')
+    recv_day_total = np.searchsorted(f_recv, day_start + 86400, side='left') - np.searchsorted(f_recv, day_start, side='left')
+
+    waves, active = _wave_progress(df_kpi[~is_recv], edges)
+    busy = _station_busy(df_events, station_ids, edges, step)
+    floors = sorted({sid.split('_')[1] for sid in station_ids if sid.count('_') >= 2})
+    floor_busy = {f: np.rint(busy[[i for i, sid in enumerate(station_ids) if sid.split('_')[1:2] == [f]]].mean(axis=0)).astype(np.int64).tolist()
+                  for f in floors}
+
+    return {
+        't0': int(edges[0]),
+        'step': step,
+        'n': int(len(edges)),
+        'done': _cum_at(fin, edges).tolist(),
+        'delayed': _cum_at(fin[is_late], edges).tolist(),
+        'recv_today': recv_today.tolist(),
+        'recv_day_total': recv_day_total.tolist(),
+        'waves': waves,
+        'active_waves': active,
+        'station_busy': busy.tolist(),
+        'floor_busy': floor_busy,
+        'active_agv': _active_agvs(df_events, edges, step).tolist(),
+    }
@@ -0,0 +1,220 @@
+import pandas as pd
+import numpy as np
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from engine import ingest
+
+# ---------------- 共用資料載入 (向量化) ----------------
+# 取代各步驟中以 iterrows 逐列組 dict 的寫法：
+# 先用 drop_duplicates / groupby 在欄位層級收斂，再以 zip 一次建出 dict。
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SHELF_MAP_PATH = os.path.join(BASE_DIR, 'data', 'mapping', 'shelf_coordinate_map.csv')
+INVENTORY_PATH = os.path.join(BASE_DIR, 'data', 'master', 'item_inventory.csv')
+PARAMS_PATH = os.path.join(BASE_DIR, 'data', 'master', 'system_parameters.csv')
+ROUTE_SCHEDULE_PATH = os.path.join(BASE_DIR, 'data', 'master', 'route_schedule_master.csv')
+MAP_DIR = os.path.join(BASE_DIR, 'data', 'master')
+
+
+def _read_csv(path, **kwargs):
+    # 編碼由 engine/ingest 從檔頭樣本判斷一次
+    return ingest.read_csv(path, **kwargs)
+
+
+def _upper_columns(df):
+    df.columns = [str(c).upper().strip() for c in df.columns]
+    return df
+
+
+def load_shelf_coords(path=SHELF_MAP_PATH, pos_order='rc', keep='last'):
+    """
+    料架座標表 -> {shelf_id: {'floor': '2F', 'pos': (...)}}
+    pos_order: 'rc' = (row=y, col=x)；'xy' = (x, y)
+    keep: 同一個 shelf_id 出現多次時，保留 'first' 或 'last' (與舊版 dict 覆蓋語意相同)
+    """
+    if not os.path.exists(path): return {}
+    df = _upper_columns(_read_csv(path))
+
+    # 嘗試找正確的欄位名 (相容不同命名習慣)
+    col_shelf = next((c for c in df.columns if 'SHELF' in c), 'SHELF_ID')
+    col_floor = next((c for c in df.columns if 'FLOOR' in c), 'FLOOR')
+    if not {col_shelf, col_floor, 'X', 'Y'} <= set(df.columns): return {}
+
+    df = df.dropna(subset=[col_shelf, 'X', 'Y'])
+    sids = df[col_shelf].astype(str)
+    df = df.assign(_sid=sids).drop_duplicates(subset='_sid', keep=keep)
+    xs = df['X'].to_numpy().astype(np.int64).tolist()
+    ys = df['Y'].to_numpy().astype(np.int64).tolist()
+    a, b = (ys, xs) if pos_order == 'rc' else (xs, ys)
+    return {sid: {'floor': fl, 'pos': (p, q)}
+            for sid, fl, p, q in zip(df['_sid'].tolist(), df[col_floor].tolist(), a, b)}
+
+
+def load_cell_shelf_map(path=SHELF_MAP_PATH):
+    """
+    料架座標表 -> {cell_id: shelf_id} (step1 產出的 cell_id 欄)
+    座標表沒有 cell_id 欄 (例如 repair_step1_mapping 產生的 Shelf_N 表) 時回傳空 dict
+    """
+    if not os.path.exists(path): return {}
+    df = _upper_columns(_read_csv(path, dtype=str))
+    col_cell = next((c for c in df.columns if 'CELL' in c), None)
+    col_shelf = next((c for c in df.columns if 'SHELF' in c), None)
+    if col_cell is None or col_shelf is None: return {}
+    df = df.dropna(subset=[col_cell, col_shelf])
+    return dict(zip(df[col_cell].str.strip().tolist(), df[col_shelf].str.strip().tolist()))
+
+
+def load_shelf_cells(path=SHELF_MAP_PATH, rows_limit=32, cols_limit=61, floors=('2F', '3F')):
+    """料架座標表 -> {floor: {(x, y), ...}} (僅保留地圖範圍內的格子，供視覺化使用)"""
+    shelf_set = {f: set() for f in floors}
+    if not os.path.exists(path): return shelf_set
+    df = _read_csv(path, usecols=lambda c: str(c).strip().lower() in ('floor', 'x', 'y'))
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    df = df.dropna(subset=['x', 'y'])
+    df = df[(df['x'] >= 0) & (df['x'] < cols_limit) & (df['y'] >= 0) & (df['y'] < rows_limit)]
+    df = df.assign(x=df['x'].astype(np.int64), y=df['y'].astype(np.int64)).drop_duplicates()
+    for floor, g in df.groupby('floor', sort=False):
+        if floor in shelf_set:
+            shelf_set[floor] = set(zip(g['x'].tolist(), g['y'].tolist()))
+    return shelf_set
+
+
+def load_inventory(path=INVENTORY_PATH, verbose=False):
+    """庫存表 -> defaultdict(list): {part_no: [cell, ...]} (保留檔案中的儲位順序)"""
+    inv = defaultdict(list)
+    if not os.path.exists(path): return inv
+    df = _upper_columns(_read_csv(path, dtype=str))
+    cols = df.columns
+    part_col = next((c for c in cols if 'PART' in c), None)
+    cell_col = next((c for c in cols if 'CELL' in c or 'LOC' in c), None)
+    if not (part_col and cell_col):
+        print(f"⚠️ Inventory 欄位對應失敗。現有欄位: {list(cols)}")
+        return inv
+    if verbose: print(f"   -> Inventory 欄位對應: Part='{part_col}', Loc='{cell_col}'")
+
+    df = df[[part_col, cell_col]].dropna()
+    parts = df[part_col].str.strip()
+    cells = df[cell_col].str.strip()
+    grouped = cells.groupby(parts, sort=False).agg(list)
+    inv.update(zip(grouped.index.tolist(), grouped.tolist()))
+    return inv
+
+
+def load_map_grid(filename, rows=32, cols=61, map_dir=MAP_DIR):
+    """地圖 (xlsx，找不到時改讀同名 csv) -> (rows, cols) float 陣列；空值為 0，超出原圖範圍補 -1 (牆)"""
+    path = os.path.join(map_dir, filename)
+    if not os.path.exists(path): path = path.replace('.xlsx', '.csv')
+    if not os.path.exists(path): return None
+    df = pd.read_excel(path, header=None) if path.endswith('.xlsx') else pd.read_csv(path, header=None)
+    raw = df.iloc[0:rows, 0:cols].fillna(0).to_numpy(dtype=np.float64)
+    grid = np.full((rows, cols), -1.0)
+    grid[:raw.shape[0], :raw.shape[1]] = raw
+    return grid
+
+
+def load_parameters(path=PARAMS_PATH):
+    """
+    系統參數表 -> {parameter_name: value}
+    型別轉換規則同舊版：integer/int -> int (失敗為 0)、float (失敗為 0.0)、空值 -> None、其他保留字串
+    """
+    df = _read_csv(path, dtype=str)
+    names = df['parameter_name'].astype(str).str.strip()
+    vals = df['parameter_value'].fillna('nan').astype(str).str.strip()
+    dtypes = df['data_type'].fillna('nan').astype(str).str.strip().str.lower()
+
+    nums = pd.to_numeric(vals, errors='coerce')
+    is_null = (vals.str.lower() == 'nan') | (vals == '')
+    is_int = dtypes.isin(['integer', 'int'])
+    is_float = dtypes == 'float'
+
+    out = vals.astype(object)
+    out[is_float] = nums[is_float].fillna(0.0).astype(float).tolist()
+    # int(float(x)) 的截斷語意
+    out[is_int] = np.trunc(nums[is_int].fillna(0).astype(float)).astype(np.int64).tolist()
+    out[is_null] = None
+    return dict(zip(names.tolist(), out.tolist()))
+
+
+def parse_time_series(values):
+    """
+    向量化版 parse_time_str：'855' / '08:55' / '08:55:00' -> 當日秒數 (int)，無法解析為 -1
+    """
+    s = pd.Series(values, dtype=object).astype(str).str.strip()
+    secs = pd.Series(-1, index=s.index, dtype=np.int64)
+
+    has_colon = s.str.contains(':', regex=False)
+    digits = ~has_colon & s.str.fullmatch(r'\d+').fillna(False)
+
+    def to_secs(parsed):
+        return (parsed.dt.hour * 3600 + parsed.dt.minute * 60 + parsed.dt.second)
+
+    if has_colon.any():
+        sub = s[has_colon]
+        hms = pd.to_datetime(sub, format='%H:%M:%S', errors='coerce')
+        hm = pd.to_datetime(sub, format='%H:%M', errors='coerce')
+        parsed = hms.fillna(hm)
+        ok = parsed.notna()
+        secs[ok[ok].index] = to_secs(parsed[ok]).astype(np.int64)
+    if digits.any():
+        sub = s[digits].str.zfill(4)
+        parsed = pd.to_datetime(sub, format='%H%M', errors='coerce')
+        ok = parsed.notna()
+        secs[ok[ok].index] = to_secs(parsed[ok]).astype(np.int64)
+    return secs
+
+
+def load_route_schedule_frame(path=ROUTE_SCHEDULE_PATH):
+    """
+    班次表 -> DataFrame[ROUTECD, PARTCUSTID, CUTOFF_SEC] (已清洗、已排序、去除無效時間)
+    """
+    df = _read_csv(path, dtype={'ROUTECD': str, 'PARTCUSTID': str})
+    df['ROUTECD'] = df['ROUTECD'].str.strip()
+    df['PARTCUSTID'] = df['PARTCUSTID'].str.strip()
+    df = df.dropna(subset=['ROUTECD', 'PARTCUSTID', 'ORDERENDTIME'])
+    df = df.assign(CUTOFF_SEC=parse_time_series(df['ORDERENDTIME']).to_numpy())
+    df = df[df['CUTOFF_SEC'] >= 0]
+    return df[['ROUTECD', 'PARTCUSTID', 'CUTOFF_SEC']].sort_values(
+        ['ROUTECD', 'PARTCUSTID', 'CUTOFF_SEC'], kind='stable').reset_index(drop=True)
+
+
+def load_route_schedule(path=ROUTE_SCHEDULE_PATH):
+    """班次表 -> {(ROUTECD, PARTCUSTID): [time, ...]} (每組已排序)"""
+    df = load_route_schedule_frame(path)
+    times = [datetime.min.replace(hour=s // 3600, minute=(s % 3600) // 60, second=s % 60).time()
+             for s in df['CUTOFF_SEC'].tolist()]
+    schedule_map = {}
+    for key, t in zip(zip(df['ROUTECD'].tolist(), df['PARTCUSTID'].tolist()), times):
+        schedule_map.setdefault(key, []).append(t)
+    return schedule_map
+
+
+def outbound_frame(df):
+    """wave_orders (ingest 型別化結果) -> 任務明細 DataFrame"""
+    df = df.dropna(subset=['datetime'])
+    if 'LOC' not in df.columns: df = df.assign(LOC='')
+    return df
+
+
+def outbound_records(df):
+    """wave_orders (ingest 型別化結果) -> 任務記錄 list[dict]"""
+    return outbound_frame(df).to_dict('records')
+
+
+def inbound_frame(df_in):
+    """
+    historical_receiving (ingest 型別化結果) -> 任務明細 DataFrame
+    沿用舊版語意：入庫任務以 DATE 當日 00:00 起算 (舊版只取 DATE 欄解析)
+    """
+    df_in = df_in.dropna(subset=['datetime'])
+    day = df_in['datetime'].dt.normalize()
+    df_in = df_in.assign(datetime=day, WAVE_ID='RECEIVING_' + day.dt.strftime('%Y%m%d'),
+                         PARTCUSTID='REC_VENDOR')
+    if 'LOC' not in df_in.columns: df_in = df_in.assign(LOC='')
+    return df_in
+
+
+def inbound_records(df_in):
+    """historical_receiving (ingest 型別化結果) -> 任務記錄 list[dict]"""
+    return inbound_frame(df_in).to_dict('records')
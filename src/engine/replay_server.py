@@ -0,0 +1,150 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import mimetypes
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from engine.event_store import EventStore, MANIFEST_FILE
+
+# ==========================================
+# 本機回放伺服器 (step5_visualizer --serve)
+# dashboard 改為薄客戶端：事件 chunk / LOD 檔由伺服器按需提供，
+# 另提供時間區間與物件查詢 API (只讀取涉及的 chunk，不需整份事件進記憶體)
+#
+#   GET /                                   dashboard HTML
+#   GET /<data_dir>/<file>                  event store 靜態檔 (chunk / LOD / manifest)
+#   GET /api/manifest
+#   GET /api/events?t0=&t1=&floor=&obj=&type=&limit=
+#   GET /api/trajectory?agv=AGV_17&t0=&t1=&limit=
+#   GET /api/station?id=3F_4&t0=&t1=&limit=
+# 時間參數可為 epoch 秒或日期時間字串 (例: 2025-07-01 08:00)
+# ==========================================
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_LIMIT = 200000
+
+TRAJECTORY_COLUMNS = ['start_ts', 'end_ts', 'floor', 'sx', 'sy', 'ex', 'ey', 'type']
+STATION_COLUMNS = ['start_ts', 'end_ts', 'text']
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_time(val, default):
+    if val is None or val == '': return default
+    if val.lstrip('-').isdigit(): return int(val)
+    ts = pd.to_datetime(val, errors='coerce')
+    if pd.isna(ts): raise BadRequest(f"無法解析時間: {val}")
+    return int(pd.Timestamp(ts).timestamp())
+
+
+def _json_default(o):
+    if isinstance(o, np.generic): return o.item()
+    raise TypeError(f"無法序列化 {type(o)}")
+
+
+def _table(df, columns, truncated):
+    return {'columns': columns, 'rows': df[columns].values.tolist(), 'count': int(len(df)), 'truncated': bool(truncated)}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    # 由 make_server 設定
+    store = None
+    html_path = None
+    data_prefix = None
+
+    def log_message(self, fmt, *args):
+        pass # 不逐筆輸出存取紀錄
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path in ('/', '/index.html'):
+                self._send_file(self.html_path, 'text/html; charset=utf-8')
+            elif url.path.startswith(self.data_prefix):
+                # 只允許 store 目錄下的檔名 (不接受子路徑)
+                name = os.path.basename(url.path[len(self.data_prefix):])
+                self._send_file(os.path.join(self.store.dir, name))
+            elif url.path.startswith('/api/'):
+                self._send_json(self._api(url.path[len('/api/'):], q))
+            else:
+                self._send_json({'error': 'not found'}, 404)
+        except BadRequest as e:
+            self._send_json({'error': str(e)}, 400)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _api(self, name, q):
+        m = self.store.manifest
+        t0 = parse_time(q.get('t0'), m['min_time'])
+        t1 = parse_time(q.get('t1'), m['max_time'])
+        if t1 < t0: raise BadRequest("t1 必須 >= t0")
+        try: limit = int(q.get('limit', DEFAULT_LIMIT))
+        except ValueError: raise BadRequest("limit 必須為整數")
+
+        if name == 'manifest':
+            return m
+        if name == 'events':
+            types = q['type'].split(',') if q.get('type') else None
+            df, truncated = self.store.query(t0, t1, floor=q.get('floor') or None, obj_id=q.get('obj') or None,
+                                             types=types, limit=limit)
+            return _table(df, list(df.columns), truncated)
+        if name == 'trajectory':
+            agv = q.get('agv', '')
+            if agv.isdigit(): agv = f"AGV_{int(agv)}"
+            if agv not in m['agv_ids']: raise BadRequest(f"未知的 AGV: {agv}")
+            df, truncated = self.store.trajectory(agv, t0, t1, limit=limit)
+            return dict(_table(df, TRAJECTORY_COLUMNS, truncated), agv=agv)
+        if name == 'station':
+            sid = q.get('id', '')
+            if not sid.startswith('WS_'): sid = 'WS_' + sid
+            if sid not in m['station_ids']: raise BadRequest(f"未知的工作站: {sid}")
+            df, truncated = self.store.station_timeline(sid, t0, t1, limit=limit)
+            return dict(_table(df, STATION_COLUMNS, truncated), station=sid)
+        raise BadRequest(f"未知的 API: {name}")
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path, ctype=None):
+        if not os.path.isfile(path):
+            self._send_json({'error': 'not found'}, 404)
+            return
+        with open(path, 'rb') as f: body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', ctype or mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(store_dir, html_path, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    if not os.path.exists(os.path.join(store_dir, MANIFEST_FILE)):
+        raise FileNotFoundError(f"找不到 event store: {store_dir}")
+    handler = type('Handler', (ReplayHandler,), {
+        'store': EventStore(store_dir),
+        'html_path': html_path,
+        'data_prefix': '/' + os.path.basename(os.path.normpath(store_dir)) + '/',
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(store_dir, html_path, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = make_server(store_dir, html_path, host, port)
+    print(f"🌐 回放伺服器啟動: http://{host}:{server.server_address[1]}/  (Ctrl+C 結束)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,335 @@
+import numpy as np
+import pandas as pd
+import os
+import json
+from collections.abc import MutableMapping, Sequence
+
+# ---------------- 預處理資料集 (Memory-Mapped Store) ----------------
+# 取代 processed_sim_data.pkl：
+#   - 地圖：每層一個 .npy 陣列
+#   - 料架座標：依 shelf_id 排序的欄位陣列 (searchsorted 查詢，不需建 dict)
+#   - 任務：每層一組欄位陣列 (columnar task table)，stops / items / lines 以 offset 參照
+#     (lines = 跨波次併單後每筆原任務的 wave 與截止時間，見 logic/consolidation)
+#   - 明細 (raw items)：欄位陣列，只有在 KPI 需要時才實體化
+# 所有 .npy 以 mmap_mode='r' 開啟，多個 sweep worker 可共用同一份 page cache。
+
+STORE_VERSION = 2
+FLOORS = ('2F', '3F')
+META_FILE = 'meta.json'
+
+
+def _npy(store_dir, name):
+    return os.path.join(store_dir, f"{name}.npy")
+
+
+def _save(store_dir, name, arr):
+    np.save(_npy(store_dir, name), np.ascontiguousarray(arr))
+
+
+def _encode_str(values):
+    """字串欄位 -> 固定寬度 UTF-8 bytes 陣列 (可 mmap)；只對 uniques 編碼，缺值 = b''"""
+    codes, uniq = pd.factorize(pd.Series(list(values) if not isinstance(values, pd.Series) else values, dtype=object))
+    enc = [str(v).encode('utf-8') for v in uniq] + [b''] # codes == -1 (缺值) 取最後一個
+    width = max([len(b) for b in enc] + [1])
+    return np.array(enc, dtype=f'S{width}')[codes]
+
+
+def _ns(values):
+    """datetime 序列 -> int64 ns (缺值 = int64 最小值，同 NaT)"""
+    if not len(values): return np.zeros(0, dtype=np.int64)
+    return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy().astype('datetime64[ns]').view(np.int64)
+
+
+def _decode(b):
+    return b.decode('utf-8')
+
+
+def write_sim_store(store_dir, grids, stations, shelf_coords, queues, base_time, items_df):
+    """
+    將預處理結果寫成 memory-mappable 資料集。
+    queues: {floor: [task, ...]}，task['item_rows'] 為 items_df 的列位置 (positional index)。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    # meta.json 最後寫入，作為資料集完整的標記
+    if os.path.exists(os.path.join(store_dir, META_FILE)): os.remove(os.path.join(store_dir, META_FILE))
+
+    for floor, grid in grids.items():
+        _save(store_dir, f"grid_{floor}", np.asarray(grid, dtype=np.float64))
+
+    # 1. 料架座標 (依 shelf_id 排序，rank 保留原始順序以支援「後者覆蓋」語意)
+    sids = list(shelf_coords.keys())
+    sid_arr = _encode_str(sids)
+    order = np.argsort(sid_arr, kind='stable')
+    floor_codes = {f: i for i, f in enumerate(FLOORS)}
+    s_floor = np.array([floor_codes.get(str(v['floor']), -1) for v in shelf_coords.values()], dtype=np.int8)
+    s_pos = np.array([v['pos'] for v in shelf_coords.values()], dtype=np.int32).reshape(-1, 2)
+    _save(store_dir, 'shelf_ids', sid_arr[order])
+    _save(store_dir, 'shelf_floor', s_floor[order])
+    _save(store_dir, 'shelf_pos', s_pos[order])
+    _save(store_dir, 'shelf_rank', order.astype(np.int32))
+
+    # 2. 任務表 (每層) + stops 表 + items 表
+    station_ids = list(stations.keys())
+    st_code = {s: i for i, s in enumerate(station_ids)}
+    item_order = []
+    strings = {'task_shelf': {}, 'wave': {}, 'type': {}}
+
+    def code_of(table, val):
+        d = strings[table]
+        if val not in d: d[val] = len(d)
+        return d[val]
+
+    for floor in FLOORS:
+        tasks = queues.get(floor, [])
+        n = len(tasks)
+        t_shelf = np.empty(n, np.int32); t_wave = np.empty(n, np.int32); t_type = np.empty(n, np.int16)
+        t_prio = np.empty(n, np.int16); t_dt = []
+        t_item_start = np.empty(n, np.int64); t_item_cnt = np.empty(n, np.int32)
+        t_stop_start = np.empty(n, np.int32); t_stop_cnt = np.empty(n, np.int16)
+        t_line_start = np.empty(n, np.int32); t_line_cnt = np.empty(n, np.int32)
+        stop_st, stop_time = [], []
+        line_wave, line_deadline, line_count = [], [], []
+        for i, t in enumerate(tasks):
+            t_shelf[i] = code_of('task_shelf', str(t['shelf_id']))
+            t_wave[i] = code_of('wave', str(t.get('wave_id', 'UNK')))
+            t_type[i] = code_of('type', str(t.get('type', 'ORDER')))
+            t_prio[i] = int(t.get('priority', 10))
+            t_dt.append(t['datetime'])
+            t_stop_start[i] = len(stop_st); t_stop_cnt[i] = len(t['stops'])
+            for s in t['stops']:
+                stop_st.append(st_code[s['station']]); stop_time.append(int(s['time']))
+            rows = t.get('item_rows', [])
+            t_item_start[i] = len(item_order); t_item_cnt[i] = len(rows)
+            item_order.extend(rows)
+            lines = t.get('lines') or []
+            t_line_start[i] = len(line_wave); t_line_cnt[i] = len(lines)
+            for ln in lines:
+                line_wave.append(code_of('wave', str(ln.get('wave_id', 'UNK'))))
+                line_deadline.append(ln.get('deadline'))
+                line_count.append(int(ln.get('count', 1)))
+        t_dt = _ns(t_dt)
+        for name, arr in [('shelf', t_shelf), ('wave', t_wave), ('type', t_type), ('priority', t_prio),
+                          ('datetime', t_dt), ('item_start', t_item_start), ('item_count', t_item_cnt),
+                          ('stop_start', t_stop_start), ('stop_count', t_stop_cnt),
+                          ('line_start', t_line_start), ('line_count', t_line_cnt)]:
+            _save(store_dir, f"task_{floor}_{name}", arr)
+        _save(store_dir, f"stop_{floor}_station", np.array(stop_st, dtype=np.int16))
+        _save(store_dir, f"stop_{floor}_time", np.array(stop_time, dtype=np.int32))
+        _save(store_dir, f"line_{floor}_wave", np.array(line_wave, dtype=np.int32))
+        _save(store_dir, f"line_{floor}_deadline", _ns(line_deadline))
+        _save(store_dir, f"line_{floor}_count", np.array(line_count, dtype=np.int32))
+
+    for table in strings:
+        _save(store_dir, f"str_{table}", _encode_str(list(strings[table].keys())))
+
+    # 3. 明細表：依任務順序排列，任務以 (item_start, item_count) 參照
+    items = items_df.iloc[item_order] if len(item_order) else items_df.iloc[0:0]
+    item_cols = []
+    for ci, col in enumerate(items.columns):
+        s = items[col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            kind = 'datetime'
+            arr = s.astype('datetime64[ns]').values.view(np.int64)
+        elif pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+            kind = 'num'
+            arr = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            kind = 'str'
+            arr = _encode_str(s.tolist())
+        _save(store_dir, f"item_c{ci}", arr)
+        item_cols.append({'name': str(col), 'kind': kind})
+
+    meta = {
+        'version': STORE_VERSION,
+        'base_time': pd.Timestamp(base_time).isoformat(),
+        'floors': list(FLOORS),
+        'grids': list(grids.keys()),
+        'stations': {k: {'floor': v['floor'], 'pos': [int(v['pos'][0]), int(v['pos'][1])]} for k, v in stations.items()},
+        'station_ids': station_ids,
+        'item_columns': item_cols,
+        'n_items': len(item_order),
+        'n_tasks': {f: len(queues.get(f, [])) for f in FLOORS},
+    }
+    with open(os.path.join(store_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+class ItemSlice(Sequence):
+    """任務明細的延遲檢視：只有在被存取時才從 mmap 陣列組出 dict"""
+    def __init__(self, store, start, count):
+        self._store = store
+        self._start = int(start)
+        self._count = int(count)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        if i < 0: i += self._count
+        if not (0 <= i < self._count): raise IndexError(i)
+        return self._store.item_row(self._start + i)
+
+
+class ShelfCoordMap(MutableMapping):
+    """
+    料架座標查詢 (sid -> {'floor', 'pos'})。
+    以排序好的 mmap 陣列做二分搜尋；被修改過的料架存在 overlay dict。
+    """
+    def __init__(self, ids, floors, pos, floor_names):
+        self._ids = ids
+        self._floor = floors
+        self._pos = pos
+        self._floor_names = floor_names
+        self._overlay = {}
+        self._deleted = set()
+
+    def _index(self, key):
+        k = str(key).encode('utf-8')
+        if len(k) > self._ids.dtype.itemsize: return -1
+        i = int(np.searchsorted(self._ids, k))
+        if i < len(self._ids) and self._ids[i] == k: return i
+        return -1
+
+    def __getitem__(self, key):
+        key = str(key)
+        if key in self._overlay: return self._overlay[key]
+        if key in self._deleted: raise KeyError(key)
+        i = self._index(key)
+        if i < 0: raise KeyError(key)
+        fc = int(self._floor[i])
+        entry = {'floor': self._floor_names[fc] if fc >= 0 else None,
+                 'pos': (int(self._pos[i][0]), int(self._pos[i][1]))}
+        self._overlay[key] = entry
+        return entry
+
+    def __contains__(self, key):
+        key = str(key)
+        if key in self._overlay: return True
+        if key in self._deleted: return False
+        return self._index(key) >= 0
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        self._deleted.discard(key)
+        self._overlay[key] = value
+
+    def __delitem__(self, key):
+        if key not in self: raise KeyError(key)
+        self._overlay.pop(str(key), None)
+        self._deleted.add(str(key))
+
+    def __iter__(self):
+        seen = set()
+        for b in self._ids:
+            k = _decode(b)
+            seen.add(k)
+            if k not in self._deleted: yield k
+        for k in self._overlay:
+            if k not in seen: yield k
+
+    def __len__(self):
+        extra = sum(1 for k in self._overlay if self._index(k) < 0)
+        return len(self._ids) - len(self._deleted) + extra
+
+
+class SimStore:
+    """以 memory mapping 開啟預處理資料集 (唯讀)"""
+    def __init__(self, store_dir):
+        meta_path = os.path.join(store_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"找不到預處理資料集: {store_dir} (請先執行 step4_preprocessor)")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"資料集版本不符: {self.meta.get('version')} (需要 {STORE_VERSION})")
+        self.dir = store_dir
+        self.floors = self.meta['floors']
+        self.base_time = pd.Timestamp(self.meta['base_time'])
+        self.stations = {k: {'floor': v['floor'], 'pos': tuple(v['pos'])} for k, v in self.meta['stations'].items()}
+        self.station_ids = self.meta['station_ids']
+        self._items = None
+        self._strings = {}
+
+    def _load(self, name):
+        return np.load(_npy(self.dir, name), mmap_mode='r')
+
+    def grid(self, floor):
+        return self._load(f"grid_{floor}")
+
+    # --- 料架 ---
+    def shelf_arrays(self):
+        """回傳 (ids, floor_code, pos, rank) 四個 mmap 陣列"""
+        return self._load('shelf_ids'), self._load('shelf_floor'), self._load('shelf_pos'), self._load('shelf_rank')
+
+    def shelf_coords(self):
+        ids, fl, pos, _ = self.shelf_arrays()
+        return ShelfCoordMap(ids, fl, pos, self.floors)
+
+    # --- 任務 ---
+    def _string_table(self, table):
+        if table not in self._strings:
+            self._strings[table] = [_decode(b) for b in self._load(f"str_{table}")]
+        return self._strings[table]
+
+    def task_columns(self, floor):
+        names = ['shelf', 'wave', 'type', 'priority', 'datetime', 'item_start', 'item_count', 'stop_start', 'stop_count',
+                 'line_start', 'line_count']
+        return {n: self._load(f"task_{floor}_{n}") for n in names}
+
+    def iter_tasks(self, floor):
+        """依序產生任務 dict (格式與舊 pkl 相容，raw_items 為延遲載入)"""
+        cols = self.task_columns(floor)
+        stop_st = self._load(f"stop_{floor}_station")
+        stop_time = self._load(f"stop_{floor}_time")
+        line_wave = self._load(f"line_{floor}_wave")
+        line_deadline = self._load(f"line_{floor}_deadline")
+        line_count = self._load(f"line_{floor}_count")
+        shelves = self._string_table('task_shelf')
+        waves = self._string_table('wave')
+        types = self._string_table('type')
+        dts = pd.to_datetime(np.asarray(cols['datetime']))
+        for i in range(len(cols['shelf'])):
+            sid = shelves[cols['shelf'][i]]
+            wid = waves[cols['wave'][i]]
+            s0 = int(cols['stop_start'][i])
+            stops = [{'station': self.station_ids[int(stop_st[j])], 'time': int(stop_time[j])}
+                     for j in range(s0, s0 + int(cols['stop_count'][i]))]
+            task = {
+                'task_id': f"{wid}_{sid}",
+                'type': types[cols['type'][i]],
+                'shelf_id': sid,
+                'wave_id': wid,
+                'priority': int(cols['priority'][i]),
+                'stops': stops,
+                'datetime': dts[i],
+                'raw_items': ItemSlice(self, cols['item_start'][i], cols['item_count'][i]),
+            }
+            l0 = int(cols['line_start'][i])
+            if cols['line_count'][i]:
+                task['lines'] = [{'wave_id': waves[int(line_wave[j])], 'count': int(line_count[j]),
+                                  'deadline': pd.Timestamp(int(line_deadline[j])) if line_deadline[j] != np.iinfo(np.int64).min else None}
+                                 for j in range(l0, l0 + int(cols['line_count'][i]))]
+            yield task
+
+    def tasks(self, floor):
+        return list(self.iter_tasks(floor))
+
+    # --- 明細 ---
+    def _item_columns(self):
+        if self._items is None:
+            self._items = [(c['name'], c['kind'], self._load(f"item_c{i}")) for i, c in enumerate(self.meta['item_columns'])]
+        return self._items
+
+    def item_row(self, idx):
+        row = {}
+        for name, kind, arr in self._item_columns():
+            v = arr[idx]
+            if kind == 'datetime':
+                row[name] = pd.Timestamp(int(v)) if v != np.iinfo(np.int64).min else pd.NaT
+            elif kind == 'num':
+                row[name] = float(v)
+            else:
+                row[name] = _decode(v)
+        return row
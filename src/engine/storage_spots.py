@@ -0,0 +1,103 @@
+import numpy as np
+
+# ==========================================
+# 料架歸還點 (storage spot) 向量化選擇
+# 取代「隨機抽 30~100 個點，逐點算 AGV 擁擠度 / 鄰格障礙」：
+#   ShelfOccupancy  取代 runner 的 shelf_occupancy set，add/remove 時同步一張 bool mask
+#                   (A* / ShuffleManager / InvariantMonitor 仍當一般 set 使用)
+#   StorageSpotFinder 空儲位 = 儲位 mask & ~料架 mask，整層一次算分：
+#                   曼哈頓距離 + AGV 擁擠度 (agv_index.DensityGrid) + 孤島懲罰 + 隨機擾動
+# 座標慣例同 runner：pos = (row, col)
+# ==========================================
+
+
+class ShelfOccupancy(set):
+    """料架佔用 set + 同步的 numpy mask (界外座標只進 set)"""
+    def __init__(self, shape, items=()):
+        super().__init__()
+        self.mask = np.zeros(shape, dtype=bool)
+        for p in items: self.add(p)
+
+    def _mark(self, pos, value):
+        r, c = pos
+        if 0 <= r < self.mask.shape[0] and 0 <= c < self.mask.shape[1]: self.mask[r, c] = value
+
+    def add(self, pos):
+        super().add(pos); self._mark(pos, True)
+
+    def remove(self, pos):
+        super().remove(pos); self._mark(pos, False)
+
+    def discard(self, pos):
+        if pos in self: self.remove(pos)
+
+    def pop(self):
+        pos = super().pop(); self._mark(pos, False)
+        return pos
+
+    def clear(self):
+        super().clear(); self.mask[:] = False
+
+    def update(self, *iterables):
+        for it in iterables:
+            for p in it: self.add(p)
+
+    def difference_update(self, *iterables):
+        for it in iterables:
+            for p in it: self.discard(p)
+
+    def __ior__(self, other):
+        self.update(other); return self
+
+    def __isub__(self, other):
+        self.difference_update(other); return self
+
+
+class StorageSpotFinder:
+    def __init__(self, grid, storage_mask, shelves, density, agv_cells=None):
+        """
+        storage_mask: 可放料架的格子 (bool)；shelves: ShelfOccupancy；density: DensityGrid
+        agv_cells: agv_index.at (排除有車的格子時使用)
+        """
+        self.grid = np.asarray(grid)
+        self.storage = np.asarray(storage_mask, dtype=bool)
+        self.shelves = shelves
+        self.density = density
+        self.agv_cells = agv_cells
+        self.rr, self.cc = np.indices(self.storage.shape)
+        self.wall = self.grid[:self.storage.shape[0], :self.storage.shape[1]] == -1
+
+    def free_mask(self, avoid=(), exclude_agvs=False):
+        free = self.storage & ~self.shelves.mask
+        for p in avoid:
+            if p is not None and 0 <= p[0] < free.shape[0] and 0 <= p[1] < free.shape[1]: free[p[0], p[1]] = False
+        if exclude_agvs and self.agv_cells:
+            for p in self.agv_cells:
+                if 0 <= p[0] < free.shape[0] and 0 <= p[1] < free.shape[1]: free[p[0], p[1]] = False
+        return free
+
+    def neighbour_obstacles(self):
+        """每格 4 鄰中 界外 / 牆 / 料架 的數量"""
+        blocked = np.pad(self.wall | self.shelves.mask, 1, constant_values=True).astype(np.int8)
+        return blocked[:-2, 1:-1] + blocked[2:, 1:-1] + blocked[1:-1, :-2] + blocked[1:-1, 2:]
+
+    def scores(self, start_pos, crowd_weight=1.0, island_penalty=0.0, noise=0.0, avoid=(), exclude_agvs=False):
+        """回傳 (spots[n, 2], score[n])，只含空儲位"""
+        free = self.free_mask(avoid, exclude_agvs)
+        rr, cc = self.rr[free], self.cc[free]
+        score = (np.abs(rr - start_pos[0]) + np.abs(cc - start_pos[1])).astype(float)
+        if crowd_weight: score += crowd_weight * self.density.grid[free]
+        if island_penalty: score += np.where(self.neighbour_obstacles()[free] >= 3, island_penalty, 0.0)
+        if noise: score += np.random.uniform(0, noise, len(score))
+        return np.stack([rr, cc], axis=1), score
+
+    def best(self, start_pos, k=1, **kw):
+        """分數最低的 k 個空儲位 (由好到差)"""
+        spots, score = self.scores(start_pos, **kw)
+        if len(score) == 0: return []
+        if k < len(score):
+            part = np.argpartition(score, k - 1)[:k]
+            order = part[np.argsort(score[part], kind='stable')]
+        else:
+            order = np.argsort(score, kind='stable')
+        return [(int(spots[i, 0]), int(spots[i, 1])) for i in order]
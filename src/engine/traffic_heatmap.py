@@ -0,0 +1,120 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+
+# ==========================================
+# 模擬中的交通熱區累計器 (step4 runner 可選)
+# 取代「跑完後重讀整份 simulation_events.csv」的塞車分析：
+# write_move / write_move_events / _lock_spot 寫入時直接累加計數方塊
+#   counts[kind][floor, bucket, row, col]
+#   kind = visit (路徑步進入格子) / wait (原地等待步) / lock (預約鎖定秒數)
+# 結束時以 save() 寫成 logs/traffic_heatmap.npz，並輸出 floor,x,y,count 摘要 traffic_heatmap_live.csv
+# ==========================================
+
+FLOORS = ('2F', '3F')
+KINDS = ('visit', 'wait', 'lock')
+GRID_SHAPE = (32, 61)
+BUCKET_SEC = 300
+HEATMAP_FILE = 'traffic_heatmap.npz'
+HEATMAP_CSV = 'traffic_heatmap_live.csv' # 不覆蓋事後分析產生的 traffic_heatmap.csv
+
+
+class TrafficHeatmap:
+    def __init__(self, grid_shape=GRID_SHAPE, bucket_sec=BUCKET_SEC, floors=FLOORS, init_buckets=64):
+        self.rows, self.cols = grid_shape
+        self.bucket_sec = int(bucket_sec)
+        self.floors = tuple(floors)
+        self.floor_idx = {f: i for i, f in enumerate(self.floors)}
+        self.counts = {k: np.zeros((len(self.floors), init_buckets, self.rows, self.cols), dtype=np.uint32) for k in KINDS}
+        self.n_buckets = 0 # 實際用到的時間桶數
+
+    def _ensure(self, max_bucket):
+        if max_bucket >= self.n_buckets: self.n_buckets = max_bucket + 1
+        cap = self.counts['visit'].shape[1]
+        if max_bucket < cap: return
+        while cap <= max_bucket: cap *= 2
+        for k, arr in self.counts.items():
+            grown = np.zeros((arr.shape[0], cap) + arr.shape[2:], dtype=arr.dtype)
+            grown[:, :arr.shape[1]] = arr
+            self.counts[k] = grown
+
+    def _add(self, kind, fi, rows, cols, ts, weights=1):
+        ok = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols) & (ts >= 0)
+        if not ok.all():
+            rows, cols, ts = rows[ok], cols[ok], ts[ok]
+            if not np.isscalar(weights): weights = weights[ok]
+        if len(ts) == 0: return
+        b = ts // self.bucket_sec
+        self._ensure(int(b.max()))
+        np.add.at(self.counts[kind][fi], (b, rows, cols), weights)
+
+    def add_path(self, floor, path):
+        """path: [((r, c), t), ...]；每一步依是否原地不動計入 visit 或 wait"""
+        fi = self.floor_idx.get(floor)
+        if fi is None or not path or len(path) < 2: return
+        pos = np.array([p for p, _ in path], dtype=np.int64)
+        ts = np.array([t for _, t in path], dtype=np.int64)
+        stay = (pos[1:] == pos[:-1]).all(axis=1)
+        r, c, t = pos[1:, 0], pos[1:, 1], ts[1:]
+        self._add('visit', fi, r[~stay], c[~stay], t[~stay])
+        self._add('wait', fi, r[stay], c[stay], t[stay])
+
+    def add_lock(self, floor, pos, start_t, duration):
+        """預約鎖定 [start_t, start_t + duration) 秒，依時間桶拆開計入秒數"""
+        fi = self.floor_idx.get(floor)
+        duration = int(duration)
+        if fi is None or duration <= 0: return
+        r, c = pos
+        end_t = int(start_t) + duration; start_t = max(int(start_t), 0)
+        if not (0 <= r < self.rows and 0 <= c < self.cols) or end_t <= start_t: return
+        # 鎖定通常只跨 1~2 個桶，直接逐桶累加 (避免小陣列的 numpy 呼叫成本)
+        b0 = start_t // self.bucket_sec; b1 = (end_t - 1) // self.bucket_sec
+        self._ensure(b1)
+        arr = self.counts['lock'][fi]
+        for b in range(b0, b1 + 1):
+            arr[b, r, c] += min(end_t, (b + 1) * self.bucket_sec) - max(start_t, b * self.bucket_sec)
+
+    def totals(self, kinds=('visit', 'wait')):
+        """全時段加總 -> {floor: (rows, cols) 陣列}"""
+        tot = sum(self.counts[k][:, :self.n_buckets].sum(axis=1, dtype=np.int64) for k in kinds)
+        return {f: tot[i] for i, f in enumerate(self.floors)}
+
+    def save(self, out_dir, base_time=None):
+        """寫出 npz 計數方塊與舊版 floor,x,y,count 摘要 csv，回傳 npz 路徑"""
+        path = os.path.join(out_dir, HEATMAP_FILE)
+        meta = {
+            'floors': list(self.floors), 'kinds': list(KINDS), 'bucket_sec': self.bucket_sec,
+            'base_time': None if base_time is None else int(pd.Timestamp(base_time).timestamp()),
+        }
+        arrays = {k: v[:, :self.n_buckets] for k, v in self.counts.items()}
+        np.savez_compressed(path, meta=np.array(json.dumps(meta)), **arrays)
+        hotspot_frame(self.totals(), self.floors).to_csv(os.path.join(out_dir, HEATMAP_CSV), index=False)
+        return path
+
+
+def hotspot_frame(totals, floors=FLOORS):
+    """{floor: 2D 計數} -> floor,x,y,count (x=欄, y=列，與事件檔座標一致)，只保留非零格"""
+    frames = []
+    for f in floors:
+        grid = totals[f]
+        rr, cc = np.nonzero(grid)
+        frames.append(pd.DataFrame({'floor': f, 'x': cc, 'y': rr, 'count': grid[rr, cc]}))
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['floor', 'x', 'y', 'count'])
+    return df.sort_values(['floor', 'x', 'y'], kind='stable').reset_index(drop=True)
+
+
+def load_heatmap(path):
+    """讀回 save() 的結果 -> (meta, {kind: counts[floor, bucket, row, col]})"""
+    with np.load(path) as z:
+        meta = json.loads(str(z['meta']))
+        return meta, {k: z[k] for k in meta['kinds']}
+
+
+def hotspots(counts, meta, kinds=('visit', 'wait'), top=5, floor=None):
+    """依累計次數排序的熱點 [(floor, x, y, count), ...]"""
+    tot = sum(counts[k].sum(axis=1, dtype=np.int64) for k in kinds)
+    df = hotspot_frame({f: tot[i] for i, f in enumerate(meta['floors'])}, meta['floors'])
+    if floor is not None: df = df[df['floor'] == floor]
+    df = df.sort_values('count', ascending=False, kind='stable').head(top)
+    return list(df.itertuples(index=False, name=None))
@@ -0,0 +1,170 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment as _scipy_lsa
+except ImportError:
+    _scipy_lsa = None
+
+# ==========================================
+# 批次派車 (epoch 內最小成本指派)
+# 取代「最早空出的 AGV 直接拿下一個任務」的貪婪派車：
+#   收集 epoch 內會空出的 AGV 與可出發的料架任務，解一次 AGV x 任務 的最小成本指派
+#   epoch 內沿用同一份計畫：最早空出的 AGV 若沒分到任務就原地等，讓計畫中較近的車來拿
+#   成本 = 空車行駛秒數 (BFS 步數，agv_index.distance_map 快取) + 等待 AGV 空出的秒數
+#        + 重試懲罰 + 截止時間 (slack) 項：有餘裕者小幅加分、預計遲到者重罰
+# 有 scipy 時用 linear_sum_assignment，否則用內建的 Hungarian (最短擴增路徑，O(n^2 m))
+# ==========================================
+
+EPOCH_SEC = 30
+SEC_PER_CELL = 1.0   # 空車每格秒數 (runner 的 A* 每步 1 秒)
+W_WAIT = 1.0         # 等 AGV 空出每秒成本
+W_RETRY = 60.0       # 每次重試的懲罰秒數 (同 step4_simulation_core 的 task_retry_counter * 60)
+W_SLACK = 0.05       # 截止前餘裕每秒成本：餘裕越少越優先
+W_LATE = 5.0         # 預計遲到每秒成本
+TASK_DEADLINE_SEC = 4 * 3600 # 任務釋出後的預設截止 (同 runner KPI 的 4 小時)
+UNREACHABLE_COST = 1e9
+
+
+def hungarian(cost):
+    """最小成本指派 (rows <= cols 或自動轉置)，回傳 (row_ind, col_ind)，介面同 scipy"""
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0: return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed: cost = cost.T
+    n, m = cost.shape
+    u = np.zeros(n + 1); v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=int) # match[j] = 指派到第 j 欄的列 (1-based，0 = 無)
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            upd = free & (cur < minv[1:])
+            minv[1:][upd] = cur[upd]
+            way[1:][upd] = j0
+            cand = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(cand)) + 1
+            delta = cand[j1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if match[j0] == 0: break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    if transposed:
+        order = np.argsort(cols)
+        return cols[order], rows[order]
+    return rows, cols
+
+
+def solve_assignment(cost):
+    if _scipy_lsa is not None: return _scipy_lsa(np.asarray(cost, dtype=float))
+    return hungarian(cost)
+
+
+class BatchAssigner:
+    def __init__(self, agv_index, epoch_sec=EPOCH_SEC, sec_per_cell=SEC_PER_CELL, w_wait=W_WAIT,
+                 w_retry=W_RETRY, w_slack=W_SLACK, w_late=W_LATE):
+        """agv_index: 該樓層的 AgvSpatialIndex (提供 BFS 距離圖快取)"""
+        self.index = agv_index
+        self.epoch_sec = epoch_sec
+        self.sec_per_cell = sec_per_cell
+        self.w_wait, self.w_retry, self.w_slack, self.w_late = w_wait, w_retry, w_slack, w_late
+        self.plan = {}        # agv -> task key (目前 epoch 的指派)
+        self.window = set()   # 參與本次求解的 AGV
+        self.plan_until = -1
+        self.stats = {'epochs': 0, 'assigned': 0, 'empty_cells': 0}
+
+    def travel_cells(self, agv_pos, task_pos):
+        d = int(self.index.distance_map(task_pos)[agv_pos[0], agv_pos[1]])
+        return None if d >= np.iinfo(np.int32).max else d
+
+    def cost_matrix(self, now, agvs, tasks):
+        """
+        agvs: [(agv_id, pos, ready_t)]
+        tasks: [{'key', 'pos', 'deadline' (秒，可 None), 'retries', 'agv' (已綁定的 AGV，可 None)}]
+        回傳 (cost[n_agv, n_task], travel_cells[n_agv, n_task])
+        """
+        cost = np.full((len(agvs), len(tasks)), UNREACHABLE_COST)
+        cells = np.full((len(agvs), len(tasks)), -1, dtype=np.int64)
+        apos = np.array([a[1] for a in agvs], dtype=int).reshape(-1, 2)
+        ready = np.array([max(a[2] - now, 0) for a in agvs], dtype=float)
+        for j, task in enumerate(tasks):
+            dmap = self.index.distance_map(task['pos'])
+            d = dmap[apos[:, 0], apos[:, 1]].astype(np.int64)
+            ok = d < np.iinfo(np.int32).max
+            arrive = ready + d * self.sec_per_cell
+            c = arrive + self.w_wait * ready + self.w_retry * task.get('retries', 0)
+            if task.get('deadline') is not None:
+                slack = task['deadline'] - (now + arrive)
+                c = c + self.w_slack * np.maximum(slack, 0) + self.w_late * np.maximum(-slack, 0)
+            if task.get('agv') is not None: ok &= np.array([a[0] == task['agv'] for a in agvs], dtype=bool)
+            cost[ok, j] = c[ok]
+            cells[ok, j] = d[ok]
+        return cost, cells
+
+    def solve(self, now, agvs, tasks):
+        """解一個 epoch：更新 self.plan，回傳 [(agv_id, task_key, travel_cells)]"""
+        self.plan = {}
+        self.window = {a[0] for a in agvs}
+        self.plan_until = now + self.epoch_sec
+        if not agvs or not tasks: return []
+        cost, cells = self.cost_matrix(now, agvs, tasks)
+        rows, cols = solve_assignment(cost)
+        out = []
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            if cost[i, j] >= UNREACHABLE_COST: continue
+            self.plan[agvs[i][0]] = tasks[j]['key']
+            out.append((agvs[i][0], tasks[j]['key'], int(cells[i, j])))
+        self.stats['epochs'] += 1
+        return out
+
+    def window_agvs(self, agv_pool, now):
+        """epoch 內會空出的 AGV：[(agv_id, pos, ready_t)]"""
+        return [(aid, s['pos'], s['time']) for aid, s in agv_pool.items() if s['time'] <= now + self.epoch_sec]
+
+    def needs_solve(self, now, agv_id, valid_keys):
+        if now > self.plan_until or agv_id not in self.window: return True
+        key = self.plan.get(agv_id)
+        if key is not None: return key not in valid_keys
+        # 沒分到：計畫裡還有可拿的任務就繼續等，否則重解
+        return not any(k in valid_keys for k in self.plan.values())
+
+    def choose(self, now, agv_id, valid_keys, build):
+        """
+        build() -> (agvs, tasks)，只在需要重解時呼叫
+        回傳 (key, greedy)：key = 這台該領的任務 (None = 本 epoch 讓給別台，原地等)；
+        greedy = True 表示無任何可行配對，runner 照舊貪婪派車
+        """
+        if self.needs_solve(now, agv_id, valid_keys):
+            agvs, tasks = build()
+            self.solve(now, agvs, tasks)
+            if not self.plan: return None, True
+        return self.plan.get(agv_id), False
+
+    def summary_line(self):
+        st = self.stats
+        avg = st['empty_cells'] / st['assigned'] if st['assigned'] else 0
+        return f"epoch {st['epochs']} | 指派 {st['assigned']} | 平均空車 {avg:.1f} 格"
+
+    def take(self, agv_id, travel_cells=None):
+        """AGV 實際領走了計畫中的任務"""
+        self.plan.pop(agv_id, None)
+        self.stats['assigned'] += 1
+        if travel_cells is not None: self.stats['empty_cells'] += travel_cells
+
+    def invalidate(self):
+        self.plan = {}; self.plan_until = -1
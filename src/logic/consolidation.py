@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+import pandas as pd
+
+# ==========================================
+# 跨波次併單 (cross-wave shelf consolidation)
+# Preprocessor / OrderProcessor 只在同一個 WAVE_ID 內依料架併單，熱門料架在相鄰波次會被重複搬出。
+# 這裡把「同料架、同工作站組合」且釋出時間落在 window 內的任務合併成一趟：
+#   - 以第一筆的 datetime 為錨點，window 秒內到達的後續任務併入；超過就另開一組
+#   - 合併任務在最後一筆釋出時出發 (datetime = 組內最晚)，stops 同站同 face 的工時相加
+#   - 每筆原任務留一筆 line {'wave_id', 'datetime', 'deadline', 'count'}，deadline = 訂單的 WAVE_DEADLINE
+#     (無則 None)；兩個 runner 的 KPI 一律依各 line 的截止時間判斷延遲 (合併與否相同)
+#   - 入庫 (RECEIVING) 與出庫任務不互相合併
+# ==========================================
+
+CONSOLIDATE_WINDOW_SEC = 0 # 預設關閉 (0 = 不跨波次合併，仍會補上 lines)；例: 600
+
+
+def wave_deadline(task):
+    """任務明細 (raw_orders) 中第一個有值的 WAVE_DEADLINE"""
+    for o in task.get('raw_orders') or ():
+        v = o.get('WAVE_DEADLINE')
+        if v is not None and not pd.isna(v): return v
+    return None
+
+
+def make_line(task, deadline_of=wave_deadline):
+    n = len(task.get('raw_orders') or task.get('item_rows') or ()) or 1
+    return {'wave_id': task.get('wave_id', 'UNK'), 'datetime': task.get('datetime'),
+            'deadline': deadline_of(task), 'count': n}
+
+
+def _key(task):
+    stations = tuple(sorted({s['station'] for s in task['stops']}))
+    return task['shelf_id'], stations, 'RECEIVING' in str(task.get('wave_id', ''))
+
+
+def _merge_stops(stops, extra):
+    """同 (station, face) 工時相加；新 face 插在同站最後一個停靠點之後，face 群組保持相鄰"""
+    out = [dict(s) for s in stops]
+    for s in extra:
+        hit = next((o for o in out if o['station'] == s['station'] and o.get('face') == s.get('face')), None)
+        if hit is not None:
+            hit['time'] += s['time']
+            continue
+        last = max((i for i, o in enumerate(out) if o['station'] == s['station']), default=len(out) - 1)
+        out.insert(last + 1, dict(s))
+    return out
+
+
+def _merge(group):
+    if len(group) == 1: return group[0]
+    task = dict(group[0])
+    for other in group[1:]:
+        task['stops'] = _merge_stops(task['stops'], other['stops'])
+        for k in ('raw_orders', 'item_rows'):
+            if k in task: task[k] = list(task[k]) + list(other.get(k, ()))
+        task['lines'] = task['lines'] + other['lines']
+    task['datetime'] = max(t['datetime'] for t in group)
+    return task
+
+
+def consolidate_tasks(tasks, window_sec=CONSOLIDATE_WINDOW_SEC, deadline_of=wave_deadline):
+    """
+    tasks: 單一樓層的任務 list (各自已在波次內依料架併單)
+    deadline_of: task -> 該任務波次的截止時間 (預設讀 raw_orders 的 WAVE_DEADLINE)
+    回傳 (新任務 list, stats)；合併任務放在組內最後一筆原本的位置
+    stats: {'before', 'after', 'saved'} (saved = 省下的 AGV 趟數)
+    """
+    window = timedelta(seconds=window_sec)
+    for t in tasks:
+        if 'lines' not in t: t['lines'] = [make_line(t, deadline_of)]
+    groups = []      # [[task, ...]]
+    slot = {}        # group idx -> 在輸出中的位置 (最後一筆)
+    open_group = {}  # key -> group idx
+    order = sorted(range(len(tasks)), key=lambda i: (tasks[i]['datetime'] is None, tasks[i]['datetime'] or 0, i)) if window_sec > 0 else []
+    for i in order:
+        t = tasks[i]
+        if t.get('type', 'ORDER') != 'ORDER' or t['datetime'] is None or not t.get('stops'): continue
+        key = _key(t)
+        g = open_group.get(key)
+        if g is not None and t['datetime'] - groups[g][0]['datetime'] <= window:
+            groups[g].append(t); slot[g] = max(slot[g], i)
+        else:
+            open_group[key] = len(groups); slot[len(groups)] = i
+            groups.append([t])
+    if not groups: return list(tasks), {'before': len(tasks), 'after': len(tasks), 'saved': 0}
+    member = {}
+    for g, grp in enumerate(groups):
+        for t in grp: member[id(t)] = g
+    out = []
+    for i, t in enumerate(tasks):
+        g = member.get(id(t))
+        if g is None: out.append(t)
+        elif slot[g] == i: out.append(_merge(groups[g]))
+    return out, {'before': len(tasks), 'after': len(out), 'saved': len(tasks) - len(out)}
+
+
+def report(stats, label=''):
+    b, s = stats['before'], stats['saved']
+    pct = s / b * 100 if b else 0
+    print(f"🔗 [Consolidate] {label} 任務 {b} -> {stats['after']} | 省下 {s} 趟 AGV ({pct:.1f}%)")
@@ -1,76 +1,121 @@
 import pandas as pd
 import collections
+import heapq
 import math
 
+# ==========================================
+# 工作站派工 (波次 -> 客戶 -> 工作站)
+# 以「工作站預估完工時間」的 min-heap 分配客戶 (負載大者優先，LPT)：每位客戶 O(log S)
+# 時間一律用整數秒 (epoch 秒)；完工時間跨波次保留，上一波還沒做完的站在下一波分到較少客戶
+# 每行揀貨工時取自 SimConfig：一般 pick_time_normal，再包裝 pick_time_repack + repack_add_time
+# ==========================================
+
+PICK_SHARE = 0.4 # 揀貨佔工作站時間比例 (其餘為等 AGV 搬運)
+REPACK_KEYS = ('IS_REPACK', 'REPACK', 'NEED_REPACK')
+
+
+def to_sec(t):
+    """Timestamp / datetime / 秒數 -> 整數 epoch 秒"""
+    if isinstance(t, (int, float)): return int(t)
+    return int(pd.Timestamp(t).timestamp())
+
+
+def _from_sec(sec, like):
+    """把整數秒轉回與 like 相同的型別 (Timestamp 進、Timestamp 出)"""
+    if isinstance(like, (int, float)): return sec
+    ts = pd.Timestamp(sec, unit='s')
+    like = pd.Timestamp(like)
+    return ts.tz_localize('UTC').tz_convert(like.tz) if like.tz is not None else ts
+
+
+def _is_repack(order):
+    for k in REPACK_KEYS:
+        v = order.get(k)
+        if v is not None and str(v).strip().upper() in ('1', 'Y', 'TRUE'): return True
+    return False
+
+
 class TaskDispatcher:
-    def __init__(self, cfg):
+    def __init__(self, cfg, pick_share=PICK_SHARE):
         self.cfg = cfg
+        self.pick_share = pick_share
+        self.line_sec_normal = int(cfg.pick_time_normal)
+        self.line_sec_repack = int(cfg.pick_time_repack) + int(cfg.repack_add_time)
         # 記錄每個工作站的分配結果: {station_id: [order_list]}
         self.station_assignments = collections.defaultdict(list)
-        self.station_loads = collections.defaultdict(float) # 預估負載 (秒)
-        
-        # 工作站即時狀態 (用於模擬執行時)
-        self.station_busy_until = {} 
+        self.station_loads = collections.defaultdict(int) # 本波預估負載 (秒)
+
+        # 規劃用：工作站預估完工時間 (epoch 秒)，跨波次保留
+        self.station_planned_until = {}
+        # 工作站即時狀態 (用於模擬執行時，epoch 秒)
+        self.station_busy_until = {}
         self.station_buffer = collections.defaultdict(int)
         self.max_buffer = 5
 
+    def line_seconds(self, order):
+        return self.line_sec_repack if _is_repack(order) else self.line_sec_normal
+
+    def _pick_stations(self, total_load, available_stations, start, deadline):
+        """依最早可開工排序，開到 (可用秒數 * 揀貨比例) 足以吃下本波負載為止"""
+        window = max(deadline - start, 0) or 3600 # 防呆: 預設1小時
+        ready = sorted(((max(self.station_planned_until.get(st, start), start), i, st) for i, st in enumerate(available_stations)))
+        active, capacity = [], 0
+        for free_at, _, st in ready:
+            active.append(st)
+            capacity += max(start + window - free_at, 0) * self.pick_share
+            if capacity >= total_load: break
+        return active
+
     def plan_wave_assignments(self, orders, available_stations, start_time, deadline):
         """
         [核心邏輯 1] 波次規劃與客戶分配
-        1. 根據 Deadine 決定需要幾個工作站 (N)
-        2. 執行貪婪演算法分配客戶
+        1. 依各站最早可開工時間開站，直到產能足以在 Deadline 前做完
+        2. 負載大的客戶先分，每次分給預估完工最早的站 (heap)
         """
-        if not orders: return {}
-        
+        if not orders or not available_stations: return {}
+
         # 1. 歸戶：計算每個客戶的總負載
         customer_groups = collections.defaultdict(list)
-        customer_loads = collections.defaultdict(float)
-        
-        pick_time_per_line = 20.0 # 預估每行揀貨時間
-        
+        customer_loads = collections.defaultdict(int)
         for order in orders:
             cust_id = order.get('PARTCUSTID', 'UNKNOWN')
             customer_groups[cust_id].append(order)
-            customer_loads[cust_id] += pick_time_per_line
+            customer_loads[cust_id] += self.line_seconds(order)
 
         # 2. 計算需要幾個站
+        start, end = to_sec(start_time), to_sec(deadline)
         total_load_seconds = sum(customer_loads.values())
-        available_seconds = (deadline - start_time).total_seconds()
-        if available_seconds <= 0: available_seconds = 3600 # 防呆: 預設1小時
-        
-        # 產能估算: 考慮 AGV 搬運佔比 (假設揀貨佔 40%, 搬運佔 60%)
-        # 純作業時間 / 0.4 
-        estimated_needed_capacity = total_load_seconds / 0.4
-        needed_stations = math.ceil(estimated_needed_capacity / available_seconds)
-        
-        # 限制在可用工作站範圍內
-        needed_stations = max(1, min(needed_stations, len(available_stations)))
-        active_stations = available_stations[:needed_stations]
-        
+        active_stations = self._pick_stations(total_load_seconds, available_stations, start, end)
+
         print(f"⚖️ [波次規劃] 訂單總數: {len(orders)} | 客戶數: {len(customer_groups)}")
-        print(f"   -> 總需工時: {total_load_seconds:.1f}s | 可用時間: {available_seconds:.1f}s")
-        print(f"   -> 建議開啟工作站: {needed_stations} 站 (Pool: {len(available_stations)})")
+        print(f"   -> 總需工時: {total_load_seconds}s | 可用時間: {max(end - start, 0) or 3600}s")
+        print(f"   -> 建議開啟工作站: {len(active_stations)} 站 (Pool: {len(available_stations)})")
 
-        # 3. 貪婪分配 (Sort by Load Descending)
+        # 3. LPT 分配：heap 內為 (預估完工秒, 站序, 站)
         sorted_customers = sorted(customer_loads.items(), key=lambda x: x[1], reverse=True)
-        
+
         # 重置分配表
         self.station_assignments.clear()
         self.station_loads.clear()
-        for st in active_stations: self.station_loads[st] = 0.0
+        order_idx = {st: i for i, st in enumerate(active_stations)}
+        heap = [(max(self.station_planned_until.get(st, start), start), order_idx[st], st) for st in active_stations]
+        heapq.heapify(heap)
+        for st in active_stations: self.station_loads[st] = 0
 
         for cust_id, load in sorted_customers:
-            # 找出目前負載最小的站
-            best_st = min(active_stations, key=lambda st: self.station_loads[st])
-            
+            finish, idx, best_st = heap[0]
+
             # 分配
             for order in customer_groups[cust_id]:
                 self.station_assignments[best_st].append(order)
                 # 標記訂單屬於該站 (重要：供 Step4 使用)
                 order['assigned_station_id'] = best_st
-            
+
             self.station_loads[best_st] += load
-            
+            heapq.heapreplace(heap, (finish + math.ceil(load / self.pick_share), idx, best_st))
+
+        # 完工時間帶到下一波
+        for finish, _, st in heap: self.station_planned_until[st] = finish
         return self.station_assignments
 
     def get_assigned_station(self, order):
@@ -89,14 +134,14 @@ class TaskDispatcher:
 
     def occupy_station(self, st_id, duration, current_time):
         """
-        佔用資源
+        佔用資源 (內部整數秒；回傳值與 current_time 同型別)
         """
         self.station_buffer[st_id] += 1
-        last_busy = self.station_busy_until.get(st_id, current_time)
-        start = max(last_busy, current_time)
-        finish = start + pd.Timedelta(seconds=duration)
+        now = to_sec(current_time)
+        start = max(self.station_busy_until.get(st_id, now), now)
+        finish = start + int(math.ceil(duration))
         self.station_busy_until[st_id] = finish
-        return finish
+        return _from_sec(finish, current_time)
 
     def release_station(self, st_id):
         if self.station_buffer[st_id] > 0:
@@ -0,0 +1,138 @@
+from engine.agv_index import bfs_distance_map, UNREACHABLE
+
+# ==========================================
+# 料架多站巡迴排序 (tour optimizer)
+# 一個料架任務要到好幾個工作站時，原本 stops 依 (station, face) 字串排序，不管站在哪裡，
+# 可能在樓層上來回折返。這裡改成「從料架位置出發、依序拜訪各站」的最短開放路徑：
+#   StationDistances  每站一張 BFS 步數圖 (繞牆，快取)，站對站 / 料架對站距離皆為查表
+#   TourOptimizer     站數 <= EXACT_MAX 用 Held-Karp 精確 DP，較多時用最近鄰 + 2-opt
+# 同一站的各 face 停靠點保持相鄰且維持原本 face 順序 (只排「站」的先後，不拆 face 群組)
+# ==========================================
+
+EXACT_MAX = 8 # Held-Karp 上限 (2^n * n^2)
+FAR = 10**6   # 不可達的站對站距離
+
+
+class StationDistances:
+    def __init__(self, grid, stations):
+        """stations: {station_id: (row, col)}"""
+        self.grid = grid
+        self.pos = {sid: (int(p[0]), int(p[1])) for sid, p in stations.items()}
+        self._maps = {}
+        self._pair = {}
+
+    def dmap(self, sid):
+        dist = self._maps.get(sid)
+        if dist is None: dist = self._maps[sid] = bfs_distance_map(self.grid, self.pos[sid])
+        return dist
+
+    def from_pos(self, pos, sid):
+        """任意格 -> 工作站的步數 (格子圖無向，查該站的距離圖即可)；pos=None 時為 0，起點未知請勿排序"""
+        if pos is None or sid not in self.pos: return 0
+        dist = self.dmap(sid)
+        r, c = int(pos[0]), int(pos[1])
+        if not (0 <= r < dist.shape[0] and 0 <= c < dist.shape[1]): return FAR
+        d = int(dist[r, c])
+        return FAR if d == UNREACHABLE else d
+
+    def between(self, a, b):
+        if a == b or a not in self.pos or b not in self.pos: return 0
+        key = (a, b) if a < b else (b, a)
+        d = self._pair.get(key)
+        if d is None:
+            d = self._pair[key] = self.from_pos(self.pos[key[1]], key[0])
+        return d
+
+
+def path_cost(start, dist, order):
+    """start[i]: 起點 -> 站 i；dist[i][j]: 站 i -> 站 j"""
+    if not order: return 0
+    total = start[order[0]]
+    for a, b in zip(order, order[1:]): total += dist[a][b]
+    return total
+
+
+def held_karp(start, dist):
+    """開放路徑的精確最短拜訪順序 (同分時保留索引較小者，原順序不會被等長路徑打亂)"""
+    n = len(start)
+    if n <= 1: return list(range(n))
+    full = (1 << n) - 1
+    inf = FAR * (n + 1)
+    cost = [[inf] * n for _ in range(1 << n)]
+    prev = [[-1] * n for _ in range(1 << n)]
+    for j in range(n): cost[1 << j][j] = start[j]
+    for mask in range(1, full + 1):
+        for j in range(n):
+            if not (mask >> j) & 1: continue
+            cur = cost[mask][j]
+            if cur >= inf: continue
+            for k in range(n):
+                if (mask >> k) & 1: continue
+                nxt = mask | (1 << k)
+                c = cur + dist[j][k]
+                if c < cost[nxt][k]:
+                    cost[nxt][k] = c; prev[nxt][k] = j
+    last = min(range(n), key=lambda j: (cost[full][j], j))
+    order, mask = [], full
+    while last != -1:
+        order.append(last)
+        last, mask = prev[mask][last], mask & ~(1 << last)
+    return order[::-1]
+
+
+def nearest_two_opt(start, dist, seed=None):
+    """最近鄰建初解 (或用 seed)，再做開放路徑 2-opt 直到無改善"""
+    n = len(start)
+    if seed is None:
+        left = set(range(n))
+        cur = min(left, key=lambda j: (start[j], j))
+        order = [cur]; left.discard(cur)
+        while left:
+            cur = min(left, key=lambda j: (dist[cur][j], j))
+            order.append(cur); left.discard(cur)
+    else:
+        order = list(seed)
+    best = path_cost(start, dist, order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 1):
+            for k in range(i + 1, n):
+                cand = order[:i] + order[i:k + 1][::-1] + order[k + 1:]
+                c = path_cost(start, dist, cand)
+                if c < best:
+                    order, best, improved = cand, c, True
+    return order
+
+
+class TourOptimizer:
+    def __init__(self, distances, exact_max=EXACT_MAX):
+        self.dist = distances
+        self.exact_max = exact_max
+
+    def order_stations(self, start_pos, stations):
+        """回傳 (最佳站序, 原順序步數, 最佳步數)"""
+        n = len(stations)
+        start = [self.dist.from_pos(start_pos, s) for s in stations]
+        dist = [[self.dist.between(a, b) for b in stations] for a in stations]
+        base = list(range(n))
+        before = path_cost(start, dist, base)
+        if n <= 1: return list(stations), before, before
+        if n <= self.exact_max:
+            order = held_karp(start, dist)
+        else:
+            order = min((nearest_two_opt(start, dist), nearest_two_opt(start, dist, base)),
+                        key=lambda o: path_cost(start, dist, o))
+        after = path_cost(start, dist, order)
+        if after >= before: order, after = base, before
+        return [stations[i] for i in order], before, after
+
+    def order_stops(self, start_pos, stops):
+        """
+        stops: [{'station', 'face', 'time'}]，同站的 face 群組保持相鄰
+        回傳 (新 stops, 原順序步數, 最佳步數)
+        """
+        groups = {}
+        for s in stops: groups.setdefault(s['station'], []).append(s)
+        order, before, after = self.order_stations(start_pos, list(groups))
+        return [s for st in order for s in groups[st]], before, after
@@ -0,0 +1,99 @@
+import pandas as pd
+import numpy as np
+
+# ==========================================
+# 向量化波次引擎 (取代 step2 逐筆 assign_wave)
+# 班次時間攤平成一條排序好的整數軸：key = 群組代碼 * 一天 + 當日時間 (ns)
+# 一次 searchsorted 即可替所有訂單找到「同群組、>= 下單時間」的第一個截單點。
+# ==========================================
+
+DAY_NS = 86400 * 10**9
+DEFAULT_CUTOFF = pd.Timedelta(hours=23, minutes=59)
+
+
+class CutoffTable:
+    """
+    班次截單表 (由 engine/loaders.load_route_schedule_frame 的結果建立)
+    keys: MultiIndex(ROUTECD, PARTCUSTID)，位置即群組代碼
+    flat: 攤平後已排序的 int64 軸 (群組代碼 * DAY_NS + 截單時間 ns)
+    first_ns: 每個群組最早的截單時間 (跨日時使用)
+    """
+    def __init__(self, schedule_df):
+        df = schedule_df.sort_values(['ROUTECD', 'PARTCUSTID', 'CUTOFF_SEC'], kind='stable')
+        codes, uniques = pd.MultiIndex.from_frame(df[['ROUTECD', 'PARTCUSTID']]).factorize(sort=True)
+        cut_ns = df['CUTOFF_SEC'].to_numpy(np.int64) * 10**9
+
+        self.keys = uniques
+        self.flat = codes.astype(np.int64) * DAY_NS + cut_ns
+        self.flat_code = codes.astype(np.int64)
+        # 已依 (群組, 時間) 排序，每組第一筆即最早班次
+        starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1] if len(codes) else np.array([], dtype=np.int64)
+        self.first_ns = cut_ns[starts]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, routecd, partcustid):
+        """(ROUTECD, PARTCUSTID) 陣列 -> 群組代碼陣列 (-1 代表沒有對應班次)"""
+        # 先對訂單端去重，只查不重複的組合 (客戶數遠少於訂單數)
+        r_codes, r_uniq = pd.factorize(np.asarray(routecd, dtype=object))
+        c_codes, c_uniq = pd.factorize(np.asarray(partcustid, dtype=object))
+        n_c = max(len(c_uniq), 1)
+        pair = r_codes.astype(np.int64) * n_c + c_codes
+        uniq, inv = np.unique(np.maximum(pair, 0), return_inverse=True)
+
+        if len(r_uniq) == 0 or len(c_uniq) == 0: return np.full(len(pair), -1, dtype=np.int64)
+        idx = pd.MultiIndex.from_arrays([np.asarray(r_uniq, dtype=object)[uniq // n_c],
+                                         np.asarray(c_uniq, dtype=object)[uniq % n_c]])
+        found = self.keys.get_indexer(idx).astype(np.int64)
+        out = found[inv.ravel()]
+        # 任一欄位為空值 (factorize 代碼 -1) 一律視為沒有對應班次
+        out[(r_codes < 0) | (c_codes < 0)] = -1
+        return out
+
+
+def assign_waves(order_dt, group_codes, table):
+    """
+    批次指派波次
+    order_dt: 下單時間 (datetime64 Series)
+    group_codes: CutoffTable.lookup 的結果
+    回傳 (WAVE_ID, WAVE_DEADLINE, IS_ROLLOVER, 是否為 DEFAULT) 四個陣列
+    """
+    order_dt = pd.Series(pd.to_datetime(order_dt)).reset_index(drop=True)
+    day = order_dt.dt.normalize()
+    tod_ns = (order_dt - day).to_numpy().astype('timedelta64[ns]').astype(np.int64)
+    codes = np.asarray(group_codes, dtype=np.int64)
+
+    matched = codes >= 0
+    deadline_ns = np.zeros(len(codes), dtype=np.int64)
+    rollover = np.zeros(len(codes), dtype=bool)
+
+    if matched.any() and len(table.flat):
+        q = codes[matched] * DAY_NS + tod_ns[matched]
+        pos = np.searchsorted(table.flat, q, side='left')
+        in_range = pos < len(table.flat)
+        same_group = np.zeros(len(q), dtype=bool)
+        same_group[in_range] = table.flat_code[pos[in_range]] == codes[matched][in_range]
+
+        # 當日仍有班次：截單時間 = 當日 + 班次時間
+        hit_ns = np.where(same_group, table.flat[np.minimum(pos, len(table.flat) - 1)] - codes[matched] * DAY_NS, 0)
+        # 當日已無班次：跨日至隔天最早班次
+        next_ns = DAY_NS + table.first_ns[codes[matched]]
+        deadline_ns[matched] = np.where(same_group, hit_ns, next_ns)
+        rollover[matched] = ~same_group
+
+    deadline = day + pd.to_timedelta(deadline_ns, unit='ns')
+    # 沒有對應班次 -> 當日 23:59 DEFAULT 波次
+    deadline = deadline.where(pd.Series(matched), day + DEFAULT_CUTOFF)
+
+    wave_ids = np.empty(len(codes), dtype=object)
+    wave_ids[matched] = _format_unique(deadline[matched], 'W_%Y%m%d_%H%M')
+    wave_ids[~matched] = _format_unique(day[~matched], 'W_%Y%m%d_DEFAULT')
+    return wave_ids, deadline.to_numpy(), rollover.astype(np.int64), ~matched
+
+
+def _format_unique(dt_series, fmt):
+    # strftime 是逐元素的慢操作；波次數遠少於訂單數，只格式化不重複的時間點再展開
+    if dt_series.empty: return np.array([], dtype=object)
+    inv, uniq = pd.factorize(dt_series)
+    return pd.DatetimeIndex(uniq).strftime(fmt).to_numpy(dtype=object)[inv]
@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 # 引入引擎
 from engine.configs import SimConfig
 from engine.physics import MapWorld, AGV
+from engine import ingest
+from engine.loaders import load_shelf_coords
 
 # ==========================================
 # 設定檔案路徑
@@ -59,11 +61,7 @@ class EventSimulationRunner:
 
     def _load_shelf_map(self):
         path = os.path.join(DATA_MAP_DIR, SHELF_MAP_FILE)
-        df = pd.read_csv(path)
-        mapping = {}
-        for _, row in df.iterrows():
-            mapping[str(row['shelf_id'])] = {'floor': row['floor'], 'pos': (int(row['x']), int(row['y']))}
-        return mapping
+        return load_shelf_coords(path, pos_order='xy', keep='last')
 
     def _init_agvs(self, world, count, start_id):
         agvs = []
@@ -82,10 +80,9 @@ class EventSimulationRunner:
 
     def _load_orders(self):
         path = os.path.join(DATA_TRX_DIR, WAVE_FILE)
-        df = pd.read_csv(path)
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df['WAVE_DEADLINE'] = pd.to_datetime(df['WAVE_DEADLINE'])
-        df = df.sort_values('datetime')
+        # datetime / WAVE_DEADLINE 已由 ingest schema 解析
+        df = ingest.load_table('wave_orders', path)
+        df = df.sort_values('datetime', kind='stable')
         return df.to_dict('records')
 
     def get_travel_time(self, agv, target_pos):
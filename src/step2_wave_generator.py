@@ -2,8 +2,16 @@ import pandas as pd
 import numpy as np
 import os
 import sys
+import csv
+import heapq
+import argparse
+import tempfile
 from datetime import datetime, timedelta
 
+from engine import ingest
+from engine.loaders import load_route_schedule_frame
+from logic.wave_engine import CutoffTable, assign_waves
+
 # ==========================================
 # 設定檔案路徑
 # ==========================================
@@ -16,105 +24,78 @@ ROUTE_SCHEDULE_FILE = 'route_schedule_master.csv'
 HISTORICAL_ORDERS_FILE = 'historical_orders_ex.csv'
 OUTPUT_WAVE_FILE = 'wave_orders.csv'
 
+# 串流模式 (--stream)：每批讀入的訂單筆數，決定記憶體峰值
+STREAM_CHUNK_SIZE = 200000
+# 一次 k-way merge 最多同時開啟的暫存檔數，超過時分層合併
+MAX_MERGE_FANIN = 64
+
 def read_csv_robust(file_path, dtype=None):
     """
-    強健的 CSV 讀取函式，自動嘗試 utf-8 與 cp950 (Big5) 編碼
+    強健的 CSV 讀取函式：由 engine/ingest 從檔頭樣本判斷編碼，只讀一次檔案
     """
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"找不到檔案: {file_path}")
-
-    encodings = ['utf-8', 'cp950', 'big5', 'gbk']
-    
-    for enc in encodings:
-        try:
-            # 加入 low_memory=False 與 dtype 指定，提升讀取穩定度
-            df = pd.read_csv(file_path, encoding=enc, dtype=dtype, low_memory=False)
-            return df
-        except UnicodeDecodeError:
-            continue
-        except Exception as e:
-            raise e
-            
-    raise ValueError(f"無法讀取檔案 {os.path.basename(file_path)}，請確認編碼")
-
-def parse_time_str(time_str):
-    """
-    將 '855' (int/str) 或 '08:55:00' 轉為 time object
-    """
-    s = str(time_str).strip()
-    if not s or s.lower() == 'nan': return None
-    
-    if ':' in s:
-        # 格式: 08:55:00 或 08:55
-        try:
-            return datetime.strptime(s, "%H:%M:%S").time()
-        except ValueError:
-            try:
-                return datetime.strptime(s, "%H:%M").time()
-            except ValueError:
-                return None
-    else:
-        # 格式: 855 -> 08:55
-        if s.isdigit():
-            s = s.zfill(4)
-            try:
-                return datetime.strptime(s, "%H%M").time()
-            except ValueError:
-                return None
-        return None
+    return ingest.read_csv(file_path, dtype=dtype, low_memory=False)
 
 def load_route_schedule():
     path = os.path.join(DATA_MASTER_DIR, ROUTE_SCHEDULE_FILE)
     print(f"📖 正在讀取班次表: {ROUTE_SCHEDULE_FILE} ...")
     
-    # 強制將 ROUTECD 和 PARTCUSTID 讀為字串，避免型別混亂
-    df = read_csv_robust(path, dtype={'ROUTECD': str, 'PARTCUSTID': str})
-    
-    schedule_map = {}
-    count = 0
-    
-    # 清洗資料
-    df['ROUTECD'] = df['ROUTECD'].str.strip()
-    df['PARTCUSTID'] = df['PARTCUSTID'].str.strip()
-    
-    # 移除空值
-    df.dropna(subset=['ROUTECD', 'PARTCUSTID', 'ORDERENDTIME'], inplace=True)
-    
-    for _, row in df.iterrows():
-        key = (row['ROUTECD'], row['PARTCUSTID'])
-        t = parse_time_str(row['ORDERENDTIME'])
-        
-        if t:
-            if key not in schedule_map: schedule_map[key] = []
-            schedule_map[key].append(t)
-            count += 1
-            
-    for k in schedule_map:
-        schedule_map[k].sort()
-        
-    print(f"   -> 已建立 {len(schedule_map)} 組客戶班次規則 (共 {count} 個班次時間點)")
-    return schedule_map
+    # 清洗、時間解析與排序皆在欄位層級完成 (engine/loaders)，再攤平成截單表
+    table = CutoffTable(load_route_schedule_frame(path))
+    count = len(table.flat)
+
+    print(f"   -> 已建立 {len(table)} 組客戶班次規則 (共 {count} 個班次時間點)")
+    return table
+
+def clean_orders(df_orders):
+    """
+    資料清洗 (一般模式與串流模式共用)
+    去除空白與時間解析已由 ingest schema 完成 (DATE/TIME 任一為空時 datetime 即為 NaT)
+    """
+    # 移除 ROUTECD 或 PARTCUSTID 為空、或時間解析失敗的行 (解決 ,,,,,,, 的問題)
+    return df_orders.dropna(subset=['ROUTECD', 'PARTCUSTID', 'datetime'])
+
+def tag_waves(df_orders, table):
+    """
+    向量化：一次 searchsorted 完成所有訂單的班次比對、跨日與 DEFAULT 處理
+    回傳 (已標記波次並排序的 DataFrame, DEFAULT 筆數, 找不到班次的 key 範例)
+    """
+    codes = table.lookup(df_orders['ROUTECD'].to_numpy(), df_orders['PARTCUSTID'].to_numpy())
+    wave_ids, deadlines, rollover, is_default = assign_waves(df_orders['datetime'], codes, table)
 
-def assign_wave(order_datetime, schedule_times):
-    order_time = order_datetime.time()
+    df_orders['WAVE_ID'] = wave_ids
+    df_orders['WAVE_DEADLINE'] = deadlines
+    df_orders['IS_ROLLOVER'] = rollover
+
+    unmatched_count = int(is_default.sum())
+    unmatched_keys = set()
+    if unmatched_count:
+        sample = df_orders.loc[is_default, ['ROUTECD', 'PARTCUSTID']].drop_duplicates().head(10)
+        unmatched_keys = {str(k) for k in zip(sample['ROUTECD'], sample['PARTCUSTID'])}
+
+    # 多欄排序為穩定排序：同 key 保留原始檔案順序 (串流合併時依賴此性質)
+    df_orders = df_orders.sort_values(by=['WAVE_DEADLINE', 'datetime'])
+    return df_orders, unmatched_count, unmatched_keys
+
+def print_summary(cleaned_count, wave_count, unmatched_count, unmatched_keys, head_df):
+    print(f"✅ 波次生成完成！結果已存檔: {OUTPUT_WAVE_FILE}")
+    print("\n📊 波次統計摘要:")
+    print(f"   -> 有效訂單數: {cleaned_count}")
+    print(f"   -> 生成波次數: {wave_count}")
     
-    for cutoff_time in schedule_times:
-        if order_time <= cutoff_time:
-            wave_dt = datetime.combine(order_datetime.date(), cutoff_time)
-            return wave_dt, False
-            
-    # 跨日
-    next_day = order_datetime.date() + timedelta(days=1)
-    first_cutoff = schedule_times[0]
-    wave_dt = datetime.combine(next_day, first_cutoff)
-    return wave_dt, True
+    if unmatched_count > 0:
+        print(f"   ⚠️ 警告: 有 {unmatched_count} 筆訂單找不到對應班次 (歸入 DEFAULT)")
+        print(f"   🔍 找不到班次的 (Route, Cust) 範例: {list(unmatched_keys)}")
+        print("      (請確認 route_schedule_master.csv 是否包含這些組合)")
+        
+    print("\n   [範例波次分佈 (前 5 筆)]:")
+    print(head_df[['WAVE_ID', 'ROUTECD', 'PARTCUSTID', 'datetime']].head(5).to_string())
 
 def main():
     print("🚀 [Step 2] 啟動訂單波次產生器 (資料清洗版)...")
     
     # 1. 載入班次表
     try:
-        schedule_map = load_route_schedule()
+        table = load_route_schedule()
     except Exception as e:
         print(f"❌ 班次表讀取錯誤: {e}")
         sys.exit(1)
@@ -124,8 +105,8 @@ def main():
     print(f"📖 正在讀取歷史訂單: {HISTORICAL_ORDERS_FILE} ...")
     
     try:
-        # 強制讀取為字串，後續再轉型，確保資料完整
-        df_orders = read_csv_robust(orders_path, dtype=str)
+        # 依 ingest schema 轉型 (內容未變時直接讀取快取)
+        df_orders = ingest.load_table('historical_orders', orders_path)
     except Exception as e:
         print(f"❌ 訂單檔讀取錯誤: {e}")
         sys.exit(1)
@@ -134,19 +115,8 @@ def main():
     
     # --- 資料清洗 ---
     print("🧹 執行資料清洗...")
-    # 1. 移除 ROUTECD 或 PARTCUSTID 為空的行 (解決 ,,,,,,, 的問題)
-    df_orders.dropna(subset=['ROUTECD', 'PARTCUSTID', 'DATE', 'TIME'], inplace=True)
-    
-    # 2. 去除空白字元
-    df_orders['ROUTECD'] = df_orders['ROUTECD'].str.strip()
-    df_orders['PARTCUSTID'] = df_orders['PARTCUSTID'].str.strip()
-    
-    # 3. 解析時間
     try:
-        # 錯誤的時間格式轉為 NaT
-        df_orders['datetime'] = pd.to_datetime(df_orders['DATE'] + ' ' + df_orders['TIME'], errors='coerce')
-        # 移除時間解析失敗的行
-        df_orders.dropna(subset=['datetime'], inplace=True)
+        df_orders = clean_orders(df_orders)
     except Exception as e:
         print(f"❌ 時間格式解析嚴重錯誤: {e}")
         sys.exit(1)
@@ -160,55 +130,122 @@ def main():
 
     # 3. 進行波次分派
     print(f"⚙️ 開始分配波次...")
-    
-    wave_ids = []
-    wave_timestamps = []
-    is_next_day_list = []
-    
-    unmatched_keys = set()
-    unmatched_count = 0
-    
-    for _, row in df_orders.iterrows():
-        key = (row['ROUTECD'], row['PARTCUSTID'])
-        
-        if key in schedule_map:
-            target_dt, is_next_day = assign_wave(row['datetime'], schedule_map[key])
-            w_id = f"W_{target_dt.strftime('%Y%m%d_%H%M')}"
-            
-            wave_ids.append(w_id)
-            wave_timestamps.append(target_dt)
-            is_next_day_list.append(1 if is_next_day else 0)
-        else:
-            unmatched_count += 1
-            if len(unmatched_keys) < 10: unmatched_keys.add(str(key))
-            
-            # Default Wave: 當日 23:59
-            def_dt = datetime.combine(row['datetime'].date(), datetime.strptime("23:59", "%H:%M").time())
-            wave_ids.append(f"W_{def_dt.strftime('%Y%m%d')}_DEFAULT")
-            wave_timestamps.append(def_dt)
-            is_next_day_list.append(0)
-            
-    df_orders['WAVE_ID'] = wave_ids
-    df_orders['WAVE_DEADLINE'] = wave_timestamps
-    df_orders['IS_ROLLOVER'] = is_next_day_list
-    
-    df_orders = df_orders.sort_values(by=['WAVE_DEADLINE', 'datetime'])
+    df_orders, unmatched_count, unmatched_keys = tag_waves(df_orders, table)
     
     output_path = os.path.join(DATA_TRANSACTION_DIR, OUTPUT_WAVE_FILE)
     df_orders.to_csv(output_path, index=False, encoding='utf-8-sig')
     
-    print(f"✅ 波次生成完成！結果已存檔: {OUTPUT_WAVE_FILE}")
-    print("\n📊 波次統計摘要:")
-    print(f"   -> 有效訂單數: {cleaned_count}")
-    print(f"   -> 生成波次數: {df_orders['WAVE_ID'].nunique()}")
-    
-    if unmatched_count > 0:
-        print(f"   ⚠️ 警告: 有 {unmatched_count} 筆訂單找不到對應班次 (歸入 DEFAULT)")
-        print(f"   🔍 找不到班次的 (Route, Cust) 範例: {list(unmatched_keys)}")
-        print("      (請確認 route_schedule_master.csv 是否包含這些組合)")
-        
-    print("\n   [範例波次分佈 (前 5 筆)]:")
-    print(df_orders[['WAVE_ID', 'ROUTECD', 'PARTCUSTID', 'datetime']].head(5).to_string())
+    print_summary(cleaned_count, df_orders['WAVE_ID'].nunique(), unmatched_count, unmatched_keys, df_orders)
+
+# ==========================================
+# 串流模式：分批讀取 -> 每批排序後落地 (sorted run) -> k-way merge
+# 記憶體峰值只和 chunk_size 有關，與歷史訂單總長度無關
+# ==========================================
+def _write_run(df_orders, run_dir, run_idx):
+    """將一批已排序的訂單寫成暫存 run；前兩欄為整數排序鍵 (ns)，合併時不需再解析時間字串"""
+    path = os.path.join(run_dir, f"run_{run_idx:05d}.csv")
+    keys = pd.DataFrame({
+        '_K_DEADLINE': df_orders['WAVE_DEADLINE'].to_numpy().astype('datetime64[ns]').astype(np.int64),
+        '_K_DATETIME': df_orders['datetime'].to_numpy().astype('datetime64[ns]').astype(np.int64),
+    }, index=df_orders.index)
+    pd.concat([keys, df_orders], axis=1).to_csv(path, index=False, header=False, encoding='utf-8')
+    return path
+
+def _iter_run(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for line in f:
+            k1, k2, rest = line.split(',', 2)
+            yield (int(k1), int(k2)), line, rest
+
+def _merge_runs(paths, out_f, strip_keys):
+    """heapq.merge 以 key 比較，同 key 時依 run 順序輸出 (穩定)，結果等同整體穩定排序"""
+    iters = [_iter_run(p) for p in paths]
+    for _, line, rest in heapq.merge(*iters, key=lambda t: t[0]):
+        out_f.write(rest if strip_keys else line)
+
+def _merge_to_output(run_paths, run_dir, output_path, header):
+    # 暫存檔過多時先分層合併，控制同時開啟的檔案數
+    level = 0
+    while len(run_paths) > MAX_MERGE_FANIN:
+        merged = []
+        for i in range(0, len(run_paths), MAX_MERGE_FANIN):
+            group = run_paths[i:i + MAX_MERGE_FANIN]
+            path = os.path.join(run_dir, f"merge_{level}_{i // MAX_MERGE_FANIN:05d}.csv")
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                _merge_runs(group, f, strip_keys=False)
+            for p in group: os.remove(p)
+            merged.append(path)
+        run_paths = merged
+        level += 1
+
+    with open(output_path, 'w', encoding='utf-8-sig', newline='') as f:
+        csv.writer(f, lineterminator=os.linesep).writerow(header)
+        _merge_runs(run_paths, f, strip_keys=True)
+
+def main_streaming(chunk_size=STREAM_CHUNK_SIZE):
+    print(f"🚀 [Step 2] 啟動訂單波次產生器 (串流模式, 每批 {chunk_size} 筆)...")
+
+    try:
+        table = load_route_schedule()
+    except Exception as e:
+        print(f"❌ 班次表讀取錯誤: {e}")
+        sys.exit(1)
+
+    orders_path = os.path.join(DATA_TRANSACTION_DIR, HISTORICAL_ORDERS_FILE)
+    print(f"📖 正在串流讀取歷史訂單: {HISTORICAL_ORDERS_FILE} ...")
+    try:
+        # 只讀檔頭樣本判斷編碼，不需為了偵測整檔掃描
+        enc = ingest.sniff_encoding(orders_path)
+    except Exception as e:
+        print(f"❌ 訂單檔讀取錯誤: {e}")
+        sys.exit(1)
+
+    original_count = cleaned_count = unmatched_count = 0
+    unmatched_keys = set()
+    wave_set = set()
+    header = None
+    head_df = None
+    output_path = os.path.join(DATA_TRANSACTION_DIR, OUTPUT_WAVE_FILE)
+
+    with tempfile.TemporaryDirectory(prefix='wave_runs_', dir=DATA_TRANSACTION_DIR) as run_dir:
+        run_paths = []
+        reader = pd.read_csv(orders_path, encoding=enc, dtype=str, chunksize=chunk_size)
+        for chunk in reader:
+            original_count += len(chunk)
+            try:
+                chunk = clean_orders(ingest.apply_schema(chunk, 'historical_orders'))
+            except Exception as e:
+                print(f"❌ 時間格式解析嚴重錯誤: {e}")
+                sys.exit(1)
+            if chunk.empty: continue
+
+            chunk, n_default, keys = tag_waves(chunk, table)
+            cleaned_count += len(chunk)
+            unmatched_count += n_default
+            if len(unmatched_keys) < 10: unmatched_keys.update(list(keys)[:10 - len(unmatched_keys)])
+            wave_set.update(chunk['WAVE_ID'].unique().tolist())
+            if header is None: header = list(chunk.columns)
+            # 各批前 5 筆合併後取全域前 5 筆 (供摘要顯示)
+            head_df = pd.concat([head_df, chunk.head(5)]).sort_values(by=['WAVE_DEADLINE', 'datetime']).head(5)
+
+            run_paths.append(_write_run(chunk, run_dir, len(run_paths)))
+            print(f"   -> 已處理 {original_count} 筆 (暫存 run: {len(run_paths)})", end='\r')
+
+        print(f"\n   -> 原始筆數: {original_count}, 清洗後有效筆數: {cleaned_count} (剔除 {original_count - cleaned_count} 筆無效資料)")
+        if cleaned_count == 0:
+            print("❌ 錯誤: 清洗後沒有剩餘任何訂單！請檢查 CSV 內容格式。")
+            sys.exit(1)
+
+        print(f"🔀 合併 {len(run_paths)} 個已排序暫存檔 (k-way merge)...")
+        _merge_to_output(run_paths, run_dir, output_path, header)
+
+    print_summary(cleaned_count, len(wave_set), unmatched_count, unmatched_keys, head_df)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="訂單波次產生器")
+    parser.add_argument('--stream', action='store_true', help="串流模式：分批讀取並外部排序，適用長期歷史訂單")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help="串流模式每批筆數 (決定記憶體峰值)")
+    args = parser.parse_args()
+
+    if args.stream: main_streaming(args.chunk_size)
+    else: main()
\ No newline at end of file
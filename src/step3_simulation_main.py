@@ -9,6 +9,9 @@ from datetime import datetime, timedelta
 # 引入引擎
 from engine.configs import SimConfig
 from engine.physics import MapWorld, AGV
+from engine import ingest
+from engine.loaders import load_shelf_coords
+from engine.agv_index import AgvSpatialIndex
 
 # ==========================================
 # 設定檔案路徑
@@ -50,6 +53,12 @@ class SimulationRunner:
         self.agvs_2f = self._init_agvs(self.world_2f, agv_count_2f, start_id=1)
         self.agvs_3f = self._init_agvs(self.world_3f, agv_count_3f, start_id=101)
         self.all_agvs = self.agvs_2f + self.agvs_3f
+        self.agv_by_id = {agv.id: agv for agv in self.all_agvs}
+        
+        # AGV 空間索引：派車不再逐台計算距離
+        self.agv_index = {'2F': AgvSpatialIndex(self.world_2f.grid), '3F': AgvSpatialIndex(self.world_3f.grid)}
+        for floor, agvs in [('2F', self.agvs_2f), ('3F', self.agvs_3f)]:
+            for agv in agvs: self.agv_index[floor].update(agv.id, agv.pos, 'idle')
         
         print(f"🤖 AGV 就位: 2F({len(self.agvs_2f)}台), 3F({len(self.agvs_3f)}台)")
 
@@ -70,13 +79,7 @@ class SimulationRunner:
         path = os.path.join(DATA_MAP_DIR, SHELF_MAP_FILE)
         if not os.path.exists(path):
             raise FileNotFoundError(f"找不到座標表: {path}")
-        df = pd.read_csv(path)
-        mapping = {}
-        for _, row in df.iterrows():
-            s_id = str(row['shelf_id'])
-            if s_id not in mapping:
-                mapping[s_id] = {'floor': row['floor'], 'pos': (int(row['x']), int(row['y']))}
-        return mapping
+        return load_shelf_coords(path, pos_order='xy', keep='first')
 
     def _init_agvs(self, world, count, start_id):
         agvs = []
@@ -100,10 +103,9 @@ class SimulationRunner:
         if not os.path.exists(path):
             print("⚠️ 找不到波次訂單，請先執行 Step 2")
             return []
-        df = pd.read_csv(path)
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df['WAVE_DEADLINE'] = pd.to_datetime(df['WAVE_DEADLINE'])
-        df = df.sort_values('datetime')
+        # datetime / WAVE_DEADLINE 已由 ingest schema 解析
+        df = ingest.load_table('wave_orders', path)
+        df = df.sort_values('datetime', kind='stable')
         return df.to_dict('records')
 
     def run(self, duration_days=1):
@@ -187,21 +189,16 @@ class SimulationRunner:
                         agvs = self.agvs_3f
                         world = self.world_3f
                     
-                    # 簡單派車：找最近閒置
-                    best_agv = None
-                    min_dist = 9999
-                    for agv in agvs:
-                        if agv.status == 'IDLE' and not agv.current_task:
-                            dist = abs(agv.pos[0] - task['target_pos'][0]) + abs(agv.pos[1] - task['target_pos'][1])
-                            if dist < min_dist:
-                                min_dist = dist
-                                best_agv = agv
+                    # 簡單派車：找最近閒置 (空間索引)
+                    best_id = self.agv_index[task['floor']].nearest_one(task['target_pos'], status='idle')
+                    best_agv = self.agv_by_id[best_id] if best_id is not None else None
                     
                     if best_agv:
                         success = best_agv.plan_path(world, task['target_pos'])
                         if success:
                             best_agv.status = 'MOVING'
                             best_agv.current_task = task
+                            self.agv_index[task['floor']].set_status(best_agv.id, 'busy')
                             self.order_queue.remove(task)
                             assigned = True
 
@@ -212,6 +209,7 @@ class SimulationRunner:
                         if agv.status == 'MOVING':
                             others = other_positions - {agv.pos}
                             moved, new_pos = agv.move_step(world, others)
+                            self.agv_index[floor].update(agv.id, agv.pos)
                             
                             # 到達檢查
                             if agv.pos == agv.current_task['target_pos']:
@@ -235,6 +233,7 @@ class SimulationRunner:
                                 
                                 agv.status = 'IDLE'
                                 agv.current_task = None
+                                self.agv_index[floor].set_status(agv.id, 'idle')
                                 self.stats['completed'] += 1
                                 if is_delayed: self.stats['delayed'] += 1
                         
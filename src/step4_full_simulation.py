@@ -6,13 +6,30 @@ import heapq
 import csv
 import random
 import math
+import itertools
 from collections import defaultdict, deque, Counter
 from datetime import datetime, timedelta
 
+from engine import ingest
+from engine.loaders import load_shelf_coords, load_cell_shelf_map, load_inventory, outbound_records, inbound_records
+from engine.traffic_heatmap import TrafficHeatmap
+from engine.invariants import InvariantMonitor, InvariantViolation
+from engine.agv_index import AgvSpatialIndex, manhattan_kernel, bucket_ring
+from engine.storage_spots import ShelfOccupancy, StorageSpotFinder
+from engine.inventory_index import InventoryIndex
+from logic.batch_dispatch import BatchAssigner, TASK_DEADLINE_SEC
+from logic.tour import TourOptimizer, StationDistances
+from logic.consolidation import consolidate_tasks, report, CONSOLIDATE_WINDOW_SEC
+
 # ---------------- CONFIG ----------------
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
+ENABLE_TRAFFIC_HEATMAP = False # 模擬中累計交通熱區 (logs/traffic_heatmap.npz)；預設關閉
+INVARIANT_MODE = None # 線上不變量檢查：None = 關閉 / 'warn' = 只統計 / 'strict' = 第一個違規即中止
+DISPATCH_MODE = 'greedy' # 'greedy' = 最早空出的 AGV 拿佇列第一筆 / 'batch' = epoch 內最小成本指派 (logic/batch_dispatch)
+BATCH_LOOKAHEAD = 40 # 批次派車時往佇列後看幾筆
+TOUR_SKIP_WARN = 0.2 # 多站任務找不到料架座標的比例超過此值時警告
 # ----------------------------------------
 
 class BatchWriter:
@@ -148,11 +165,13 @@ class TimeAwareAStar:
 
 
 class TrafficController:
-    def __init__(self, grid, agv_state_pool, reservations):
+    def __init__(self, grid, agv_state_pool, reservations, agv_index=None):
         self.grid = grid
         self.rows, self.cols = grid.shape
         self.agv_pool = agv_state_pool 
         self.reservations = reservations
+        # pos -> AGV 即時佔用 (runner 每次提交位置都會更新)；「這格有沒有車」不再掃整個 agv_pool
+        self.agv_index = agv_index if agv_index is not None else AgvSpatialIndex.from_pool(grid, agv_state_pool)
 
     def clear_path_obstacles(self, start_pos, goal_pos, current_time, w_evt, floor, my_agv_name):
         blocker_id = None
@@ -168,12 +187,11 @@ class TrafficController:
             elif curr[1] > target[1]: curr[1] -= 1
             check_pos = tuple(curr)
             
-            for agv_id, state in self.agv_pool.items():
+            for agv_id in self.agv_index.at.get(check_pos, ()):
                 if f"AGV_{agv_id}" == my_agv_name: continue
-                if state['pos'] == check_pos:
-                    blocker_id = agv_id
-                    blocker_pos = check_pos
-                    break
+                blocker_id = agv_id
+                blocker_pos = check_pos
+                break
             if blocker_id: break
             steps_checked += 1
             
@@ -182,6 +200,7 @@ class TrafficController:
         sanctuary = self._find_sanctuary(blocker_pos, current_time)
         if sanctuary:
             self.agv_pool[blocker_id]['pos'] = sanctuary
+            self.agv_index.update(blocker_id, sanctuary)
             dist = abs(blocker_pos[0]-sanctuary[0]) + abs(blocker_pos[1]-sanctuary[1])
             cost = dist * 2.0 
             w_evt.writerow([
@@ -206,13 +225,8 @@ class TrafficController:
                 for t in range(3): 
                     if curr in self.reservations[current_time + t]:
                         is_reserved = True; break
-                if not is_reserved:
-                    is_occupied = False
-                    for state in self.agv_pool.values():
-                        if state['pos'] == curr:
-                            is_occupied = True; break
-                    if not is_occupied:
-                        return curr 
+                if not is_reserved and curr not in self.agv_index.at:
+                    return curr 
             for dr, dc in [(0,1), (0,-1), (1,0), (-1,0)]:
                 nr, nc = curr[0]+dr, curr[1]+dc
                 if 0<=nr<self.rows and 0<=nc<self.cols:
@@ -229,11 +243,7 @@ class TrafficController:
             nr, nc = current_pos[0]+dr, current_pos[1]+dc
             if 0 <= nr < self.rows and 0 <= nc < self.cols:
                 if self.grid[nr][nc] != -1:
-                    is_occupied = False
-                    for state in self.agv_pool.values():
-                        if state['pos'] == (nr, nc): is_occupied = True; break
-                    
-                    if not is_occupied:
+                    if (nr, nc) not in self.agv_index.at:
                         dist_to_goal = abs(nr - goal_pos[0]) + abs(nc - goal_pos[1])
                         if dist_to_goal > max_dist:
                             max_dist = dist_to_goal
@@ -251,27 +261,74 @@ class TrafficController:
         return False, current_pos, 0
 
 class CleanupManager:
-    def __init__(self):
-        self.pending_tasks = deque()
+    # 待歸位料架 (shuffle 暫放) 以格桶索引：最近查詢由 AGV 所在桶一圈圈向外找，移除 O(1)
+    # 每次排程迴圈都會查一次，shuffle 頻繁時佇列很長，不能再線性掃描
+    def __init__(self, bucket=4):
+        self.pending_tasks = {} # seq -> (buffer_pos, original_pos, shelf_id)，依加入順序
+        self.added_at = {}
+        self.buckets = defaultdict(dict) # (br, bc) -> {seq: None}
+        self.bucket = bucket
+        self.bounds = None # 出現過的桶範圍 [min_br, max_br, min_bc, max_bc]
+        self.seq = 0
+        self.now = 0
+        self.served = 0; self.wait_sum = 0; self.wait_max = 0
     
-    def add_task(self, buffer_pos, original_pos, shelf_id):
-        self.pending_tasks.append((buffer_pos, original_pos, shelf_id))
+    def _key(self, pos):
+        return (pos[0] // self.bucket, pos[1] // self.bucket)
+
+    def add_task(self, buffer_pos, original_pos, shelf_id, t=None):
+        seq = self.seq; self.seq += 1
+        if t is not None: self.now = max(self.now, t)
+        self.pending_tasks[seq] = (buffer_pos, original_pos, shelf_id)
+        self.added_at[seq] = self.now if t is None else t
+        key = self._key(buffer_pos)
+        self.buckets[key][seq] = None
+        b = self.bounds
+        if b is None: self.bounds = [key[0], key[0], key[1], key[1]]
+        else: b[0] = min(b[0], key[0]); b[1] = max(b[1], key[0]); b[2] = min(b[2], key[1]); b[3] = max(b[3], key[1])
     
-    def get_nearest_task(self, agv_pos):
+    def get_nearest_task(self, agv_pos, t=None):
         if not self.pending_tasks: return None
-        best_idx = -1
-        min_dist = float('inf')
-        for i, task in enumerate(self.pending_tasks):
-            buf_pos = task[0]
-            dist = abs(buf_pos[0]-agv_pos[0]) + abs(buf_pos[1]-agv_pos[1])
-            if dist < min_dist:
-                min_dist = dist
-                best_idx = i
-        if best_idx != -1:
-            task = self.pending_tasks[best_idx]
-            del self.pending_tasks[best_idx]
-            return task 
-        return None
+        if t is not None: self.now = max(self.now, t)
+        br, bc = self._key(agv_pos)
+        b = self.bounds
+        max_r = max(br - b[0], b[1] - br, bc - b[2], b[3] - bc, 0)
+        best = None # (dist, seq)，同距離取最早加入的
+        for r in range(max_r + 1):
+            for key in bucket_ring(br, bc, r):
+                bucket = self.buckets.get(key)
+                if not bucket: continue
+                for seq in bucket:
+                    buf_pos = self.pending_tasks[seq][0]
+                    cand = (abs(buf_pos[0]-agv_pos[0]) + abs(buf_pos[1]-agv_pos[1]), seq)
+                    if best is None or cand < best: best = cand
+            # 下一圈的距離至少 r*bucket+1
+            if best is not None and best[0] <= r * self.bucket: break
+        if best is None: return None
+        return self._pop(best[1], t)
+
+    def _pop(self, seq, t=None):
+        task = self.pending_tasks.pop(seq)
+        added = self.added_at.pop(seq)
+        key = self._key(task[0])
+        bucket = self.buckets[key]
+        del bucket[seq]
+        if not bucket: del self.buckets[key]
+        if t is not None:
+            wait = t - added
+            self.served += 1; self.wait_sum += wait; self.wait_max = max(self.wait_max, wait)
+        return task
+
+    def stats(self):
+        """佇列長度、最久一筆已等待秒數、已處理筆數與平均 / 最大等待"""
+        oldest = min(self.added_at.values()) if self.added_at else None
+        return {
+            'pending': len(self.pending_tasks),
+            'oldest_age': (self.now - oldest) if oldest is not None else 0,
+            'served': self.served,
+            'avg_wait': round(self.wait_sum / self.served, 1) if self.served else 0,
+            'max_wait': self.wait_max,
+        }
 
 class ShuffleManager:
     def __init__(self, grid, shelf_occupancy, pos_to_shelf_id_map, shelf_coords, cleanup_mgr):
@@ -324,7 +381,7 @@ class ShuffleManager:
         self.pos_to_id[buffer_pos] = sid_blk
         
         t += 5
-        self.cleanup_mgr.add_task(buffer_pos, blk_pos, sid_blk)
+        self.cleanup_mgr.add_task(buffer_pos, blk_pos, sid_blk, t)
         
         return True, t, curr
 
@@ -371,9 +428,10 @@ class ParkingManager:
         self.rows, self.cols = grid.shape
         self.valid_spots_list = list(valid_storage_spots)
     
-    def get_fast_parking_spot(self, agv_pool):
+    def get_fast_parking_spot(self, agv_pool, agv_index=None):
         attempts = 0
-        occupied_by_agvs = {s['pos'] for s in agv_pool.values()}
+        # 有 AGV 空間索引時直接用它的 pos -> AGV 佔用表，不再每次重建集合
+        occupied_by_agvs = agv_index.at if agv_index is not None else {s['pos'] for s in agv_pool.values()}
         while attempts < 20:
             spot = random.choice(self.valid_spots_list)
             # [修正] 只要沒有「其他 AGV」，就可以停！
@@ -533,9 +591,16 @@ class PhysicalQueueManager:
             print(f"🧹 [Ghost Buster] 已強制驅魔工作站 {sid} 的排隊區")
 
 class OrderProcessor:
-    def __init__(self, stations_2f, stations_3f):
+    def __init__(self, stations_2f, stations_3f, grids=None, shelf_coords=None):
         self.stations = {'2F': list(stations_2f.keys()), '3F': list(stations_3f.keys())}
         self.cust_station_map = {'2F': {}, '3F': {}} 
+        # 多站料架的巡迴排序 (有地圖時才啟用)：從料架位置出發走最短的站序
+        self.shelf_coords = shelf_coords or {}
+        self.tours = {}
+        for floor, sts in [('2F', stations_2f), ('3F', stations_3f)]:
+            if grids and floor in grids and sts:
+                self.tours[floor] = TourOptimizer(StationDistances(grids[floor], {k: v['pos'] for k, v in sts.items()}))
+        self.tour_report = defaultdict(lambda: {'tasks': 0, 'before': 0, 'after': 0, 'skipped': 0}) # wave_id -> 多站任務數 / 原順序步數 / 排序後步數 / 無料架座標略過數
 
     def process_wave(self, wave_orders, floor):
         wave_custs = wave_orders['PARTCUSTID'].unique()
@@ -592,23 +657,59 @@ class OrderProcessor:
             if current_st is not None:
                 proc_time = self._calc_time(current_sku_group)
                 stops.append({'station': current_st, 'face': current_face, 'time': proc_time})
+            wave_id = orders[0]['order_row'].get('WAVE_ID')
+            stops = self._order_tour(floor, shelf_id, stops, wave_id)
             final_tasks.append({
                 'shelf_id': shelf_id, 'stops': stops,
-                'wave_id': orders[0]['order_row'].get('WAVE_ID'),
+                'wave_id': wave_id,
                 'raw_orders': [o['order_row'] for o in orders],
                 'datetime': task_dt
             })
         return final_tasks
 
+    def _order_tour(self, floor, shelf_id, stops, wave_id):
+        tour = self.tours.get(floor)
+        if tour is None or len({s['station'] for s in stops}) < 2: return stops
+        start = self.shelf_coords.get(shelf_id, {}).get('pos')
+        rep = self.tour_report[wave_id]
+        if start is None:
+            # 料架不在座標表 (無起點)：各站序距離都一樣，維持原順序並記為略過
+            rep['skipped'] += 1
+            return stops
+        stops, before, after = tour.order_stops(start, stops)
+        rep['tasks'] += 1; rep['before'] += before; rep['after'] += after
+        return stops
+
+    def tour_summary(self, top=5):
+        if not self.tour_report: return
+        before = sum(r['before'] for r in self.tour_report.values())
+        after = sum(r['after'] for r in self.tour_report.values())
+        tasks = sum(r['tasks'] for r in self.tour_report.values())
+        skipped = sum(r['skipped'] for r in self.tour_report.values())
+        pct = (1 - after / before) * 100 if before else 0
+        print(f"🧭 [Tour] 多站料架任務 {tasks} 筆 | 站間行駛 {before} -> {after} 格 (省 {before - after} 格, {pct:.1f}%)")
+        if skipped:
+            ratio = skipped / (tasks + skipped)
+            if ratio >= TOUR_SKIP_WARN:
+                print(f"⚠️ [Tour] {skipped}/{tasks + skipped} ({ratio:.0%}) 多站料架任務找不到料架座標，未做巡迴排序！"
+                      f" 請確認 shelf_coordinate_map.csv 的 shelf_id 與 LOC 前 9 碼一致 (step1 產出)")
+            else:
+                print(f"   -> 無料架座標略過 {skipped} 筆")
+        ranked = sorted(self.tour_report.items(), key=lambda kv: kv[1]['before'] - kv[1]['after'], reverse=True)
+        for wid, r in ranked[:top]:
+            if r['before'] == r['after']: break
+            print(f"   -> 波次 {wid}: {r['tasks']} 筆 | {r['before']} -> {r['after']} 格 (省 {r['before'] - r['after']})")
+
     def _calc_time(self, sku_group):
         total_time = 0
         for sku, count in sku_group.items(): total_time += 15 + (count * 5)
         return total_time
 
 class LiveMonitor:
-    def __init__(self):
+    def __init__(self, invariants=None):
         self.stats = {'Load':0, 'Visit':0, 'Return':0, 'Park':0}
         self.teleports = Counter()
+        self.invariants = invariants
         self.start_time = time.time()
     
     def log_success(self, category):
@@ -620,15 +721,17 @@ class LiveMonitor:
     def print_status(self, done_count, total_tasks, agv_pool, cleaners):
         elapsed = time.time() - self.start_time
         active_agvs = sum(1 for s in agv_pool.values() if s['time'] > 0)
-        trash_count = len(cleaners.pending_tasks)
+        trash = cleaners.stats()
         top_errors = self.teleports.most_common(3)
         err_str = " | ".join([f"{k}:{v}" for k,v in top_errors])
-        print(f"\n[{elapsed:.0f}s] {done_count}/{total_tasks} | 🚗 Act:{active_agvs} Trash:{trash_count}")
+        print(f"\n[{elapsed:.0f}s] {done_count}/{total_tasks} | 🚗 Act:{active_agvs} Trash:{trash['pending']} (最久 {trash['oldest_age']}s, 平均等待 {trash['avg_wait']}s)")
         print(f"   📊 S:{self.stats['Load']}/{self.stats['Visit']}/{self.stats['Return']}/{self.stats['Park']}")
         print(f"   ⚠️ Err: {err_str}")
+        if self.invariants: print(f"   🛡️ Inv: {self.invariants.summary_line()}")
 
 class AdvancedSimulationRunner:
-    def __init__(self):
+    def __init__(self, heatmap=ENABLE_TRAFFIC_HEATMAP, invariants=INVARIANT_MODE, dispatch=DISPATCH_MODE,
+                 consolidate_window=CONSOLIDATE_WINDOW_SEC):
         print(f"🚀 [Step 4] 啟動進階模擬 (V67: Strict Capacity 4)...")
         
         self.grid_2f = self._load_map_correct('2F_map.xlsx', 32, 61)
@@ -637,7 +740,7 @@ class AdvancedSimulationRunner:
         self.reservations_2f = defaultdict(set)
         self.reservations_3f = defaultdict(set)
         self.shelf_coords = self._load_shelf_coords()
-        self.shelf_occupancy = {'2F': set(), '3F': set()}
+        self.shelf_occupancy = {'2F': ShelfOccupancy(self.grid_2f.shape), '3F': ShelfOccupancy(self.grid_3f.shape)}
         self.valid_storage_spots = {'2F': set(), '3F': set()}
         self.pos_to_sid_2f = {}
         self.pos_to_sid_3f = {}
@@ -664,13 +767,16 @@ class AdvancedSimulationRunner:
             
         self.inventory_map = self._load_inventory() 
         self.all_tasks_raw = self._load_all_tasks()
+        self.stations = self._init_stations()
+        self.inventory_index = InventoryIndex(self.inventory_map, self.shelf_coords,
+                                              {'2F': self.grid_2f, '3F': self.grid_3f}, self.stations,
+                                              self._load_cell_shelf_map())
         self._assign_locations_smartly(self.all_tasks_raw)
         
-        self.stations = self._init_stations()
         st_2f = {k:v for k,v in self.stations.items() if v['floor']=='2F'}
         st_3f = {k:v for k,v in self.stations.items() if v['floor']=='3F'}
         
-        self.processor = OrderProcessor(st_2f, st_3f)
+        self.processor = OrderProcessor(st_2f, st_3f, {'2F': self.grid_2f, '3F': self.grid_3f}, self.shelf_coords)
         
         self.used_spots_2f = set()
         self.used_spots_3f = set()
@@ -680,13 +786,23 @@ class AdvancedSimulationRunner:
             '3F': {i: {'time': 0, 'pos': self._get_strict_spawn_spot(self.grid_3f, self.used_spots_3f, '3F')} for i in range(101, 119)}
         }
         
+        self.agv_index = {'2F': AgvSpatialIndex.from_pool(self.grid_2f, self.agv_state['2F']),
+                          '3F': AgvSpatialIndex.from_pool(self.grid_3f, self.agv_state['3F'])}
+        # 歸還點評分：曼哈頓距離 d < 5 的每台 AGV 加 (10-d)*5 擁擠懲罰
+        self.storage_finder = {
+            floor: StorageSpotFinder(grid, grid == 1, self.shelf_occupancy[floor],
+                                     self.agv_index[floor].add_density(manhattan_kernel(4, lambda d: (10 - d) * 5)),
+                                     self.agv_index[floor].at)
+            for floor, grid in [('2F', self.grid_2f), ('3F', self.grid_3f)]
+        }
+        
         self.cleaner_2f = CleanupManager()
         self.cleaner_3f = CleanupManager()
         
         self.shuffler_2f = ShuffleManager(self.grid_2f, self.shelf_occupancy['2F'], self.pos_to_sid_2f, self.shelf_coords, self.cleaner_2f)
         self.shuffler_3f = ShuffleManager(self.grid_3f, self.shelf_occupancy['3F'], self.pos_to_sid_3f, self.shelf_coords, self.cleaner_3f)
-        self.traffic_2f = TrafficController(self.grid_2f, self.agv_state['2F'], self.reservations_2f)
-        self.traffic_3f = TrafficController(self.grid_3f, self.agv_state['3F'], self.reservations_3f)
+        self.traffic_2f = TrafficController(self.grid_2f, self.agv_state['2F'], self.reservations_2f, self.agv_index['2F'])
+        self.traffic_3f = TrafficController(self.grid_3f, self.agv_state['3F'], self.reservations_3f, self.agv_index['3F'])
         
         self.parking_2f = ParkingManager(self.grid_2f, self.valid_storage_spots['2F'], self.shelf_occupancy['2F'])
         self.parking_3f = ParkingManager(self.grid_3f, self.valid_storage_spots['3F'], self.shelf_occupancy['3F'])
@@ -706,51 +822,26 @@ class AdvancedSimulationRunner:
             if 'RECEIVING' in wid: self.recv_totals[d_str] = self.recv_totals.get(d_str, 0) + 1
             else: self.wave_totals[wid] = self.wave_totals.get(wid, 0) + 1
             
-        self.monitor = LiveMonitor()
+        self.invariants = InvariantMonitor({'2F': self.grid_2f, '3F': self.grid_3f}, self.shelf_occupancy,
+                                           strict=(invariants == 'strict')) if invariants else None
+        self.monitor = LiveMonitor(self.invariants)
+        self.batch = {f: BatchAssigner(self.agv_index[f]) for f in ['2F', '3F']} if dispatch == 'batch' else None
+        self.heatmap = TrafficHeatmap() if heatmap else None
+        self.consolidate_window = consolidate_window
 
     def _load_inventory(self):
         path = os.path.join(BASE_DIR, 'data', 'master', 'item_inventory.csv')
-        inv = defaultdict(list)
-        try:
-            df = pd.read_csv(path, dtype=str)
-            cols = [c.upper() for c in df.columns]
-            part_col = next((c for c in cols if 'PART' in c), None)
-            cell_col = next((c for c in cols if 'CELL' in c or 'LOC' in c), None)
-            if part_col and cell_col:
-                for _, r in df.iterrows():
-                    inv[str(r[part_col]).strip()].append(str(r[cell_col]).strip())
-        except: pass
-        return inv
+        try: return load_inventory(path)
+        except: return defaultdict(list)
 
     def _load_all_tasks(self):
         tasks = []
+        # 型別與時間欄由 engine/ingest schema 處理 (內容未變時直接讀取快取)
         path_out = os.path.join(BASE_DIR, 'data', 'transaction', 'wave_orders.csv')
-        try:
-            df_out = pd.read_csv(path_out)
-            df_out.columns = [c.upper() for c in df_out.columns]
-            date_col = next((c for c in df_out.columns if 'DATETIME' == c), None)
-            if not date_col: date_col = next((c for c in df_out.columns if 'DATE' in c or 'TIME' in c), None)
-            if date_col:
-                df_out['datetime'] = pd.to_datetime(df_out[date_col])
-                df_out = df_out.dropna(subset=['datetime'])
-                if 'LOC' not in df_out.columns: df_out['LOC'] = ''
-                tasks.extend(df_out.to_dict('records'))
+        try: tasks.extend(outbound_records(ingest.load_table('wave_orders', path_out)))
         except: pass
         path_in = os.path.join(BASE_DIR, 'data', 'transaction', 'historical_receiving_ex.csv')
-        try:
-            df_in = pd.read_csv(path_in)
-            df_in.columns = [c.upper() for c in df_in.columns]
-            cols = df_in.columns
-            date_col = next((c for c in cols if 'DATE' in c), None)
-            part_col = next((c for c in cols if 'ITEM' in c or 'PART' in c), None)
-            if date_col and part_col:
-                df_in['datetime'] = pd.to_datetime(df_in[date_col])
-                df_in = df_in.dropna(subset=['datetime'])
-                df_in['PARTNO'] = df_in[part_col]
-                df_in['WAVE_ID'] = 'RECEIVING_' + df_in['datetime'].dt.strftime('%Y%m%d')
-                df_in['PARTCUSTID'] = 'REC_VENDOR'
-                if 'LOC' not in df_in.columns: df_in['LOC'] = ''
-                tasks.extend(df_in.to_dict('records'))
+        try: tasks.extend(inbound_records(ingest.load_table('receiving', path_in)))
         except: pass
         tasks.sort(key=lambda x: x['datetime'])
         return tasks 
@@ -772,9 +863,9 @@ class AdvancedSimulationRunner:
             if part in part_shelf_map:
                 t['LOC'] = part_shelf_map[part]
             else:
-                cands = self.inventory_map.get(part, [])
-                if cands:
-                    chosen = cands[0] 
+                # 多個儲位時選離工作站最近的料架 (此時客戶尚未分站，以最近的任一站計)
+                chosen = self.inventory_index.choose(part)
+                if chosen:
                     t['LOC'] = chosen
                     part_shelf_map[part] = chosen
                 elif valid_shelves:
@@ -797,36 +888,10 @@ class AdvancedSimulationRunner:
             return cand
         return (0, 0)
 
-    def _find_smart_storage_spot(self, start_pos, valid_spots, occupied_spots, shelf_occupied_spots, agv_pool, grid, limit=50):
-        if start_pos is None: return list(valid_spots)[:5]
-        candidates = []
-        agv_positions = [s['pos'] for s in agv_pool.values()]
-        
-        sample_spots = random.sample(list(valid_spots), min(limit*2, len(valid_spots)))
-        
-        for spot in sample_spots:
-            if spot not in shelf_occupied_spots and spot not in occupied_spots:
-                dist = abs(spot[0]-start_pos[0]) + abs(spot[1]-start_pos[1])
-                crowd_penalty = 0
-                for apos in agv_positions:
-                    d = abs(spot[0]-apos[0]) + abs(spot[1]-apos[1])
-                    if d < 5: crowd_penalty += (10 - d) * 5 
-                
-                obstacle_count = 0
-                for dr, dc in [(0,1),(0,-1),(1,0),(-1,0)]:
-                    nr, nc = spot[0]+dr, spot[1]+dc
-                    if not (0<=nr<grid.shape[0] and 0<=nc<grid.shape[1]): obstacle_count+=1
-                    elif grid[nr][nc] == -1: obstacle_count+=1
-                    elif (nr, nc) in shelf_occupied_spots: obstacle_count+=1
-                
-                island_penalty = 0
-                if obstacle_count >= 3: island_penalty = 1000 
-                
-                total_score = dist + crowd_penalty + island_penalty + random.uniform(0, 10)
-                candidates.append((total_score, spot))
-        
-        candidates.sort(key=lambda x: x[0])
-        top_candidates = [x[1] for x in candidates[:limit]]
+    def _find_smart_storage_spot(self, floor, start_pos, limit=50):
+        if start_pos is None: return list(self.valid_storage_spots[floor])[:5]
+        # 全部空儲位 (無料架、無 AGV) 一次評分：距離 + 擁擠度 + 孤島懲罰 (3 面以上被擋) + 隨機擾動
+        top_candidates = self.storage_finder[floor].best(start_pos, k=limit, island_penalty=1000, noise=10, exclude_agvs=True)
         if top_candidates:
             return [random.choice(top_candidates)]
         return []
@@ -847,13 +912,13 @@ class AdvancedSimulationRunner:
 
     def _load_shelf_coords(self):
         path = os.path.join(BASE_DIR, 'data', 'mapping', 'shelf_coordinate_map.csv')
-        coords = {}
-        try:
-            df = pd.read_csv(path)
-            for _, r in df.iterrows():
-                coords[str(r['shelf_id'])] = {'floor': r['floor'], 'pos': (int(r['y']), int(r['x']))}
-        except: pass
-        return coords
+        try: return load_shelf_coords(path, pos_order='rc', keep='last')
+        except: return {}
+
+    def _load_cell_shelf_map(self):
+        path = os.path.join(BASE_DIR, 'data', 'mapping', 'shelf_coordinate_map.csv')
+        try: return load_cell_shelf_map(path)
+        except: return {}
 
     def _init_stations(self):
         sts = {}
@@ -902,6 +967,50 @@ class AdvancedSimulationRunner:
             ])
         if path:
             res_table[path[-1][1]].add(path[-1][0])
+        if self.heatmap: self.heatmap.add_path(floor, path)
+        if self.invariants: self.invariants.on_path(floor, agv_id, path)
+
+    def _commit_pos(self, floor, agv_id, pos, status=None):
+        # 位置提交一律經過這裡，同步 AGV 空間索引
+        self.agv_state[floor][agv_id]['pos'] = pos
+        self.agv_index[floor].update(agv_id, pos, status)
+
+    def _station_visits(self, task):
+        """stops -> [(站, 工時)]；同站相鄰的 face 停靠點合併成一次到站 (工時相加)"""
+        visits = []
+        for s in task['stops']:
+            if visits and visits[-1][0] == s['station']: visits[-1][1] += s['time']
+            else: visits.append([s['station'], s['time']])
+        return visits
+
+    def _batch_task_index(self, floor, agv_id, queue, q_mgr, z_mgr, now):
+        # 批次派車：回傳這台 AGV 該領的佇列位置 (None = 讓給計畫中較近的車，原地等)
+        ba = self.batch[floor]
+        cands = {}
+        for i, task in enumerate(itertools.islice(queue, BATCH_LOOKAHEAD)):
+            st = task['stops'][0]['station']
+            # 錯樓層 / 無座標的任務交給原本的流程處理掉
+            if st not in q_mgr.station_queues or task['shelf_id'] not in self.shelf_coords: return i
+            rel = (task['datetime'] - self.base_time).total_seconds() if task.get('datetime') else 0
+            if rel > now + ba.epoch_sec or not z_mgr.can_enter(st): continue
+            cands[id(task)] = (i, task) # 佇列位置隨候選一起帶著，不用 queue.index (dict 依值比較會找錯)
+        if not cands: return 0
+        def build():
+            tasks = [{'key': k, 'pos': self.shelf_coords[t['shelf_id']]['pos'],
+                      'deadline': ((t['datetime'] - self.base_time).total_seconds() if t.get('datetime') else 0) + TASK_DEADLINE_SEC}
+                     for k, (_, t) in cands.items()]
+            return ba.window_agvs(self.agv_state[floor], now), tasks
+        key, greedy = ba.choose(now, agv_id, cands, build)
+        if greedy: return 0
+        if key is None: return None
+        i, task = cands[key]
+        ba.take(agv_id, ba.travel_cells(self.agv_state[floor][agv_id]['pos'], self.shelf_coords[task['shelf_id']]['pos']))
+        return i
+
+    def _lock_spot(self, res_table, floor, pos, start_t, duration, agv_id=None):
+        for t in range(start_t, start_t + duration): res_table[t].add(pos)
+        if self.heatmap: self.heatmap.add_lock(floor, pos, start_t, duration)
+        if self.invariants: self.invariants.on_lock(floor, agv_id, pos, start_t, start_t + duration)
 
     def _cleanup_reservations(self, res_table, limit_time):
         cutoff = limit_time - 60
@@ -940,10 +1049,7 @@ class AdvancedSimulationRunner:
             path, _ = astar.find_path(curr, target, t, is_loaded=loaded, ignore_dynamic=False)
             
             if not path and is_returning and retry_count > 1:
-                 new_candidates = self._find_smart_storage_spot(
-                    curr, self.valid_storage_spots[floor], 
-                    {s['pos'] for k,s in agv_pool.items()}, self.shelf_occupancy[floor], agv_pool, grid, limit=30
-                 )
+                 new_candidates = self._find_smart_storage_spot(floor, curr, limit=30)
                  if new_candidates:
                     target = new_candidates[0]
                     retry_count = 0 
@@ -987,15 +1093,13 @@ class AdvancedSimulationRunner:
                 arrival_pos = path[-1][0]
                 
                 # 鎖定未來 2 分鐘 (或直到下一次移動解鎖)
-                for lock_t in range(arrival_t, arrival_t + 120):
-                    res_table[lock_t].add(arrival_pos)
+                self._lock_spot(res_table, floor, arrival_pos, arrival_t, 120, agv_name.replace("AGV_", ""))
 
                 t = arrival_t
                 curr = target
             else:
                 backoff_time = min(2 ** retry_count, 5) 
-                for k in range(backoff_time):
-                    res_table[t + k].add(curr)
+                self._lock_spot(res_table, floor, curr, t, backoff_time, agv_name.replace("AGV_", ""))
                 t += backoff_time
                 retry_count += 1
                     
@@ -1013,6 +1117,7 @@ class AdvancedSimulationRunner:
             f_kpi = open(os.path.join(LOG_DIR, 'simulation_kpi.csv'), 'w', newline='', encoding='utf-8')
             w_kpi = csv.writer(f_kpi)
             w_kpi.writerow(['finish_time', 'type', 'wave_id', 'is_delayed', 'date', 'workstation', 'total_in_wave', 'deadline_ts'])
+            if self.invariants: self.invariants.on_stop = lambda: (w_evt.flush(), f_kpi.flush())
 
             df_tasks = pd.DataFrame(self.all_tasks_raw)
             grouped_waves = df_tasks.groupby('WAVE_ID')
@@ -1025,6 +1130,12 @@ class AdvancedSimulationRunner:
                 wave_3f = wave_df[wave_df['LOC'].str.startswith('3')].copy()
                 task_queue_2f.extend(self.processor.process_wave(wave_2f, '2F'))
                 task_queue_3f.extend(self.processor.process_wave(wave_3f, '3F'))
+            self.processor.tour_summary()
+            # 跨波次併單：相鄰波次同料架、同工作站的任務合成一趟 (KPI 仍依各自波次 / 截止時間)
+            merged_2f, st_2f = consolidate_tasks(list(task_queue_2f), self.consolidate_window)
+            merged_3f, st_3f = consolidate_tasks(list(task_queue_3f), self.consolidate_window)
+            report(st_2f, '2F'); report(st_3f, '3F')
+            task_queue_2f, task_queue_3f = deque(merged_2f), deque(merged_3f)
                 
             total_tasks = len(task_queue_2f) + len(task_queue_3f)
             
@@ -1076,7 +1187,7 @@ class AdvancedSimulationRunner:
                     current_t = agv_ready_time
                     
                     # Cleanup Priority (閒置車支援搬運路障)
-                    cleanup_task = cleaner.get_nearest_task(agv_pos)
+                    cleanup_task = cleaner.get_nearest_task(agv_pos, current_t)
                     if cleanup_task:
                         buf_pos, orig_pos, sid = cleanup_task
                         path, end_t = astar.find_path(agv_pos, buf_pos, current_t, False, ignore_dynamic=True)
@@ -1095,14 +1206,20 @@ class AdvancedSimulationRunner:
                                 if sid != "Unknown":
                                     if floor == '2F': self.pos_to_sid_2f[orig_pos] = sid
                                     else: self.pos_to_sid_3f[orig_pos] = sid
-                                self.agv_state[floor][best_agv]['pos'] = orig_pos
+                                self._commit_pos(floor, best_agv, orig_pos, 'idle')
                                 self.agv_state[floor][best_agv]['time'] = end_t2 + 5
                                 continue 
                     
                     if not queue: break
                     
-                    # Peek Task
-                    task = queue[0]
+                    # Peek Task (批次派車時可能不是佇列第一筆)
+                    task_idx = 0
+                    if self.batch:
+                        task_idx = self._batch_task_index(floor, best_agv, queue, q_mgr, z_mgr, current_t)
+                        if task_idx is None:
+                            self.agv_state[floor][best_agv]['time'] += 5
+                            continue
+                    task = queue[task_idx]
                     
                     # --- [V65 Feature] 歷史時間鎖 ---
                     task_dt = task.get('datetime')
@@ -1112,12 +1229,12 @@ class AdvancedSimulationRunner:
                             current_t = int(task_relative_sec)
                     # --------------------------------
 
-                    target_st = task['stops'][-1]['station']
+                    target_st = task['stops'][0]['station'] # 第一站 (多站任務依 stops 順序逐站拜訪)
                     
                     # [V65 防呆] 樓層檢查
                     if target_st not in q_mgr.station_queues:
                         print(f"🚨 [CRITICAL] 樓層錯誤派單！AGV_{best_agv} ({floor}) 接到去 {target_st} 的任務。跳過。")
-                        queue.popleft() 
+                        del queue[task_idx]
                         continue
 
                     # ----------------------------------------------------
@@ -1176,7 +1293,7 @@ class AdvancedSimulationRunner:
                         continue
                     
                     # 成功取得排隊位置
-                    task = queue.popleft() 
+                    del queue[task_idx]
                     
                     shelf_id = task['shelf_id']
                     if shelf_id not in self.shelf_coords: 
@@ -1195,81 +1312,86 @@ class AdvancedSimulationRunner:
                     if tele_1: stats['Load'] += 1
                     self.monitor.log_success('Load')
                     
+                    if self.invariants: self.invariants.on_shelf(floor, best_agv, shelf_pos, current_t, load=True)
                     w_evt.writerow([self.to_dt(current_t), self.to_dt(current_t+5), floor, f"AGV_{best_agv}", shelf_pos[1], shelf_pos[0], shelf_pos[1], shelf_pos[0], 'SHELF_LOAD', f"Task_{done_count}"])
                     current_t += 5
                     if shelf_pos in self.shelf_occupancy[floor]: self.shelf_occupancy[floor].remove(shelf_pos)
+                    self.agv_index[floor].set_status(best_agv, 'loaded')
                     current_shelf_pos = shelf_pos
                     
-                    # 2. Visit Station (with Queuing)
-                    queue_wait_start = current_t
-                    while True:
-                        if current_t - queue_wait_start > 600:
-                             w_evt.writerow([self.to_dt(current_t), self.to_dt(current_t), floor, f"AGV_{best_agv}", current_shelf_pos[1], current_shelf_pos[0], current_shelf_pos[1], current_shelf_pos[0], 'FORCE_TELE', 'Queue Stuck'])
-                             self.monitor.log_teleport('QUEUE', 'TimeOut')
-                             q_data = q_mgr.station_queues.get(target_st)
-                             if q_data and best_agv in q_data['occupants']:
-                                idx = q_data['occupants'].index(best_agv)
-                                q_data['occupants'][idx] = None
-                             break
-
-                        next_q_pos, is_processing = q_mgr.get_target_for_agv(target_st, best_agv)
+                    # 2. Visit Stations (with Queuing)：依 stops 順序逐站排隊、揀貨、離站 (同站相鄰的 face 合併為一次到站)
+                    for v_idx, (target_st, stop_time) in enumerate(self._station_visits(task)):
+                        if v_idx > 0:
+                            # 下一站的區域門票 (第一站已在派工時取得)；逾時仍強制進入，避免料架卡在途中
+                            zone_wait_start = current_t
+                            while not z_mgr.can_enter(target_st) and current_t - zone_wait_start <= 600:
+                                self._lock_spot(res_table, floor, current_shelf_pos, current_t, 5, best_agv)
+                                current_t += 5
+                            z_mgr.enter(target_st)
+                        tele_2 = False
+                        queue_wait_start = current_t
+                        while True:
+                            if current_t - queue_wait_start > 600:
+                                 w_evt.writerow([self.to_dt(current_t), self.to_dt(current_t), floor, f"AGV_{best_agv}", current_shelf_pos[1], current_shelf_pos[0], current_shelf_pos[1], current_shelf_pos[0], 'FORCE_TELE', 'Queue Stuck'])
+                                 self.monitor.log_teleport('QUEUE', 'TimeOut')
+                                 q_data = q_mgr.station_queues.get(target_st)
+                                 if q_data and best_agv in q_data['occupants']:
+                                    idx = q_data['occupants'].index(best_agv)
+                                    q_data['occupants'][idx] = None
+                                 break
+
+                            next_q_pos, is_processing = q_mgr.get_target_for_agv(target_st, best_agv)
                                                 
-                        if not next_q_pos:
-                            # 即使是原地等待 retry，也要鎖定位置
-                            for t in range(current_t, current_t + 5):
-                                res_table[t].add(current_shelf_pos)
-                            current_t += 5
-                            continue
+                            if not next_q_pos:
+                                # 即使是原地等待 retry，也要鎖定位置
+                                self._lock_spot(res_table, floor, current_shelf_pos, current_t, 5, best_agv)
+                                current_t += 5
+                                continue
                             
-                        current_shelf_pos, current_t, tele_2 = self._move_agv_segment(
-                            current_shelf_pos, next_q_pos, current_t, True, f"AGV_{best_agv}",
-                            floor, astar, shuffler, traffic, w_evt, res_table, grid, reason_label="QUEUE"
-                        )
+                            current_shelf_pos, current_t, tele_2 = self._move_agv_segment(
+                                current_shelf_pos, next_q_pos, current_t, True, f"AGV_{best_agv}",
+                                floor, astar, shuffler, traffic, w_evt, res_table, grid, reason_label="QUEUE"
+                            )
                         
-                        q_mgr.update_position(target_st, best_agv, next_q_pos)
+                            q_mgr.update_position(target_st, best_agv, next_q_pos)
                         
-                        if is_processing:
-                            break 
-                        else:
-                            # [修正] 鎖定位置，防止被後車追撞
-                            for t in range(current_t, current_t + 5):
-                                res_table[t].add(current_shelf_pos)
-                            current_t += 5
+                            if is_processing:
+                                break 
+                            else:
+                                # [修正] 鎖定位置，防止被後車追撞
+                                self._lock_spot(res_table, floor, current_shelf_pos, current_t, 5, best_agv)
+                                current_t += 5
                     
-                    # Arrived at Station Processing
-                    if tele_2: stats['Visit'] += 1 
-                    self.monitor.log_success('Visit')
+                        # Arrived at Station Processing
+                        if tele_2: stats['Visit'] += 1 
+                        self.monitor.log_success('Visit')
                     
-                    q_mgr.set_processing_time(target_st, current_t)
-
-                    stop_time = task['stops'][0]['time'] 
-                    leave_t = current_t + stop_time
-                    wid = task['wave_id']
-                    w_type = "IN" if "RECEIVING" in str(wid) else "OUT"
-                    w_evt.writerow([self.to_dt(current_t), self.to_dt(leave_t), floor, f"WS_{target_st}", current_shelf_pos[1], current_shelf_pos[0], current_shelf_pos[1], current_shelf_pos[0], 'STATION_STATUS', f'BLUE|{w_type}|{wid}'])
-                    w_evt.writerow([self.to_dt(current_t), self.to_dt(leave_t), floor, f"AGV_{best_agv}", current_shelf_pos[1], current_shelf_pos[0], current_shelf_pos[1], current_shelf_pos[0], 'PICKING', f"Processing"])
-                    for t in range(current_t, int(leave_t)): res_table[t].add(current_shelf_pos)
-                    current_t = int(leave_t)
+                        q_mgr.set_processing_time(target_st, current_t)
+
+                        leave_t = current_t + stop_time
+                        wid = task['wave_id']
+                        w_type = "IN" if "RECEIVING" in str(wid) else "OUT"
+                        w_evt.writerow([self.to_dt(current_t), self.to_dt(leave_t), floor, f"WS_{target_st}", current_shelf_pos[1], current_shelf_pos[0], current_shelf_pos[1], current_shelf_pos[0], 'STATION_STATUS', f'BLUE|{w_type}|{wid}'])
+                        w_evt.writerow([self.to_dt(current_t), self.to_dt(leave_t), floor, f"AGV_{best_agv}", current_shelf_pos[1], current_shelf_pos[0], current_shelf_pos[1], current_shelf_pos[0], 'PICKING', f"Processing"])
+                        self._lock_spot(res_table, floor, current_shelf_pos, current_t, int(leave_t) - current_t, best_agv)
+                        current_t = int(leave_t)
                     
-                    # Release Station
-                    q_mgr.release_station(target_st, best_agv)
+                        # Release Station
+                        q_mgr.release_station(target_st, best_agv)
                     
-                    # [V66] 任務完成，離開區域，歸還門票 (Exit Zone)
-                    z_mgr.exit(target_st)
+                        # [V66] 本站完成，離開區域，歸還門票 (Exit Zone)
+                        z_mgr.exit(target_st)
 
-                    exit_pos = q_mgr.get_exit_spot(target_st)
+                        exit_pos = q_mgr.get_exit_spot(target_st)
                     
-                    if exit_pos:
-                        current_shelf_pos, current_t, _ = self._move_agv_segment(
-                            current_shelf_pos, exit_pos, current_t, True, f"AGV_{best_agv}",
-                            floor, astar, shuffler, traffic, w_evt, res_table, grid, reason_label="EXIT"
-                        )
+                        if exit_pos:
+                            current_shelf_pos, current_t, _ = self._move_agv_segment(
+                                current_shelf_pos, exit_pos, current_t, True, f"AGV_{best_agv}",
+                                floor, astar, shuffler, traffic, w_evt, res_table, grid, reason_label="EXIT"
+                            )
                     
                     # 3. Return
-                    candidates = self._find_smart_storage_spot(
-                        current_shelf_pos, self.valid_storage_spots[floor], 
-                        {s['pos'] for k,s in agv_pool.items()}, self.shelf_occupancy[floor], agv_pool, grid, limit=20
-                    )
+                    candidates = self._find_smart_storage_spot(floor, current_shelf_pos, limit=20)
                     if not candidates: candidates = [shelf_pos]
                     drop_pos = candidates[0]
                     if grid[drop_pos[0]][drop_pos[1]] == -1: drop_pos = self._get_strict_spawn_spot(grid, set(), floor)
@@ -1282,27 +1404,20 @@ class AdvancedSimulationRunner:
                     if tele_3: stats['Return'] += 1
                     self.monitor.log_success('Return')
 
+                    if self.invariants: self.invariants.on_shelf(floor, best_agv, drop_pos, current_t, load=False)
                     w_evt.writerow([self.to_dt(current_t), self.to_dt(current_t+5), floor, f"AGV_{best_agv}", drop_pos[1], drop_pos[0], drop_pos[1], drop_pos[0], 'SHELF_UNLOAD', 'Done'])
                     current_t += 5
                     
                     self.shelf_occupancy[floor].add(drop_pos)
                     self.shelf_coords[shelf_id]['pos'] = drop_pos
-                    self.agv_state[floor][best_agv]['pos'] = drop_pos
+                    self._commit_pos(floor, best_agv, drop_pos, 'idle')
                     self.agv_state[floor][best_agv]['time'] = current_t
                         
                     # 4. Park
-                    park_spot = parking.get_fast_parking_spot(agv_pool)
+                    park_spot = parking.get_fast_parking_spot(agv_pool, self.agv_index[floor])
                     
                     if not park_spot:
-                        fallback_cands = self._find_smart_storage_spot(
-                            drop_pos, 
-                            self.valid_storage_spots[floor], 
-                            {s['pos'] for k,s in agv_pool.items()}, 
-                            self.shelf_occupancy[floor], 
-                            agv_pool, 
-                            grid, 
-                            limit=5
-                        )
+                        fallback_cands = self._find_smart_storage_spot(floor, drop_pos, limit=5)
                         if fallback_cands:
                             park_spot = fallback_cands[0]
                             print(f"⚠️ AGV_{best_agv} 找不到停車位，暫時前往流浪點 {park_spot}")
@@ -1314,7 +1429,7 @@ class AdvancedSimulationRunner:
                             is_returning=False, agv_pool=agv_pool, reason_label="PARK_FINAL"
                         )
                         if not tele_4:
-                            self.agv_state[floor][best_agv]['pos'] = park_spot
+                            self._commit_pos(floor, best_agv, park_spot, 'parked')
                             self.agv_state[floor][best_agv]['time'] = current_t
                             w_evt.writerow([self.to_dt(current_t), self.to_dt(current_t+1), floor, f"AGV_{best_agv}", park_spot[1], park_spot[0], park_spot[1], park_spot[0], 'PARKING', 'Hidden'])
                             stats['Park'] += 1
@@ -1323,14 +1438,22 @@ class AdvancedSimulationRunner:
                         self.monitor.log_teleport('PARK', 'NoSpot')
 
 
+                    line_deadline = {ln['wave_id']: ln['deadline'] for ln in task.get('lines') or ()}
+                    visited = {s['station'] for s in task['stops']}
+                    cust_st = self.processor.cust_station_map.get(floor, {})
                     for raw_o in task['raw_orders']:
                         wid = raw_o.get('WAVE_ID', 'UNK')
                         ttype = 'INBOUND' if 'RECEIVING' in wid else 'OUTBOUND'
                         total_wave_count = self.wave_totals.get(wid, 0)
-                        deadline_dt = self.to_dt(0) + timedelta(hours=4)
-                        st_label = f"WS_{task['stops'][-1]['station']}" 
+                        # 各明細依自己波次的 WAVE_DEADLINE 判斷延遲 (無截止時間的波次才用預設 4 小時)
+                        deadline_dt = line_deadline.get(wid)
+                        if deadline_dt is None: deadline_dt = self.to_dt(0) + timedelta(hours=4)
+                        is_delayed = 'Y' if self.to_dt(current_t) > deadline_dt else 'N'
+                        # KPI 標在該明細客戶被分配的工作站 (即實際揀貨的那一站)
+                        row_st = cust_st.get(raw_o.get('PARTCUSTID'))
+                        st_label = f"WS_{row_st if row_st in visited else task['stops'][-1]['station']}" 
                         w_kpi.writerow([
-                            self.to_dt(current_t), ttype, wid, 'N', 
+                            self.to_dt(current_t), ttype, wid, is_delayed, 
                             self.to_dt(current_t).date(), st_label, 
                             total_wave_count, deadline_dt
                         ])
@@ -1338,11 +1461,20 @@ class AdvancedSimulationRunner:
                     done_count += 1
                     if done_count % 50 == 0 or done_count == total_tasks: 
                         self._cleanup_reservations(res_table, current_t)
+                        if self.invariants: self.invariants.prune(floor, min(s['time'] for s in agv_pool.values()))
                         self.monitor.print_status(done_count, total_tasks, agv_pool, cleaner)
 
             w_evt.close()
             f_kpi.close()
+            if self.heatmap:
+                print(f"🔥 交通熱區: {self.heatmap.save(LOG_DIR, self.base_time)}")
+            if self.invariants: self.invariants.print_report()
+            if self.batch:
+                for f, ba in self.batch.items(): print(f"🧮 批次派車 {f}: {ba.summary_line()}")
             print(f"\n✅ 模擬完成！ Total Teleports: {sum(stats.values())}")
 
 if __name__ == "__main__":
-    AdvancedSimulationRunner().run()
\ No newline at end of file
+    try:
+        AdvancedSimulationRunner().run()
+    except InvariantViolation as e:
+        print(f"\n🛑 [Strict] 不變量違規，模擬中止: {e}")
\ No newline at end of file
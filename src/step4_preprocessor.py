@@ -1,19 +1,63 @@
 import pandas as pd
 import numpy as np
 import os
-import pickle
-import random
+import gc
+import zlib
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 
+from engine.sim_store import write_sim_store
+from engine import ingest
+from engine.loaders import load_shelf_coords, load_cell_shelf_map, load_inventory, outbound_frame, inbound_frame
+from engine.inventory_index import InventoryIndex
+from logic.consolidation import consolidate_tasks, report, CONSOLIDATE_WINDOW_SEC
+
 # ---------------- CONFIG ----------------
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
-OUTPUT_FILE = os.path.join(BASE_DIR, 'processed_sim_data.pkl')
+# memory-mappable 資料集目錄 (取代舊的 processed_sim_data.pkl)
+OUTPUT_DIR = os.path.join(BASE_DIR, 'processed_sim_data')
+FILL_SEED = 0 # 無庫存料號隨機補位的種子 (固定種子 -> 每次執行輸出相同)
+
+
+def _text_codes(df, name, default='', strip=False):
+    """
+    欄位 -> (每列代碼, 字串 uniques)，字串同 str(row.get(name, default))：缺欄 = default，缺值 = 'nan'
+    字串運算只對 uniques 做；strip 後相同的值合併成同一個代碼
+    """
+    if name not in df.columns: return np.zeros(len(df), dtype=np.int64), np.array([default], dtype=object)
+    codes, uniq = pd.factorize(df[name], use_na_sentinel=False)
+    text = [str(u).strip() if strip else str(u) for u in uniq]
+    remap, names = pd.factorize(pd.Series(text, dtype=object))
+    return remap[codes].astype(np.int64), np.asarray(names, dtype=object)
+
+
+@contextmanager
+def gc_paused():
+    """大量建立任務 dict 時暫停循環 GC (物件只增不減，反覆掃描是白做工)"""
+    was_on = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_on: gc.enable()
+
+
+def route_stations(cust_ids, stations):
+    """
+    客戶 -> 工作站：stations[crc32(客戶代碼) % 站數]
+    取代 Python hash() (每個行程的 salt 不同，同一份資料每次跑分站都不一樣)；每個客戶只算一次
+    """
+    codes, uniq = pd.factorize(pd.Series(cust_ids), use_na_sentinel=False)
+    idx = np.array([zlib.crc32(str(c).encode('utf-8')) % len(stations) for c in uniq], dtype=np.int64)
+    return np.asarray(stations, dtype=object)[idx[codes]]
+
 
 class Preprocessor:
-    def __init__(self):
+    def __init__(self, consolidate_window=CONSOLIDATE_WINDOW_SEC):
         print("🚀 [Preprocessor] 初始化資料處理模組...")
+        self.consolidate_window = consolidate_window # 跨波次併單窗口 (秒)，0 = 關閉
         self.grid_2f = self._load_map('2F_map.xlsx', 32, 61)
         self.grid_3f = self._load_map('3F_map.xlsx', 32, 61)
         self.shelf_coords = self._load_shelf_coords()
@@ -21,6 +65,9 @@ class Preprocessor:
         
         # 建立站點資訊
         self.stations = self._init_stations()
+        self.inventory_index = InventoryIndex(self.inventory_map, self.shelf_coords,
+                                              {'2F': self.grid_2f, '3F': self.grid_3f}, self.stations,
+                                              load_cell_shelf_map(os.path.join(DATA_DIR, 'mapping', 'shelf_coordinate_map.csv')))
         
     def _load_map(self, filename, rows, cols):
         path = os.path.join(DATA_DIR, 'master', filename)
@@ -39,51 +86,15 @@ class Preprocessor:
 
     def _load_shelf_coords(self):
         path = os.path.join(DATA_DIR, 'mapping', 'shelf_coordinate_map.csv')
-        coords = {}
-        if os.path.exists(path):
-            df = pd.read_csv(path)
-            # [FIX] 強制轉大寫，避免 Key Error
-            df.columns = [c.upper().strip() for c in df.columns]
-            
-            # 嘗試找正確的欄位名 (相容不同命名習慣)
-            col_shelf = next((c for c in df.columns if 'SHELF' in c), 'SHELF_ID')
-            col_floor = next((c for c in df.columns if 'FLOOR' in c), 'FLOOR')
-            col_x = next((c for c in df.columns if c == 'X'), 'X')
-            col_y = next((c for c in df.columns if c == 'Y'), 'Y')
-
-            for _, r in df.iterrows():
-                try:
-                    coords[str(r[col_shelf])] = {'floor': r[col_floor], 'pos': (int(r[col_y]), int(r[col_x]))}
-                except KeyError:
-                    pass # 略過欄位對不上的 row
-        return coords
+        return load_shelf_coords(path, pos_order='rc', keep='last')
 
     def _load_inventory(self):
         path = os.path.join(DATA_DIR, 'master', 'item_inventory.csv')
-        inv = defaultdict(list)
-        if os.path.exists(path):
-            try:
-                df = pd.read_csv(path, dtype=str)
-                # [FIX] 關鍵修正：直接修改 DataFrame 的 columns 為全大寫
-                df.columns = [c.upper().strip() for c in df.columns]
-                
-                cols = df.columns
-                part_col = next((c for c in cols if 'PART' in c), None)
-                cell_col = next((c for c in cols if 'CELL' in c or 'LOC' in c), None)
-                
-                if part_col and cell_col:
-                    print(f"   -> Inventory 欄位對應: Part='{part_col}', Loc='{cell_col}'")
-                    for _, r in df.iterrows():
-                        val_part = r[part_col]
-                        val_cell = r[cell_col]
-                        if pd.notna(val_part) and pd.notna(val_cell):
-                            inv[str(val_part).strip()].append(str(val_cell).strip())
-                else:
-                    print(f"⚠️ Inventory 欄位對應失敗。現有欄位: {cols}")
-            except Exception as e:
-                print(f"⚠️ 讀取 Inventory 失敗: {e}")
-
-        return inv
+        try:
+            return load_inventory(path, verbose=True)
+        except Exception as e:
+            print(f"⚠️ 讀取 Inventory 失敗: {e}")
+            return defaultdict(list)
 
     def _init_stations(self):
         sts = {}
@@ -97,171 +108,174 @@ class Preprocessor:
                         sts[f"{floor}_{cnt}"] = {'floor': floor, 'pos': (r, c)}
         return sts
 
+    def _station_lists(self):
+        return {'2F': [k for k,v in self.stations.items() if v['floor']=='2F'],
+                '3F': [k for k,v in self.stations.items() if v['floor']=='3F']}
+
     def _load_and_consolidate_orders(self):
         print("📦 正在讀取並合併訂單 (Order Batching)...")
-        tasks_raw = []
+        frames = []
         
-        # 1. 讀取 Outbound
-        path_out = os.path.join(DATA_DIR, 'transaction', 'wave_orders.csv')
-        if os.path.exists(path_out):
-            try:
-                df = pd.read_csv(path_out)
-                # [FIX] 強制轉大寫
-                df.columns = [c.upper().strip() for c in df.columns]
-                
-                date_col = next((c for c in df.columns if 'DATETIME' == c), None)
-                if not date_col:
-                    date_col = next((c for c in df.columns if 'DATE' in c), None)
-                
-                if date_col:
-                    df['datetime'] = pd.to_datetime(df[date_col])
-                    df = df.dropna(subset=['datetime'])
-                    if 'LOC' not in df.columns: df['LOC'] = ''
-                    tasks_raw.extend(df.to_dict('records'))
-                else:
-                    print(f"⚠️ wave_orders.csv 找不到時間欄位 (DATETIME)")
-            except Exception as e:
-                print(f"⚠️ 讀取 wave_orders 錯誤: {e}")
+        # 1. 讀取 Outbound (型別與時間欄已由 ingest schema 處理)
+        try:
+            df = ingest.load_table('wave_orders', os.path.join(DATA_DIR, 'transaction', 'wave_orders.csv'))
+            frames.append(outbound_frame(df))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ 讀取 wave_orders 錯誤: {e}")
         
         # 2. 讀取 Inbound (Receiving)
-        path_in = os.path.join(DATA_DIR, 'transaction', 'historical_receiving_ex.csv')
-        if os.path.exists(path_in):
-            try:
-                df_in = pd.read_csv(path_in)
-                # [FIX] 強制轉大寫
-                df_in.columns = [c.upper().strip() for c in df_in.columns]
-                
-                cols = df_in.columns
-                date_col = next((c for c in cols if 'DATE' in c), None)
-                part_col = next((c for c in cols if 'ITEM' in c or 'PART' in c), None)
-                
-                if date_col and part_col:
-                    df_in['datetime'] = pd.to_datetime(df_in[date_col])
-                    df_in['PARTNO'] = df_in[part_col]
-                    df_in['WAVE_ID'] = 'RECEIVING_' + df_in['datetime'].dt.strftime('%Y%m%d')
-                    df_in['PARTCUSTID'] = 'REC_VENDOR'
-                    if 'LOC' not in df_in.columns: df_in['LOC'] = ''
-                    tasks_raw.extend(df_in.to_dict('records'))
-            except Exception as e:
-                print(f"⚠️ 讀取 historical_receiving 錯誤: {e}")
+        try:
+            df_in = ingest.load_table('receiving', os.path.join(DATA_DIR, 'transaction', 'historical_receiving_ex.csv'))
+            frames.append(inbound_frame(df_in))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ 讀取 historical_receiving 錯誤: {e}")
         
-        if not tasks_raw:
+        frames = [f for f in frames if len(f)]
+        if not frames:
             print("⚠️ 無任何訂單資料！")
+            self.items_df = pd.DataFrame()
             return {'2F': [], '3F': []}, datetime.now()
 
-        tasks_raw.sort(key=lambda x: x['datetime'])
-        base_time = tasks_raw[0]['datetime']
+        # RangeIndex：列位置即 item_rows
+        df_tasks = pd.concat(frames, ignore_index=True).sort_values('datetime', kind='stable').reset_index(drop=True)
+        base_time = df_tasks['datetime'].iloc[0]
         
         # --- 智慧併單 (Consolidation) ---
         print("   -> 進行庫存匹配與併單運算...")
-        part_shelf_map = {}
-        valid_shelves = list(self.shelf_coords.keys())
+        self._fill_locations(df_tasks)
+        self.items_df = df_tasks
+        final_queues = self._build_queues(df_tasks)
         
-        # 先掃描一次有 LOC 的，建立 PART -> LOC 的對應 (黏滯性)
-        for t in tasks_raw:
-            part = str(t.get('PARTNO', '')).strip()
-            loc = str(t.get('LOC', '')).strip()
-            if len(loc) >= 5: # 假設至少要有長度
-                part_shelf_map[part] = loc 
-        
-        # 填補沒有 LOC 的訂單
-        for t in tasks_raw:
-            loc = str(t.get('LOC', '')).strip()
-            if len(loc) < 5:
-                part = str(t.get('PARTNO', '')).strip()
-                if part in part_shelf_map:
-                    t['LOC'] = part_shelf_map[part]
-                elif part in self.inventory_map and self.inventory_map[part]:
-                    chosen = self.inventory_map[part][0]
-                    t['LOC'] = chosen
-                    part_shelf_map[part] = chosen
-                elif valid_shelves:
-                    # 隨機分配一個假位置，避免當機 (格式: SHELF-FACE-BIN)
-                    rand_shelf = random.choice(valid_shelves)
-                    t['LOC'] = f"{rand_shelf}-A-01"
-
-        # 轉換為 AGV 任務格式
-        df_tasks = pd.DataFrame(tasks_raw)
-        final_queues = {'2F': [], '3F': []}
-        
-        if 'WAVE_ID' not in df_tasks.columns:
-            df_tasks['WAVE_ID'] = 'DEFAULT_WAVE'
-            
-        grouped = df_tasks.groupby('WAVE_ID')
-        
-        st_lists = {'2F': [k for k,v in self.stations.items() if v['floor']=='2F'],
-                    '3F': [k for k,v in self.stations.items() if v['floor']=='3F']}
-        
-        for wave_id, wave_df in grouped:
-            for floor in ['2F', '3F']:
-                # 篩選屬於該樓層的訂單 (依據 LOC 開頭)
-                # 假設 2F 的 loc 開頭是 '2'，3F 是 '3'
-                prefix = floor[0]
-                f_df = wave_df[wave_df['LOC'].str.startswith(prefix, na=False)].copy()
-                
-                if f_df.empty: continue
-                
-                avail_sts = st_lists[floor]
-                if not avail_sts: continue
-                
-                # 依據貨架合併任務 (Batching by Shelf)
-                shelf_tasks = defaultdict(list)
-                for i, row in f_df.iterrows():
-                    loc = str(row['LOC'])
-                    # 假設 Shelf ID 是前 9 碼 (例如: 2F-01-01)
-                    # 這裡做個防呆，如果長度不夠就整串當 ID
-                    shelf_id = loc[:9] if len(loc) >= 9 else loc
-                    
-                    cust_id = str(row.get('PARTCUSTID', 'UNK'))
-                    target_st = avail_sts[hash(cust_id) % len(avail_sts)]
-                    
-                    shelf_tasks[shelf_id].append({
-                        'station': target_st,
-                        'qty': row.get('QTY', 1),
-                        'row': row
-                    })
-                
-                # 生成最終任務物件
-                for sid, items in shelf_tasks.items():
-                    target_st = items[0]['station']
-                    proc_time = 15 + (len(items) * 5)
-                    
-                    # 找出最早的時間當作任務時間
-                    min_dt = min([x['row']['datetime'] for x in items])
+        # 跨波次併單：同料架、同工作站且在窗口內釋出的任務合成一趟 (line 截止時間取該波次的 WAVE_DEADLINE)
+        deadlines = self._wave_deadlines(df_tasks)
+        for f in final_queues:
+            final_queues[f], st = consolidate_tasks(final_queues[f], self.consolidate_window,
+                                                    lambda t: deadlines.get(t['wave_id']))
+            report(st, f)
 
-                    task_obj = {
-                        'task_id': f"{wave_id}_{sid}",
-                        'type': 'ORDER',
-                        'shelf_id': sid,
-                        'wave_id': wave_id,
-                        'priority': 10,
-                        'stops': [{'station': target_st, 'time': proc_time}],
-                        'datetime': min_dt,
-                        'raw_items': [x['row'] for x in items]
-                    }
-                    final_queues[floor].append(task_obj)
-                    
         # 排序
         for f in final_queues:
             final_queues[f].sort(key=lambda x: x['datetime'])
             
         return final_queues, base_time
 
+    def _wave_deadlines(self, df):
+        """WAVE_ID -> 第一筆有值的 WAVE_DEADLINE (入庫等無截止時間的波次不列入)"""
+        if 'WAVE_DEADLINE' not in df.columns: return {}
+        d = df[['WAVE_ID', 'WAVE_DEADLINE']].dropna().drop_duplicates('WAVE_ID')
+        return dict(zip(d['WAVE_ID'].astype(object), d['WAVE_DEADLINE']))
+
+    def _fill_locations(self, df):
+        """補 LOC (欄位層級)：同料號沿用已知儲位 (黏滯性) -> 有庫存選最近工作站的儲位 -> 固定種子隨機假位置"""
+        part, part_names = _text_codes(df, 'PARTNO', strip=True)
+        lc, loc_u = _text_codes(df, 'LOC', strip=True)
+        has = np.array([len(x) >= 5 for x in loc_u], dtype=bool)[lc] # 假設至少要有長度
+        # 有 LOC 的明細建立 PART -> LOC 的對應 (同料號以最後一筆為準)
+        sticky = np.full(len(part_names), -1, dtype=np.int64)
+        idx = np.flatnonzero(has)[::-1]
+        if len(idx):
+            p_u, last = np.unique(part[idx], return_index=True)
+            sticky[p_u] = lc[idx[last]]
+        miss = ~has
+        hit = miss & (sticky[part] >= 0)
+        if hit.any(): df.loc[hit, 'LOC'] = loc_u[sticky[part[hit]]]
+
+        rest = miss & ~hit
+        inv = rest & np.array([bool(self.inventory_map.get(n)) for n in part_names], dtype=bool)[part]
+        if inv.any():
+            # 有庫存的料號：每組 (料號, 客戶) 批次選一次離該客戶工作站 (各樓層各一站) 最近的儲位
+            cc, cust_u = _text_codes(df, 'PARTCUSTID', 'UNK')
+            pair = part[inv] * len(cust_u) + cc[inv]
+            uniq, inverse = np.unique(pair, return_inverse=True)
+            u_part, u_cust = uniq // len(cust_u), uniq % len(cust_u)
+            routed = {f: route_stations(cust_u, sts)[u_cust] for f, sts in self._station_lists().items() if sts}
+            targets = [dict(zip(routed, sts)) for sts in zip(*routed.values())] if routed else None
+            cells = np.array(self.inventory_index.choose_many(part_names[u_part].tolist(), targets), dtype=object)
+            df.loc[inv, 'LOC'] = cells[inverse.reshape(-1)]
+
+        rand = rest & ~inv
+        valid_shelves = list(self.shelf_coords.keys())
+        if rand.any() and valid_shelves:
+            # 隨機分配一個假位置，避免當機 (格式: SHELF-FACE-BIN)；固定種子讓每次輸出相同
+            fake = np.array([f"{sid}-A-01" for sid in valid_shelves], dtype=object)
+            df.loc[rand, 'LOC'] = fake[np.random.default_rng(FILL_SEED).integers(len(fake), size=int(rand.sum()))]
+
+    def _build_queues(self, df):
+        """
+        (波次, 樓層, 料架) 一次分組：明細數、最早時間、第一筆的工作站，工時 = 15 + 5 * 明細數
+        字串運算只對 LOC / 客戶的 uniques 做，分組用整數 key 排序
+        任務順序同舊版：波次 (排序) -> 2F / 3F -> 料架在該波次首次出現的順序
+        """
+        final_queues = {'2F': [], '3F': []}
+        if 'WAVE_ID' not in df.columns:
+            df['WAVE_ID'] = 'DEFAULT_WAVE'
+        st_lists = self._station_lists()
+        floors = [f for f in ('2F', '3F') if st_lists[f]]
+
+        # 依 LOC 開頭決定樓層 (2F 開頭 '2'，3F 開頭 '3')；Shelf ID 取前 9 碼，長度不夠就整串當 ID
+        lc, loc_u = _text_codes(df, 'LOC')
+        fl_u = np.array([next((i for i, f in enumerate(floors) if x.startswith(f[0])), -1) for x in loc_u], dtype=np.int64)
+        sk_u, shelf_names = pd.factorize(pd.Series([x[:9] for x in loc_u], dtype=object))
+        wc, wave_names = pd.factorize(df['WAVE_ID'], sort=True) # 波次代碼即排序後順序；缺值 = -1
+        fl = fl_u[lc]
+        pos = np.flatnonzero((wc >= 0) & (fl >= 0))
+        if not len(pos): return final_queues
+
+        n_shelf = len(shelf_names)
+        key = (wc[pos].astype(np.int64) * len(floors) + fl[pos]) * n_shelf + sk_u[lc[pos]]
+        order = np.argsort(key, kind='stable') # 群組內維持原列順序
+        pos, key = pos[order], key[order]
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        counts = np.diff(np.r_[starts, len(key)])
+        first = pos[starts]
+        g_wave, g_fl = wc[first], fl[first]
+        dt_ns = df['datetime'].to_numpy().astype('datetime64[ns]').view(np.int64)
+        g_dt = pd.to_datetime(np.minimum.reduceat(dt_ns[pos], starts)).to_pydatetime()
+
+        # 分站：每個客戶只算一次 crc32
+        cc, cust_u = _text_codes(df, 'PARTCUSTID', 'UNK')
+        routed = [route_stations(cust_u, st_lists[f]) for f in floors]
+        g_st = [routed[f][c] for f, c in zip(g_fl.tolist(), cc[first].tolist())]
+
+        rows = pos.tolist()
+        bounds = np.r_[starts, len(pos)].tolist()
+        g_wid = np.asarray(wave_names, dtype=object)[g_wave].tolist()
+        g_sid = np.asarray(shelf_names, dtype=object)[sk_u[lc[first]]].tolist()
+        g_floor = np.array(floors, dtype=object)[g_fl].tolist()
+        counts = counts.tolist()
+        with gc_paused():
+            for g in np.lexsort((first, g_fl, g_wave)).tolist():
+                wave_id, sid, n = g_wid[g], g_sid[g], counts[g]
+                final_queues[g_floor[g]].append({
+                    'task_id': f"{wave_id}_{sid}",
+                    'type': 'ORDER',
+                    'shelf_id': sid,
+                    'wave_id': wave_id,
+                    'priority': 10,
+                    'stops': [{'station': g_st[g], 'time': 15 + n * 5}],
+                    'datetime': g_dt[g],
+                    'item_rows': rows[bounds[g]:bounds[g + 1]]
+                })
+        return final_queues
+
     def run(self):
-        queues, base_dt = self._load_and_consolidate_orders()
-        
-        data = {
-            'grid_2f': self.grid_2f,
-            'grid_3f': self.grid_3f,
-            'stations': self.stations,
-            'shelf_coords': self.shelf_coords,
-            'queues': queues,
-            'base_time': base_dt
-        }
-        
-        with open(OUTPUT_FILE, 'wb') as f:
-            pickle.dump(data, f)
-        print(f"✅ 資料處理完成！已儲存至 {OUTPUT_FILE}")
+        with gc_paused():
+            queues, base_dt = self._load_and_consolidate_orders()
+            
+            write_sim_store(
+                OUTPUT_DIR,
+                grids={'2F': self.grid_2f, '3F': self.grid_3f},
+                stations=self.stations,
+                shelf_coords=self.shelf_coords,
+                queues=queues,
+                base_time=base_dt,
+                items_df=self.items_df
+            )
+        print(f"✅ 資料處理完成！已儲存至 {OUTPUT_DIR}")
         print(f"   - 2F 任務數: {len(queues['2F'])}")
         print(f"   - 3F 任務數: {len(queues['3F'])}")
 
@@ -5,15 +5,25 @@ import time
 import heapq
 import csv
 import random
-import pickle
 from collections import defaultdict, deque, Counter
 from datetime import datetime, timedelta
 
+from engine.sim_store import SimStore
+from engine.traffic_heatmap import TrafficHeatmap
+from engine.invariants import InvariantMonitor, InvariantViolation
+from engine.agv_index import AgvSpatialIndex, box_kernel
+from engine.storage_spots import ShelfOccupancy, StorageSpotFinder
+from logic.batch_dispatch import BatchAssigner, TASK_DEADLINE_SEC
+
 # ---------------- CONFIG ----------------
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
-INPUT_FILE = os.path.join(BASE_DIR, 'processed_sim_data.pkl')
+INPUT_DIR = os.path.join(BASE_DIR, 'processed_sim_data')
 os.makedirs(LOG_DIR, exist_ok=True)
+STORAGE_CROWD_WEIGHT = 20 # 歸還點評分：每台 5x5 範圍內的 AGV 加 20 分
+ENABLE_TRAFFIC_HEATMAP = False # 模擬中累計交通熱區 (logs/traffic_heatmap.npz)；預設關閉
+INVARIANT_MODE = None # 線上不變量檢查：None = 關閉 / 'warn' = 只統計 / 'strict' = 第一個違規即中止
+DISPATCH_MODE = 'greedy' # 'greedy' = 最早空出的 AGV 拿分數最好的站 / 'batch' = epoch 內最小成本指派 (logic/batch_dispatch)
 
 # ---------------- 核心演算法 ----------------
 
@@ -242,15 +252,23 @@ class BatchWriter:
 # ---------------- 主模擬器 ----------------
 
 class SimulationRunner:
-    def __init__(self):
+    def __init__(self, heatmap=ENABLE_TRAFFIC_HEATMAP, invariants=INVARIANT_MODE, dispatch=DISPATCH_MODE):
         print(f"🚀 [Core] 啟動模擬核心 (V7.3: Strict Quota + Yield/Retry)...")
         self._load_data()
         self.reservations = {'2F': defaultdict(set), '3F': defaultdict(set)}
         self.edge_reservations = {'2F': defaultdict(set), '3F': defaultdict(set)}
-        self.shelf_occupancy = {'2F': set(), '3F': set()}
+        self.shelf_occupancy = {'2F': ShelfOccupancy(np.asarray(self.grid_2f).shape[:2]), '3F': ShelfOccupancy(np.asarray(self.grid_3f).shape[:2])}
         self.pos_to_sid = {'2F': {}, '3F': {}}
         self._init_shelves()
         self.agv_state = self._init_agvs()
+        self.agv_index = {'2F': AgvSpatialIndex.from_pool(self.grid_2f, self.agv_state['2F']),
+                          '3F': AgvSpatialIndex.from_pool(self.grid_3f, self.agv_state['3F'])}
+        self.storage_finder = {}
+        for floor, grid in [('2F', self.grid_2f), ('3F', self.grid_3f)]:
+            grid = np.asarray(grid)
+            storage = np.zeros(grid.shape[:2], dtype=bool); storage[:32, :61] = grid[:32, :61] == 1
+            density = self.agv_index[floor].add_density(box_kernel(2, STORAGE_CROWD_WEIGHT))
+            self.storage_finder[floor] = StorageSpotFinder(grid, storage, self.shelf_occupancy[floor], density)
         st_2f = {k:v for k,v in self.stations.items() if v['floor']=='2F'}
         st_3f = {k:v for k,v in self.stations.items() if v['floor']=='3F'}
         self.qm = {'2F': PhysicalQueueManager(st_2f), '3F': PhysicalQueueManager(st_3f)}
@@ -272,28 +290,46 @@ class SimulationRunner:
         self.wave_totals = Counter()
         for floor in ['2F', '3F']:
             for t in self.queues[floor]:
-                wid = t.get('wave_id', 'UNK')
-                self.wave_totals[wid] += 1
+                # 跨波次併單的任務依各 line 的波次計數
+                for ln in t.get('lines') or [t]:
+                    self.wave_totals[ln.get('wave_id', 'UNK')] += 1
         
         self.rescue_locks = set()
+        self.heatmap = TrafficHeatmap() if heatmap else None
+        self.invariants = InvariantMonitor({'2F': self.grid_2f, '3F': self.grid_3f}, self.shelf_occupancy,
+                                           strict=(invariants == 'strict')) if invariants else None
+        if self.invariants: self.invariants.on_stop = lambda: (self.event_writer.f.flush(), self.kpi_writer.f.flush())
+        self.batch = {f: BatchAssigner(self.agv_index[f]) for f in ['2F', '3F']} if dispatch == 'batch' else None
 
     def _load_data(self):
-        with open(INPUT_FILE, 'rb') as f: data = pickle.load(f)
-        self.grid_2f = data['grid_2f']; self.grid_3f = data['grid_3f']
-        self.stations = data['stations']; self.shelf_coords = data['shelf_coords']
-        self.queues = {'2F': deque(data['queues']['2F']), '3F': deque(data['queues']['3F'])}
-        self.base_time = data['base_time']
+        # mmap 開啟：地圖/料架/任務欄位不需反序列化，明細 (raw_items) 延遲載入
+        self.store = SimStore(INPUT_DIR)
+        self.grid_2f = self.store.grid('2F'); self.grid_3f = self.store.grid('3F')
+        self.stations = self.store.stations; self.shelf_coords = self.store.shelf_coords()
+        self.queues = {'2F': deque(self.store.iter_tasks('2F')), '3F': deque(self.store.iter_tasks('3F'))}
+        self.base_time = self.store.base_time
         self.valid_spots = {'2F': [], '3F': []}
-        for r in range(32):
-            for c in range(61):
-                if self.grid_2f[r][c] == 1: self.valid_spots['2F'].append((r,c))
-                if self.grid_3f[r][c] == 1: self.valid_spots['3F'].append((r,c))
+        for floor, grid in [('2F', self.grid_2f), ('3F', self.grid_3f)]:
+            rr, cc = np.nonzero(np.asarray(grid)[:32, :61] == 1)
+            self.valid_spots[floor] = list(zip(rr.tolist(), cc.tolist()))
 
     def _init_shelves(self):
-        for sid, info in self.shelf_coords.items():
-            f, p = info['floor'], info['pos']
-            if f == '2F' and self.grid_2f[p[0]][p[1]] != -1: self.shelf_occupancy['2F'].add(p); self.pos_to_sid['2F'][p] = sid
-            elif f == '3F' and self.grid_3f[p[0]][p[1]] != -1: self.shelf_occupancy['3F'].add(p); self.pos_to_sid['3F'][p] = sid
+        # 向量化：同一格有多個料架時，保留原始順序中最後一個 (與舊版 dict 迭代相同)
+        ids, fl, pos, rank = self.store.shelf_arrays()
+        for fc, floor in enumerate(self.store.floors):
+            grid = np.asarray(self.grid_2f if floor == '2F' else self.grid_3f)
+            idx = np.nonzero(np.asarray(fl) == fc)[0]
+            if len(idx) == 0: continue
+            p = np.asarray(pos)[idx]
+            ok = (p[:, 0] >= 0) & (p[:, 0] < grid.shape[0]) & (p[:, 1] >= 0) & (p[:, 1] < grid.shape[1])
+            ok[ok] = grid[p[ok, 0], p[ok, 1]] != -1
+            idx, p = idx[ok], p[ok]
+            order = np.argsort(np.asarray(rank)[idx], kind='stable')[::-1]
+            _, first = np.unique(p[order], axis=0, return_index=True)
+            for i in order[first]:
+                cell = (int(pos[idx[i]][0]), int(pos[idx[i]][1]))
+                self.shelf_occupancy[floor].add(cell)
+                self.pos_to_sid[floor][cell] = ids[idx[i]].decode('utf-8')
 
     def _init_agvs(self):
         states = {'2F': {}, '3F': {}}
@@ -312,10 +348,17 @@ class SimulationRunner:
 
     def to_dt(self, sec): return self.base_time + timedelta(seconds=sec)
 
-    def _lock_spot(self, floor, pos, start_t, duration):
+    def _commit_pos(self, floor, agv_id, pos, status=None):
+        # 位置提交一律經過這裡，同步 AGV 空間索引
+        self.agv_state[floor][agv_id]['pos'] = pos
+        self.agv_index[floor].update(agv_id, pos, status)
+
+    def _lock_spot(self, floor, pos, start_t, duration, agv_id=None):
         end_t = start_t + duration
         for t in range(int(start_t), int(end_t) + 1):
             self.reservations[floor][t].add(pos)
+        if self.heatmap: self.heatmap.add_lock(floor, pos, start_t, int(end_t) - int(start_t) + 1)
+        if self.invariants: self.invariants.on_lock(floor, agv_id, pos, int(start_t), int(end_t) + 1)
 
     def write_move(self, path, floor, agv_id, res_table, edge_res_table):
         if not path: return
@@ -329,23 +372,13 @@ class SimulationRunner:
                 'AGV_MOVE', ''
             ])
         res_table[path[-1][1]].add(path[-1][0])
+        if self.heatmap: self.heatmap.add_path(floor, path)
+        if self.invariants: self.invariants.on_path(floor, agv_id, path)
 
-    def _find_smart_storage_spot(self, floor, start_pos, agv_pool, avoid_pos=None):
-        grid = self.grid_2f if floor=='2F' else self.grid_3f
-        candidates = []
-        heatmap = Counter()
-        for s in agv_pool.values():
-            r, c = s['pos']
-            for dr in range(-2, 3):
-                 for dc in range(-2, 3):
-                     heatmap[(r+dr, c+dc)] += 1
-        samples = random.sample(self.valid_spots[floor], min(30, len(self.valid_spots[floor])))
-        for spot in samples:
-            if spot in self.shelf_occupancy[floor] or spot == avoid_pos or grid[spot[0]][spot[1]] == -1: continue
-            dist = abs(spot[0]-start_pos[0]) + abs(spot[1]-start_pos[1])
-            candidates.append((dist + heatmap[spot]*20, spot))
-        candidates.sort(key=lambda x: x[0])
-        return candidates[0][1] if candidates else start_pos
+    def _find_smart_storage_spot(self, floor, start_pos, avoid_pos=None):
+        # 全部空儲位一次評分 (距離 + AGV 5x5 擁擠度)，不再隨機抽 30 點
+        best = self.storage_finder[floor].best(start_pos, avoid=(avoid_pos,))
+        return best[0] if best else start_pos
 
     def _move_agv(self, floor, agv_id, target, loaded, astar):
         state = self.agv_state[floor][agv_id]
@@ -353,7 +386,7 @@ class SimulationRunner:
         path, end_t, end_dir = astar.find_path(curr, target, curr_t, curr_dir, is_loaded=loaded)
         if path:
             self.write_move(path, floor, agv_id, self.reservations[floor], self.edge_reservations[floor])
-            state['pos'] = target; state['time'] = end_t; state['dir'] = end_dir
+            self._commit_pos(floor, agv_id, target); state['time'] = end_t; state['dir'] = end_dir
             return True, None
         else:
             if loaded:
@@ -362,23 +395,34 @@ class SimulationRunner:
                     for p, t in path_s:
                         if p in self.shelf_occupancy[floor] and p != curr and p != target: return False, {'type': 'BLOCKED', 'pos': p}
             
-            self._lock_spot(floor, curr, curr_t, 10) 
+            self._lock_spot(floor, curr, curr_t, 10, agv_id)
             state['time'] += 5
             return False, {'type': 'WAIT'}
 
-    def _find_closest_idle_agv(self, floor, target_pos, exclude_agv_id):
-        agv_pool = self.agv_state[floor]
-        best_agv = None
-        min_dist = float('inf')
-        
-        for aid, s in agv_pool.items():
-            if aid == exclude_agv_id: continue
-            if s.get('task') is not None: continue 
-            dist = abs(s['pos'][0]-target_pos[0]) + abs(s['pos'][1]-target_pos[1])
-            if dist < min_dist:
-                min_dist = dist
-                best_agv = aid
-        return best_agv
+    def _find_closest_idle_agv(self, floor, target_pos, exclude_agv_id, metric='manhattan'):
+        # 空間索引由目標所在格桶向外找，不再逐台計算距離；metric='bfs' 以實際步數排序
+        return self.agv_index[floor].nearest_one(target_pos, exclude=(exclude_agv_id,), metric=metric)
+
+    def _batch_station(self, floor, agv_id, candidate_list, station_tasks, task_retry_counter):
+        # 批次派車：回傳這台 AGV 在本 epoch 計畫中的站 (None = 讓給計畫中較近的車，原地等)
+        ba = self.batch[floor]
+        state = self.agv_state[floor][agv_id]
+        valid = {st for _, st in candidate_list}
+        for st in valid:
+            if station_tasks[st][0]['shelf_id'] not in self.shelf_coords: return st # 無座標的任務直接丟棄，不進求解
+        def build():
+            tasks = []
+            for st in valid:
+                t = station_tasks[st][0]
+                tasks.append({'key': st, 'pos': self.shelf_coords[t['shelf_id']]['pos'],
+                              'deadline': (t['datetime'] - self.base_time).total_seconds() + TASK_DEADLINE_SEC,
+                              'retries': task_retry_counter[t.get('task_id')], 'agv': t.get('assigned_agv')})
+            return ba.window_agvs(self.agv_state[floor], state['time']), tasks
+        st, greedy = ba.choose(state['time'], agv_id, valid, build)
+        if greedy: st = candidate_list[0][1]
+        if st is not None:
+            ba.take(agv_id, ba.travel_cells(state['pos'], self.shelf_coords[station_tasks[st][0]['shelf_id']]['pos']))
+        return st
 
     def run(self):
         station_spots = set()
@@ -459,9 +503,12 @@ class SimulationRunner:
                         score = first_task['datetime'].timestamp() + penalty
                         candidate_list.append((score, st))
                     
+                    best_st = None
                     if candidate_list:
                         candidate_list.sort(key=lambda x: x[0])
                         best_st = candidate_list[0][1]
+                        if self.batch: best_st = self._batch_station(floor, best_agv, candidate_list, station_tasks, task_retry_counter)
+                    if best_st is not None:
                         selected_task = station_tasks[best_st][0]
                         source_queue = station_tasks[best_st]
                         
@@ -470,7 +517,7 @@ class SimulationRunner:
                             zm.reserve(best_st)
 
                 if selected_task is None: 
-                    self._lock_spot(floor, state['pos'], state['time'], 10)
+                    self._lock_spot(floor, state['pos'], state['time'], 10, best_agv)
                     state['time'] += 5
                     continue
 
@@ -486,17 +533,18 @@ class SimulationRunner:
                         state['time'] += 5; rescue_queue.append(task); continue
                     
                     self.shelf_occupancy[floor].remove(target_shelf_pos)
+                    self.agv_index[floor].set_status(best_agv, 'loaded')
                     self.event_writer.writerow([
                         self.to_dt(state['time']), self.to_dt(state['time']+1),
                         floor, f"AGV_{best_agv}", target_shelf_pos[1], target_shelf_pos[0], target_shelf_pos[1], target_shelf_pos[0],
                         'SHUFFLE_LOAD', f"{task['shelf_id']}"
                     ])
                     
-                    safe_spot = self._find_smart_storage_spot(floor, target_shelf_pos, agv_pool, avoid_pos=target_shelf_pos)
+                    safe_spot = self._find_smart_storage_spot(floor, target_shelf_pos, avoid_pos=target_shelf_pos)
                     ok_buf, _ = self._move_agv(floor, best_agv, safe_spot, True, astar)
                     
                     if not ok_buf:
-                        state['pos'] = safe_spot; state['time'] += 30
+                        self._commit_pos(floor, best_agv, safe_spot); state['time'] += 30
                         # 救援車如果也被擋，這裡還是允許瞬移，因為這是「最後手段」
                         self.event_writer.writerow([
                             self.to_dt(state['time']-30), self.to_dt(state['time']),
@@ -505,6 +553,7 @@ class SimulationRunner:
                         ])
                     
                     self.shelf_occupancy[floor].add(safe_spot)
+                    self.agv_index[floor].set_status(best_agv, 'idle')
                     self.event_writer.writerow([
                         self.to_dt(state['time']), self.to_dt(state['time']+1),
                         floor, f"AGV_{best_agv}", safe_spot[1], safe_spot[0], safe_spot[1], safe_spot[0],
@@ -545,7 +594,9 @@ class SimulationRunner:
                         continue
 
                     # 成功抵達料架
+                    if self.invariants: self.invariants.on_shelf(floor, best_agv, shelf_pos, state['time'], load=True)
                     self.shelf_occupancy[floor].remove(shelf_pos)
+                    self.agv_index[floor].set_status(best_agv, 'loaded')
                     self.event_writer.writerow([
                         self.to_dt(state['time']), self.to_dt(state['time']+1),
                         floor, f"AGV_{best_agv}", shelf_pos[1], shelf_pos[0], shelf_pos[1], shelf_pos[0],
@@ -606,7 +657,7 @@ class SimulationRunner:
                          continue 
                     else:
                         # 真的無路可走 (Deadlock or Static block)，這時候才瞬移
-                        state['pos'] = q_pos; state['time'] += 20
+                        self._commit_pos(floor, best_agv, q_pos); state['time'] += 20
                         self.event_writer.writerow([
                             self.to_dt(state['time']-20), self.to_dt(state['time']),
                             floor, f"AGV_{best_agv}", state['pos'][1], state['pos'][0], q_pos[1], q_pos[0],
@@ -619,39 +670,46 @@ class SimulationRunner:
                     next_pos, start_t, next_idx, is_proc = qm.advance_slot(target_st, best_agv, current_idx, state['time'])
                     
                     if start_t > state['time']:
-                        self._lock_spot(floor, state['pos'], state['time'], int(start_t - state['time']))
+                        self._lock_spot(floor, state['pos'], state['time'], int(start_t - state['time']), best_agv)
                         state['time'] = start_t
                     
                     move_time = 5 
-                    self._lock_spot(floor, state['pos'], state['time'], move_time) 
+                    self._lock_spot(floor, state['pos'], state['time'], move_time, best_agv)
                     state['time'] += move_time
-                    state['pos'] = next_pos
+                    self._commit_pos(floor, best_agv, next_pos)
                     
                     current_idx = next_idx
                     in_processing = is_proc
                 
                 proc_time = task['stops'][0]['time']
-                self._lock_spot(floor, state['pos'], state['time'], proc_time)
+                self._lock_spot(floor, state['pos'], state['time'], proc_time, best_agv)
                 state['time'] += proc_time
                 
                 qm.process_finished(target_st, best_agv, state['time'])
                 
-                wave_id = task.get('wave_id', 'UNK')
-                ttype = 'INBOUND' if 'RECEIVING' in wave_id else 'OUTBOUND'
-                deadline_dt = self.to_dt(0) + timedelta(hours=4)
-                self.kpi_writer.writerow([
-                    self.to_dt(state['time']), ttype, wave_id, 'N', 
-                    self.to_dt(state['time']).date(), target_st, 
-                    self.wave_totals[wave_id], int(deadline_dt.timestamp())
-                ])
+                finish_dt = self.to_dt(state['time'])
+                for ln in task.get('lines') or [None]:
+                    wave_id = ln['wave_id'] if ln else task.get('wave_id', 'UNK')
+                    ttype = 'INBOUND' if 'RECEIVING' in wave_id else 'OUTBOUND'
+                    # 每筆 line 依自己波次的 WAVE_DEADLINE 判斷延遲 (無截止時間的波次才用預設 4 小時)
+                    deadline_dt = ln.get('deadline') if ln else None
+                    if deadline_dt is None: deadline_dt = self.to_dt(0) + timedelta(hours=4)
+                    is_delayed = 'Y' if finish_dt > deadline_dt else 'N'
+                    self.kpi_writer.writerow([
+                        finish_dt, ttype, wave_id, is_delayed, 
+                        finish_dt.date(), target_st, 
+                        self.wave_totals[wave_id], int(deadline_dt.timestamp())
+                    ])
                 
                 qm.release_station(target_st, best_agv)
                 zm.exit(target_st)
 
-                drop_pos = self._find_smart_storage_spot(floor, shelf_pos, agv_pool)
+                drop_pos = self._find_smart_storage_spot(floor, shelf_pos)
                 self._move_agv(floor, best_agv, drop_pos, True, astar)
                 
+                if self.invariants: self.invariants.on_shelf(floor, best_agv, drop_pos, state['time'], load=False)
                 self.shelf_occupancy[floor].add(drop_pos)
+                self.agv_index[floor].set_status(best_agv, 'idle')
                 self.event_writer.writerow([
                     self.to_dt(state['time']), self.to_dt(state['time']+1),
                     floor, f"AGV_{best_agv}", drop_pos[1], drop_pos[0], drop_pos[1], drop_pos[0],
@@ -661,12 +719,22 @@ class SimulationRunner:
                 self.shelf_coords[shelf_id]['pos'] = drop_pos
                 
                 done_cnt += 1
-                if done_cnt % 10 == 0: print(f"✅ Done {done_cnt}/{total_tasks}")
+                if done_cnt % 10 == 0:
+                    print(f"✅ Done {done_cnt}/{total_tasks}" + (f" | 🛡️ Inv: {self.invariants.summary_line()}" if self.invariants else ""))
+                    if self.invariants: self.invariants.prune(floor, min(s['time'] for s in agv_pool.values()))
 
         self.event_writer.close()
         self.kpi_writer.close()
         self.agv_kpi_writer.close()
+        if self.heatmap:
+            print(f"🔥 交通熱區: {self.heatmap.save(LOG_DIR, self.base_time)}")
+        if self.invariants: self.invariants.print_report()
+        if self.batch:
+            for f, ba in self.batch.items(): print(f"🧮 批次派車 {f}: {ba.summary_line()}")
         print("🎉 模擬結束")
 
 if __name__ == "__main__":
-    SimulationRunner().run()
\ No newline at end of file
+    try:
+        SimulationRunner().run()
+    except InvariantViolation as e:
+        print(f"\n🛑 [Strict] 不變量違規，模擬中止: {e}")
\ No newline at end of file
@@ -1,8 +1,15 @@
 import pandas as pd
+import numpy as np
 import json
 import os
-import re
 import math
+import argparse
+
+from engine.loaders import load_shelf_cells
+from engine.event_store import load_events, write_event_store
+from engine.replay_server import serve, DEFAULT_HOST, DEFAULT_PORT
+from engine.kpi_aggregates import load_kpi, build_kpi_aggregates
+from engine.traffic_heatmap import load_heatmap, HEATMAP_FILE
 
 # ---------------- CONFIG ----------------
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -10,6 +17,13 @@ DATA_MAP_DIR = os.path.join(BASE_DIR, 'data', 'master')
 MAPPING_DIR = os.path.join(BASE_DIR, 'data', 'mapping')
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 OUTPUT_HTML = os.path.join(LOG_DIR, 'dashboard_report.html')
+# 事件 chunk 目錄 (與 HTML 同層，HTML 以相對路徑載入)
+DATA_DIR_NAME = 'dashboard_report_data'
+OUTPUT_DATA_DIR = os.path.join(LOG_DIR, DATA_DIR_NAME)
+# keyframe 間距依事件密度調整：每段約 N 筆事件，介於最短 / 最長秒數之間
+KEYFRAME_TARGET_EVENTS = 4000
+KEYFRAME_MIN_SPAN = 30
+KEYFRAME_MAX_SPAN = 900
 # ----------------------------------------
 
 def load_map_fixed(filename, rows_limit, cols_limit):
@@ -32,66 +46,8 @@ def load_map_fixed(filename, rows_limit, cols_limit):
 
 def load_shelf_map():
     path = os.path.join(MAPPING_DIR, 'shelf_coordinate_map.csv')
-    shelf_set = {'2F': set(), '3F': set()}
-    if os.path.exists(path):
-        try:
-            df = pd.read_csv(path)
-            for _, r in df.iterrows():
-                if 0 <= r['x'] < 61 and 0 <= r['y'] < 32:
-                    shelf_set[r['floor']].add((int(r['x']), int(r['y'])))
-        except: pass
-    return shelf_set
-
-def normalize_obj_id(val):
-    val = str(val).strip()
-    if val.isdigit():
-        return f"AGV_{int(val)}"
-    if val.upper().startswith('AGV'):
-        nums = re.findall(r'\d+', val)
-        if nums:
-            return f"AGV_{int(nums[0])}"
-    return val
-
-def precompute_snapshots_robust(events, initial_shelf_sets):
-    print("📸 預計算高速快照 (V52)...")
-    base_sets = {
-        '2F': {f"{x},{y}" for x,y in initial_shelf_sets['2F']},
-        '3F': {f"{x},{y}" for x,y in initial_shelf_sets['3F']}
-    }
-    curr_sets = {
-        '2F': set(base_sets['2F']),
-        '3F': set(base_sets['3F'])
-    }
-    
-    snapshots = []
-    last_snap_time = -1000
-    
-    for idx, e in enumerate(events):
-        start_ts = e[0]
-        floor = e[2]
-        type_ = e[8]
-        
-        if start_ts - last_snap_time >= 300:
-            snap = {
-                't': int(start_ts),
-                'i': idx,
-                'd': {} 
-            }
-            for f in ['2F', '3F']:
-                removed = list(base_sets[f] - curr_sets[f])
-                added = list(curr_sets[f] - base_sets[f])
-                snap['d'][f] = {'r': removed, 'a': added}
-            snapshots.append(snap)
-            last_snap_time = start_ts
-            
-        if type_ in ['SHELF_LOAD', 'SHUFFLE_LOAD']:
-            key = f"{e[4]},{e[5]}"
-            if key in curr_sets[floor]: curr_sets[floor].remove(key)
-        elif type_ in ['SHELF_UNLOAD', 'SHUFFLE_UNLOAD']:
-            key = f"{e[6]},{e[7]}" 
-            curr_sets[floor].add(key)
-            
-    return snapshots
+    try: return load_shelf_cells(path, rows_limit=32, cols_limit=61)
+    except: return {'2F': set(), '3F': set()}
 
 def main():
     print("🚀 [Step 5] 啟動視覺化 (V52: New Colors)...")
@@ -106,58 +62,43 @@ def main():
         return
 
     try:
-        df_events = pd.read_csv(events_path, on_bad_lines='skip', engine='python')
+        df_events = load_events(events_path)
     except Exception as e:
         print(f"❌ Error reading events: {e}")
         return
     
-    df_events['start_ts'] = pd.to_datetime(df_events['start_time'], errors='coerce')
-    df_events['end_ts'] = pd.to_datetime(df_events['end_time'], errors='coerce')
-    df_events = df_events.dropna(subset=['start_ts', 'end_ts'])
-    df_events = df_events[df_events['start_ts'].dt.year > 2020]
-    
     if df_events.empty: return
-
-    df_events['obj_id'] = df_events['obj_id'].apply(normalize_obj_id)
-    df_events['start_ts'] = df_events['start_ts'].astype('int64') // 10**9
-    df_events['end_ts'] = df_events['end_ts'].astype('int64') // 10**9
-    df_events = df_events.sort_values('start_ts')
-    df_events['text'] = df_events['text'].fillna('').astype(str)
     
     min_time = int(df_events['start_ts'].min())
     max_time = int(df_events['end_ts'].max())
     print(f"   📅 時間範圍: {pd.to_datetime(min_time, unit='s')} ~ {pd.to_datetime(max_time, unit='s')}")
 
-    events_data = df_events[['start_ts', 'end_ts', 'floor', 'obj_id', 'sx', 'sy', 'ex', 'ey', 'type', 'text']].values.tolist()
-    snapshots_data = precompute_snapshots_robust(events_data, shelf_data)
-
-    all_agvs = sorted(list(df_events[df_events['obj_id'].str.startswith('AGV')]['obj_id'].unique()))
-    all_stations = df_events[df_events['obj_id'].str.startswith('WS_')]['obj_id'].unique().tolist()
+    # 事件依時間切成二進位 chunk (各帶起點 keyframe)，HTML 只保留 manifest，播放時按需載入
+    manifest = write_event_store(OUTPUT_DATA_DIR, df_events, shelf_data, target_events=KEYFRAME_TARGET_EVENTS,
+                                 min_span=KEYFRAME_MIN_SPAN, max_span=KEYFRAME_MAX_SPAN)
+    print(f"   📦 事件 chunk: {len(manifest['chunks'])} 個 ({sum(c['bytes'] for c in manifest['chunks']) / 1e6:.1f} MB) -> {OUTPUT_DATA_DIR}")
+    if manifest['lod']:
+        print("   🎞️ LOD 串流: " + ", ".join(f"{l['res']}s x {l['n']} ({l['bytes'] / 1e6:.1f} MB)" for l in manifest['lod']['levels']))
     
+    # KPI 面板改用離線彙總的每分鐘陣列 (前端每格 O(1) 取值)
     kpi_path = os.path.join(LOG_DIR, 'simulation_kpi.csv')
-    kpi_raw = []
-    calc_wave_totals = {}
-    calc_recv_totals = {}
+    df_kpi = None
+    try: df_kpi = load_kpi(kpi_path)
+    except Exception as e: print(f"⚠️ 無法讀取 KPI: {e}")
+    kpi_agg = build_kpi_aggregates(df_kpi, df_events, manifest['station_ids'], min_time, max_time)
+    print(f"   📈 KPI 彙總: {kpi_agg['n']} 個時間桶, {len(kpi_agg['waves']['ids'])} 個波次")
 
-    try:
-        df_kpi = pd.read_csv(kpi_path, on_bad_lines='skip', engine='python')
-        df_kpi['finish_ts'] = pd.to_datetime(df_kpi['finish_time'], errors='coerce')
-        df_kpi = df_kpi.dropna(subset=['finish_ts'])
-        df_kpi['date'] = df_kpi['finish_ts'].dt.strftime('%Y-%m-%d')
-        df_kpi['finish_ts'] = df_kpi['finish_ts'].astype('int64') // 10**9
-        df_kpi = df_kpi.sort_values('finish_ts')
-        
-        for _, row in df_kpi.iterrows():
-            wid = str(row['wave_id'])
-            if row['type'] == 'RECEIVING':
-                d = row['date']
-                calc_recv_totals[d] = calc_recv_totals.get(d, 0) + 1
-            else:
-                val = int(row.get('total_in_wave', 0))
-                if val > calc_wave_totals.get(wid, 0):
-                    calc_wave_totals[wid] = val
-        kpi_raw = df_kpi[['finish_ts', 'type', 'wave_id', 'is_delayed', 'date', 'workstation', 'total_in_wave', 'deadline_ts']].values.tolist()
-    except: pass
+    # 模擬中累計的交通熱區 (step4 輸出)：全時段通行+等待次數，log 正規化為 0~100 的疊圖強度
+    heat_overlay = None
+    heat_path = os.path.join(LOG_DIR, HEATMAP_FILE)
+    if os.path.exists(heat_path):
+        try:
+            meta, counts = load_heatmap(heat_path)
+            tot = np.log1p((counts['visit'] + counts['wait']).sum(axis=1, dtype=np.int64))
+            peak = tot.max() or 1.0
+            heat_overlay = {f: np.rint(tot[i] * 100 / peak).astype(int).tolist() for i, f in enumerate(meta['floors'])}
+            print(f"   🔥 交通熱區疊圖: {heat_path}")
+        except Exception as e: print(f"⚠️ 無法讀取交通熱區: {e}")
 
     html_template = """
 <!DOCTYPE html>
@@ -195,6 +136,7 @@ def main():
     <div class="header">
         <h3>🏭 倉儲戰情室 (V52: New Colors)</h3>
         <div style="flex:1"></div>
+        <span id="loadStatus" style="margin-right: 10px; color: #999;"></span>
         <span id="timeDisplay" style="font-weight: bold;">--</span>
     </div>
     <div class="main">
@@ -234,7 +176,9 @@ def main():
                 </div>
                 <div class="panel">
                     <h4>📊 統計指標</h4>
-                    <div>Active AGV: <span id="val-active">0</span></div>
+                    <div>Active AGV: <span id="val-active">0</span> | Busy Station: <span id="val-st-busy">0</span></div>
+                    <div>Station Util 2F / 3F: <span id="val-st-util">-</span></div>
+                    <div>Shelves 2F / 3F: <span id="val-shelves">0 / 0</span></div>
                     <div>Done: <span id="val-done">0</span> | Delay: <span id="val-delay" style="color:red">0</span></div>
                 </div>
             </div>
@@ -249,24 +193,31 @@ def main():
                     <option value="30">30x</option>
                     <option value="60">1 min/s</option>
                     <option value="300">5 min/s</option>
+                    <option value="1800">30 min/s</option>
+                    <option value="3600">1 hr/s</option>
                 </select>
+                <label id="heatToggle" style="display:none"><input type="checkbox" onchange="showHeat=this.checked; render()"> 🔥 熱區</label>
+            </div>
+            <div class="controls" id="trailControls" style="display:none">
+                <input type="text" id="trailAgv" placeholder="AGV 軌跡 (例: AGV_17)" style="flex:1">
+                <button onclick="loadTrail()">軌跡 ±30 分</button>
+                <button onclick="trail=null; render()">清除</button>
             </div>
         </div>
     </div>
 <script>
     const map2F = __MAP2F__;
     const map3F = __MAP3F__;
-    const initialShelfData = __SHELF_DATA__; 
-    const events = __EVENTS__;
-    const snapshots = __SNAPSHOTS__;
-    const kpiRaw = __KPI_RAW__;
-    const agvIds = __AGV_IDS__;
-    const stIds = __STATION_IDS__;
-    const waveTotals = __WAVE_TOTALS__;
-    const recvTotals = __RECV_TOTALS__;
+    const manifest = __MANIFEST__;
+    const DATA_DIR = __DATA_DIR__;
+    const kpiAgg = __KPI_AGG__;
+    const heatOverlay = __HEAT__;
+    let showHeat = false;
+    const agvIds = manifest.agv_ids;
+    const stIds = manifest.station_ids;
     
-    let minTime = Number(__MIN_TIME__);
-    let maxTime = Number(__MAX_TIME__);
+    let minTime = Number(manifest.min_time);
+    let maxTime = Number(manifest.max_time);
     
     if (isNaN(minTime)) minTime = Math.floor(Date.now()/1000);
     if (isNaN(maxTime)) maxTime = minTime + 3600;
@@ -275,8 +226,8 @@ def main():
     document.getElementById('slider').max = maxTime;
     document.getElementById('slider').value = minTime;
 
-    const baseShelves = { '2F': new Set(initialShelfData['2F']), '3F': new Set(initialShelfData['3F']) };
-    let currentShelves = { '2F': new Set(baseShelves['2F']), '3F': new Set(baseShelves['3F']) };
+    // 料架位置由 keyframe 還原 (第一個 keyframe 即初始料架)
+    let currentShelves = { '2F': new Set(), '3F': new Set() };
     
     let agvState = {};
     agvIds.forEach(id => { 
@@ -322,55 +273,213 @@ def main():
         }
         return lo;
     }
-    
-    function bisectSnapshots(arr, t) {
-        let lo = 0, hi = arr.length;
+
+    // ---------- 事件 chunk / LOD 檔按需載入 ----------
+    // 只抓取游標附近的檔案，以 Map 插入順序做 LRU，快取上限 CHUNK_CACHE_MAX 個
+    // key: 'E{k}' 為事件 chunk，'L{res}_{k}' 為 LOD 檔
+    const CHUNK_CACHE_MAX = 24;
+    const chunkT0 = manifest.chunks.map(c => c.t0);
+    const dataCache = new Map();
+    const dataPending = new Set();
+    // http(s) 下直接 fetch 二進位檔；file:// 無法 fetch，改以 <script> 載入 base64 包裝檔
+    const useFetch = location.protocol.startsWith('http');
+    let pendingSeek = null;
+
+    // 每格前進 >= LOD_MIN_STEP 秒模擬時間時，改用最粗且不超過每格步長的 LOD 串流
+    const LOD_MIN_STEP = 2;
+    let lodRes = 0;        // 0 = 逐筆事件
+    let lodWaiting = false;
+    let lodShelfCount = null;
+    let lastListUpdate = 0;
+
+    function chunkIndexOf(t) {
+        let lo = 0, hi = chunkT0.length;
         while (lo < hi) {
             let mid = (lo + hi) >>> 1;
-            if (arr[mid].t <= t) lo = mid + 1;
+            if (chunkT0[mid] <= t) lo = mid + 1;
             else hi = mid;
         }
-        return lo - 1;
+        return Math.max(0, lo - 1);
+    }
+
+    function decodeChunk(buf) {
+        const dv = new DataView(buf);
+        const n = dv.getUint32(8, true);
+        const kfLen = dv.getUint32(12, true);
+        const metaLen = dv.getUint32(16, true);
+        let off = 20;
+        const takeN = (Ctor, cnt) => { const a = new Ctor(buf, off, cnt); off += Ctor.BYTES_PER_ELEMENT * cnt; return a; };
+        // keyframe: chunk 起點的完整狀態
+        const nA = agvIds.length, nS = stIds.length;
+        const kf = { stText: takeN(Uint32Array, nS), ax: takeN(Int16Array, nA), ay: takeN(Int16Array, nA),
+                     afloor: takeN(Uint8Array, nA), aflags: takeN(Uint8Array, nA), acolor: takeN(Uint8Array, nA), shelves: {} };
+        manifest.shelf_floors.forEach(f => { kf.shelves[f] = takeN(Uint8Array, SHELF_BYTES); });
+        off = 20 + kfLen;
+        const take = (Ctor) => takeN(Ctor, n);
+        const start = take(Int32Array), end = take(Int32Array), text = take(Uint32Array);
+        const obj = take(Uint16Array), sx = take(Int16Array), sy = take(Int16Array), ex = take(Int16Array), ey = take(Int16Array);
+        const floor = take(Uint8Array), type = take(Uint8Array);
+        off += (4 - off % 4) % 4;
+        const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, off, metaLen)));
+        // 還原成舊版事件陣列格式: [start, end, floor, id, sx, sy, ex, ey, type, text]
+        const base = manifest.base_time;
+        const evts = new Array(n);
+        for (let i = 0; i < n; i++) {
+            evts[i] = [base + start[i], base + end[i], manifest.floors[floor[i]], manifest.objects[obj[i]],
+                       sx[i], sy[i], ex[i], ey[i], manifest.types[type[i]], meta.t[text[i]]];
+        }
+        kf.stText = Array.from(kf.stText, i => meta.t[i]);
+        return { events: evts, kf: kf };
+    }
+
+    const SHELF_BYTES = Math.ceil(manifest.grid[0] * manifest.grid[1] / 8);
+
+    function decodeLod(buf) {
+        const dv = new DataView(buf);
+        const n = dv.getUint32(8, true), t0 = dv.getUint32(12, true), nb = dv.getUint32(16, true), metaLen = dv.getUint32(20, true);
+        let off = 24;
+        const takeN = (Ctor, cnt) => { const a = new Ctor(buf, off, cnt); off += Ctor.BYTES_PER_ELEMENT * cnt; return a; };
+        const nA = agvIds.length, nS = stIds.length, nF = manifest.shelf_floors.length;
+        const d = { n: n, t0: manifest.base_time + t0,
+                    stText: takeN(Uint32Array, n * nS), ax: takeN(Int16Array, n * nA), ay: takeN(Int16Array, n * nA),
+                    shelfCount: takeN(Uint16Array, n * nF), afloor: takeN(Uint8Array, n * nA),
+                    aflags: takeN(Uint8Array, n * nA), acolor: takeN(Uint8Array, n * nA), bitmaps: [], shelfSets: [] };
+        for (let b = 0; b < nb; b++) {
+            const fl = {};
+            manifest.shelf_floors.forEach(f => { fl[f] = takeN(Uint8Array, SHELF_BYTES); });
+            d.bitmaps.push(fl);
+        }
+        off += (4 - off % 4) % 4;
+        d.texts = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, off, metaLen))).t;
+        return d;
+    }
+
+    function storeData(key, buf) {
+        dataPending.delete(key);
+        dataCache.set(key, key[0] === 'L' ? decodeLod(buf) : decodeChunk(buf));
+        while (dataCache.size > CHUNK_CACHE_MAX) dataCache.delete(dataCache.keys().next().value);
+        onChunkReady();
+    }
+
+    function base64ToBuffer(b64) {
+        const bin = atob(b64);
+        const u8 = new Uint8Array(bin.length);
+        for (let i = 0; i < bin.length; i++) u8[i] = bin.charCodeAt(i);
+        return u8.buffer;
+    }
+    window.__onEventChunk = (k, b64) => storeData('E' + k, base64ToBuffer(b64));
+    window.__onLodChunk = (res, k, b64) => storeData('L' + res + '_' + k, base64ToBuffer(b64));
+
+    function loadData(key, file) {
+        if (dataCache.has(key) || dataPending.has(key)) return;
+        dataPending.add(key);
+        file = DATA_DIR + file;
+        if (useFetch) {
+            fetch(file + '.bin').then(r => r.arrayBuffer()).then(buf => storeData(key, buf))
+                .catch(err => { dataPending.delete(key); console.error('chunk load failed', key, err); });
+        } else {
+            const el = document.createElement('script');
+            el.src = file + '.js';
+            el.onload = () => el.remove();
+            el.onerror = () => { dataPending.delete(key); el.remove(); console.error('chunk load failed', key); };
+            document.head.appendChild(el);
+        }
+    }
+
+    function getData(key, file) {
+        const d = dataCache.get(key);
+        if (!d) { loadData(key, file); return null; }
+        dataCache.delete(key); dataCache.set(key, d); // LRU touch
+        return d;
+    }
+
+    function requestChunk(k) {
+        if (k >= 0 && k < manifest.chunks.length) loadData('E' + k, manifest.chunks[k].file);
+    }
+
+    function getChunk(k) {
+        return (k >= 0 && k < manifest.chunks.length) ? getData('E' + k, manifest.chunks[k].file) : null;
+    }
+
+    function lodFile(res, k) { return 'lod' + res + '_' + String(k).padStart(5, '0'); }
+
+    function prefetchAround(t) {
+        const k = chunkIndexOf(t);
+        for (let d = -1; d <= 2; d++) requestChunk(k + d);
+    }
+
+    function setLoading(on) {
+        document.getElementById('loadStatus').innerText = on ? '⏳ 載入中...' : '';
+    }
+
+    function onChunkReady() {
+        if (pendingSeek !== null && dataCache.has('E' + chunkIndexOf(pendingSeek))) onSeek(pendingSeek);
     }
 
     let currTime = minTime;
-    let lastProcessedIdx = 0;
+    let cursor = { k: 0, i: 0 };  // 下一筆待處理事件 (chunk 索引, chunk 內索引)
     let isPlaying = false;
     let isSeeking = false;
 
-    function restoreSnapshot(snapIdx) {
-        const snap = snapshots[snapIdx];
-        if (!snap) return 0;
-        ['2F', '3F'].forEach(f => {
-            currentShelves[f] = new Set(baseShelves[f]); 
-            snap.d[f].r.forEach(k => currentShelves[f].delete(k));
-            snap.d[f].a.forEach(k => currentShelves[f].add(k));
+    function applyStationText(sid, text) {
+        if (!stState[sid]) return;
+        if (!text) { stState[sid].color = 'WHITE'; stState[sid].wave = '--'; stState[sid].type = 'IDLE'; return; }
+        const parts = text.split('|');
+        stState[sid].color = parts[0];
+        if (parts.length > 2) {
+            stState[sid].wave = parts[1]; // Type|WaveID
+            stState[sid].type = parts[2]; // Processing
+        } else {
+            stState[sid].wave = '--';
+            stState[sid].type = parts[1] || 'Busy';
+        }
+    }
+
+    function bitmapToSet(bits) {
+        const cols = manifest.grid[1];
+        const set = new Set();
+        for (let b = 0; b < bits.length; b++) {
+            if (!bits[b]) continue;
+            for (let j = 0; j < 8; j++) {
+                if (bits[b] & (1 << j)) { const cell = b * 8 + j; set.add((cell % cols) + "," + Math.floor(cell / cols)); }
+            }
+        }
+        return set;
+    }
+
+    function restoreKeyframe(kf) {
+        manifest.shelf_floors.forEach(f => { currentShelves[f] = bitmapToSet(kf.shelves[f]); });
+        agvIds.forEach((id, i) => {
+            const s = agvState[id], flags = kf.aflags[i];
+            s.floor = manifest.floors[kf.afloor[i]]; s.x = kf.ax[i]; s.y = kf.ay[i];
+            s.visible = (flags & 1) !== 0; s.loaded = (flags & 2) !== 0; s.rescue = (flags & 4) !== 0;
+            s.color = manifest.agv_colors[kf.acolor[i]];
         });
-        agvIds.forEach(id => { agvState[id].visible = false; });
-        return snap.i; 
+        stIds.forEach((sid, i) => applyStationText(sid, kf.stText[i]));
     }
 
     function onSeek(val) {
         const targetTime = Number(val);
         currTime = targetTime;
-        const snapIdx = bisectSnapshots(snapshots, targetTime);
-        let startIdx = 0;
-        if (snapIdx >= 0) startIdx = restoreSnapshot(snapIdx);
-        else {
-            ['2F', '3F'].forEach(f => currentShelves[f] = new Set(baseShelves[f]));
-            startIdx = 0;
-        }
-        fastProcess(startIdx, targetTime);
-        lastProcessedIdx = bisectRight(events, targetTime);
+        if (lodRes) { pendingSeek = null; render(); return; }
+        const k = chunkIndexOf(targetTime);
+        prefetchAround(targetTime);
+        const ch = getChunk(k);
+        if (!ch) { pendingSeek = targetTime; setLoading(true); return; }
+        pendingSeek = null; setLoading(false);
+        restoreKeyframe(ch.kf);
+        cursor = { k: k, i: fastProcess(ch.events, targetTime) };
         render();
     }
 
-    function fastProcess(startIdx, targetTime) {
-        for(let i = startIdx; i < events.length; i++) {
-            const e = events[i];
+    function fastProcess(evts, targetTime) {
+        let i = 0;
+        for(; i < evts.length; i++) {
+            const e = evts[i];
             if (e[0] > targetTime) break; 
             processEventLogic(e, targetTime, false);
         }
+        return i;
     }
 
     function processEventLogic(e, time, isRealtime) {
@@ -425,32 +534,129 @@ def main():
         
         if (type === 'STATION_STATUS') {
             if (time >= startT && time < endT) {
-                const sid = e[3];
-                if (stState[sid]) {
-                    const parts = e[9].split('|');
-                    stState[sid].color = parts[0];
-                    if (parts.length > 2) {
-                        stState[sid].wave = parts[1]; // Type|WaveID
-                        stState[sid].type = parts[2]; // Processing
-                    } else {
-                        stState[sid].wave = '--';
-                        stState[sid].type = parts[1] || 'Busy';
-                    }
-                }
+                applyStationText(e[3], e[9]);
             }
         }
     }
 
     function updateStateRealtime(time) {
-        const endIdx = bisectRight(events, time);
-        if (Math.abs(endIdx - lastProcessedIdx) > 500) { onSeek(time); return; }
-        for(let i = lastProcessedIdx; i < endIdx; i++) processEventLogic(events[i], time, true);
-        const scanStart = Math.max(0, endIdx - 50);
-        for(let i = scanStart; i < endIdx; i++) {
-            const e = events[i];
-            if (e[1] > time) processEventLogic(e, time, true);
+        if (pendingSeek !== null) return;
+        const k = chunkIndexOf(time);
+        if (k < cursor.k || k > cursor.k + 1) { onSeek(time); return; }
+        const cur = getChunk(cursor.k);
+        const nxt = k > cursor.k ? getChunk(k) : cur;
+        if (!cur || !nxt) { pendingSeek = time; setLoading(true); return; }
+
+        const endIdx = bisectRight(nxt.events, time);
+        const todo = k > cursor.k ? (cur.events.length - cursor.i) + endIdx : endIdx - cursor.i;
+        if (Math.abs(todo) > 500) { onSeek(time); return; }
+        if (k > cursor.k) {
+            for(let i = cursor.i; i < cur.events.length; i++) processEventLogic(cur.events[i], time, true);
+            cursor = { k: k, i: 0 };
+        }
+        for(let i = cursor.i; i < endIdx; i++) processEventLogic(nxt.events[i], time, true);
+
+        // 最近 50 筆中仍在進行的事件重新內插位置 (可能跨到前一個 chunk)
+        const tail = [];
+        let need = 50;
+        for (let kk = k; kk >= 0 && need > 0; kk--) {
+            const c = kk === k ? nxt : dataCache.get('E' + kk);
+            if (!c) break;
+            const hi = kk === k ? endIdx : c.events.length;
+            const lo = Math.max(0, hi - need);
+            for (let i = hi - 1; i >= lo; i--) tail.push(c.events[i]);
+            need -= hi - lo;
+        }
+        for (let j = tail.length - 1; j >= 0; j--) {
+            if (tail[j][1] > time) processEventLogic(tail[j], time, true);
+        }
+        cursor.i = endIdx;
+        prefetchAround(time);
+    }
+
+    // ---------- LOD 播放 ----------
+    function lodResFor(speed) {
+        if (!manifest.lod) return 0;
+        const step = speed / 30;
+        if (step < LOD_MIN_STEP) return 0;
+        let best = 0;
+        manifest.lod.levels.forEach(l => { if (l.res <= step && l.res > best) best = l.res; });
+        return best;
+    }
+
+    function setPlaybackMode(res) {
+        if (res === lodRes) return;
+        const prev = lodRes;
+        lodRes = res;
+        lodShelfCount = null;
+        lodWaiting = false;
+        // 回到逐筆模式時由 keyframe 重建精確狀態
+        if (!res && prev) onSeek(currTime);
+    }
+
+    function applyLod(time) {
+        const level = manifest.lod.levels.find(l => l.res === lodRes);
+        const spf = manifest.lod.samples_per_file;
+        const j = Math.min(level.n - 1, Math.max(0, Math.floor((time - minTime) / lodRes)));
+        const k = Math.floor(j / spf);
+        const d = getData('L' + lodRes + '_' + k, lodFile(lodRes, k));
+        lodWaiting = !d; setLoading(!d);
+        if (!d) return;
+        if (k + 1 < level.files) loadData('L' + lodRes + '_' + (k + 1), lodFile(lodRes, k + 1));
+
+        const i = j - k * spf;
+        const nA = agvIds.length, nS = stIds.length, nF = manifest.shelf_floors.length;
+        agvIds.forEach((id, a) => {
+            const s = agvState[id], p = i * nA + a, flags = d.aflags[p];
+            s.floor = manifest.floors[d.afloor[p]]; s.x = d.ax[p]; s.y = d.ay[p];
+            s.visible = (flags & 1) !== 0; s.loaded = (flags & 2) !== 0; s.rescue = (flags & 4) !== 0;
+            s.color = manifest.agv_colors[d.acolor[p]];
+        });
+        stIds.forEach((sid, s) => applyStationText(sid, d.texts[d.stText[i * nS + s]]));
+        // 料架位元圖每 bitmap_stride 秒一份，解碼後留在檔案物件上重複使用
+        const b = Math.floor(i * lodRes / manifest.lod.bitmap_stride);
+        if (!d.shelfSets[b]) {
+            d.shelfSets[b] = {};
+            manifest.shelf_floors.forEach(f => { d.shelfSets[b][f] = bitmapToSet(d.bitmaps[b][f]); });
         }
-        lastProcessedIdx = endIdx;
+        manifest.shelf_floors.forEach(f => { currentShelves[f] = d.shelfSets[b][f]; });
+        lodShelfCount = manifest.shelf_floors.map((f, fi) => d.shelfCount[i * nF + fi]);
+    }
+
+    // ---------- 伺服器查詢 (--serve 模式) ----------
+    // AGV 軌跡向伺服器查詢，只取游標前後 30 分鐘，不需在瀏覽器端掃描事件
+    let trail = null;
+    if (useFetch) document.getElementById('trailControls').style.display = 'flex';
+    if (heatOverlay) document.getElementById('heatToggle').style.display = 'inline';
+
+    function loadTrail() {
+        const agv = document.getElementById('trailAgv').value.trim();
+        if (!agv) { trail = null; render(); return; }
+        const t = Math.floor(currTime);
+        fetch(`api/trajectory?agv=${encodeURIComponent(agv)}&t0=${t - 1800}&t1=${t + 1800}`)
+            .then(r => r.json())
+            .then(d => {
+                if (d.error) { alert(d.error); return; }
+                const c = {}; d.columns.forEach((name, i) => c[name] = i);
+                trail = { agv: d.agv, rows: d.rows.map(r => [r[c.floor], r[c.sx], r[c.sy], r[c.ex], r[c.ey]]) };
+                render();
+            })
+            .catch(err => console.error('trajectory failed', err));
+    }
+
+    function drawTrail() {
+        if (!trail) return;
+        [['2F', f2], ['3F', f3]].forEach(([floorName, obj]) => {
+            const ctx = obj.ctx, sz = obj.size;
+            ctx.strokeStyle = 'rgba(255,87,34,0.7)'; ctx.lineWidth = 2;
+            ctx.beginPath();
+            trail.rows.forEach(r => {
+                if (r[0] !== floorName || r[1] < 0 || r[3] < 0) return;
+                ctx.moveTo(obj.ox + r[1] * sz + sz/2, obj.oy + r[2] * sz + sz/2);
+                ctx.lineTo(obj.ox + r[3] * sz + sz/2, obj.oy + r[4] * sz + sz/2);
+            });
+            ctx.stroke();
+        });
     }
 
     function drawMap(obj, floorName) {
@@ -467,6 +673,8 @@ def main():
                 else if (val === 2) { ctx.strokeStyle = '#bbb'; ctx.strokeRect(x,y,s,s); }
                 else { 
                     ctx.fillStyle = 'white'; ctx.fillRect(x,y,s,s); 
+                    const heat = showHeat && heatOverlay && heatOverlay[floorName] ? heatOverlay[floorName][r][c] : 0;
+                    if (heat > 0) { ctx.fillStyle = `rgba(255,60,0,${heat / 160})`; ctx.fillRect(x,y,s,s); }
                     const key = c + "," + r;
                     if (currentShelves[floorName].has(key)) {
                         ctx.fillStyle = '#8d6e63';
@@ -488,14 +696,14 @@ def main():
     }
 
     function render() {
-        if (!isSeeking) updateStateRealtime(currTime);
+        if (lodRes) applyLod(currTime);
+        else if (!isSeeking) updateStateRealtime(currTime);
         drawMap(f2, '2F');
         drawMap(f3, '3F');
-        let activeCount = 0;
+        drawTrail();
         Object.keys(agvState).forEach(id => {
             const s = agvState[id];
             if (!s.visible) return;
-            activeCount++;
             const obj = s.floor == '2F' ? f2 : f3;
             if(!obj.map) return;
             const sz = obj.size;
@@ -517,43 +725,56 @@ def main():
                 obj.ctx.fillText(label, px, py+3);
             }
         });
-        document.getElementById('val-active').innerText = activeCount;
+        document.getElementById('val-st-busy').innerText = Object.values(stState).filter(s => s.color !== 'WHITE').length;
+        const shelfCnt = lodShelfCount || manifest.shelf_floors.map(f => currentShelves[f].size);
+        document.getElementById('val-shelves').innerText = shelfCnt.join(' / ');
         const dObj = new Date(currTime*1000);
         document.getElementById('timeDisplay').innerText = dObj.toLocaleString();
         if (!isSeeking) document.getElementById('slider').value = currTime;
-        if (Math.floor(currTime) % 2 === 0) updateDashboardLists(dObj);
+        // 清單更新以實際時間節流 (高倍速時每格跨越數十秒，不能再用模擬秒數奇偶判斷)
+        const now = performance.now();
+        if (now - lastListUpdate > 250) { lastListUpdate = now; updateDashboardLists(dObj); }
+    }
+
+    function kpiBucket(t) {
+        return Math.min(kpiAgg.n - 1, Math.max(0, Math.floor((t - kpiAgg.t0) / kpiAgg.step)));
+    }
+
+    function waveDone(w, m) {
+        const cum = kpiAgg.waves.cum[w], i = m - kpiAgg.waves.m0[w];
+        if (i < 0) return 0;
+        return cum[Math.min(i, cum.length - 1)];
     }
 
     function updateDashboardLists(dObj) {
-        const kIdx = bisectRight(kpiRaw, currTime);
-        const doneSlice = kpiRaw.slice(0, kIdx);
-        document.getElementById('val-done').innerText = doneSlice.length;
-        let delayed = 0;
-        let waveProg = {};
-        let recvProg = {};
-        doneSlice.forEach(k => {
-            if (k[3] === 'Y') delayed++;
-            if (k[1] === 'RECEIVING') recvProg[k[4]] = (recvProg[k[4]]||0) + 1;
-            else waveProg[k[2]] = (waveProg[k[2]]||0) + 1;
-        });
-        document.getElementById('val-delay').innerText = delayed;
+        const m = kpiBucket(currTime);
+        document.getElementById('val-done').innerText = kpiAgg.done[m];
+        document.getElementById('val-delay').innerText = kpiAgg.delayed[m];
+        document.getElementById('val-active').innerText = kpiAgg.active_agv[m];
+        document.getElementById('val-st-util').innerText = ['2F', '3F'].map(f => kpiAgg.floor_busy[f] ? kpiAgg.floor_busy[f][m] + '%' : '-').join(' / ');
 
         let wHtml = '';
-        const activeWaves = Object.keys(waveTotals).sort(); 
-        activeWaves.forEach(wid => {
-            const total = waveTotals[wid];
-            const done = waveProg[wid] || 0;
-            if (done < total || (done >= total && Math.random() > 0.9)) { 
-                const pct = total > 0 ? Math.min(100, (done/total*100)).toFixed(0) : 0;
-                wHtml += `<div class="wave-item"><div style="display:flex;justify-content:space-between"><span>${wid}</span><span>${done}/${total}</span></div><div class="progress-bg"><div class="progress-fill" style="width:${pct}%;background:#007bff"></div></div></div>`;
-            }
-        });
+        const aw = kpiAgg.active_waves;
+        for (let j = aw.off[m]; j < aw.off[m + 1]; j++) {
+            const w = aw.ids[j];
+            const wid = kpiAgg.waves.ids[w], total = kpiAgg.waves.total[w];
+            const done = waveDone(w, m);
+            const pct = total > 0 ? Math.min(100, (done/total*100)).toFixed(0) : 0;
+            wHtml += `<div class="wave-item"><div style="display:flex;justify-content:space-between"><span>${wid}</span><span>${done}/${total}</span></div><div class="progress-bg"><div class="progress-fill" style="width:${pct}%;background:#007bff"></div></div></div>`;
+        }
         document.getElementById('wave-list').innerHTML = wHtml || '<div style="color:#999;padding:5px">No Active Waves</div>';
+
+        const rDone = kpiAgg.recv_today[m], rTotal = kpiAgg.recv_day_total[m];
+        const rPct = rTotal > 0 ? Math.min(100, (rDone/rTotal*100)).toFixed(0) : 0;
+        document.getElementById('recv-list').innerHTML = rTotal > 0
+            ? `<div class="wave-item"><div style="display:flex;justify-content:space-between"><span>${dObj.toLocaleDateString()}</span><span>${rDone}/${rTotal}</span></div><div class="progress-bg"><div class="progress-fill" style="width:${rPct}%;background:#28a745"></div></div></div>`
+            : '<div style="color:#999;padding:5px">No Receiving</div>';
         
         let h2 = '', h3 = '';
-        Object.keys(stState).forEach(sid => {
+        stIds.forEach((sid, i) => {
             const s = stState[sid];
-            const card = `<div class="station-card"><div style="font-weight:bold">${s.label}</div><div class="st-wave">${s.wave}</div><div style="margin-top:2px"><span class="status-dot" style="background:${s.color === 'WHITE' ? '#ddd' : s.color === 'BLUE' ? '#007bff' : '#28a745'}"></span>${s.type}</div></div>`;
+            const busy = kpiAgg.station_busy[i] ? kpiAgg.station_busy[i][m] : 0;
+            const card = `<div class="station-card"><div style="font-weight:bold">${s.label}</div><div class="st-wave">${s.wave}</div><div style="margin-top:2px"><span class="status-dot" style="background:${s.color === 'WHITE' ? '#ddd' : s.color === 'BLUE' ? '#007bff' : '#28a745'}"></span>${s.type} ${busy}%</div></div>`;
             if (s.floor === '2F') h2 += card; else h3 += card;
         });
         document.getElementById('st-list-2f').innerHTML = h2;
@@ -561,9 +782,10 @@ def main():
     }
 
     function animate() {
-        if(isPlaying && !isSeeking) {
+        if(isPlaying && !isSeeking && pendingSeek === null) {
             const speed = parseInt(document.getElementById('speed').value);
-            currTime += (1/30) * speed; 
+            setPlaybackMode(lodResFor(speed));
+            if (!lodWaiting) currTime += (1/30) * speed; 
             if(currTime > maxTime) { isPlaying=false; currTime=minTime; onSeek(minTime); }
             render();
         }
@@ -581,25 +803,24 @@ def main():
 </html>
 """
     
-    js_shelf_data = {'2F': [], '3F': []}
-    for f in shelf_data: js_shelf_data[f] = [f"{c[0]},{c[1]}" for c in shelf_data[f]]
-
     final_html = html_template.replace('__MAP2F__', json.dumps(map_2f)) \
                               .replace('__MAP3F__', json.dumps(map_3f)) \
-                              .replace('__SHELF_DATA__', json.dumps(js_shelf_data)) \
-                              .replace('__EVENTS__', json.dumps(events_data)) \
-                              .replace('__SNAPSHOTS__', json.dumps(snapshots_data)) \
-                              .replace('__KPI_RAW__', json.dumps(kpi_raw)) \
-                              .replace('__AGV_IDS__', json.dumps(all_agvs)) \
-                              .replace('__STATION_IDS__', json.dumps(all_stations)) \
-                              .replace('__MIN_TIME__', str(min_time)) \
-                              .replace('__MAX_TIME__', str(max_time)) \
-                              .replace('__WAVE_TOTALS__', json.dumps(calc_wave_totals)) \
-                              .replace('__RECV_TOTALS__', json.dumps(calc_recv_totals))
+                              .replace('__MANIFEST__', json.dumps(manifest)) \
+                              .replace('__DATA_DIR__', json.dumps(DATA_DIR_NAME + '/')) \
+                              .replace('__KPI_AGG__', json.dumps(kpi_agg, separators=(',', ':'))) \
+                              .replace('__HEAT__', json.dumps(heat_overlay, separators=(',', ':')))
 
     with open(OUTPUT_HTML, 'w', encoding='utf-8') as f:
         f.write(final_html)
     print(f"✅ 視覺化生成完畢: {OUTPUT_HTML} (V52: New Colors)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="倉儲模擬視覺化")
+    parser.add_argument('--serve', action='store_true', help="產生報表後啟動本機回放伺服器 (dashboard 改由伺服器按需提供資料)")
+    parser.add_argument('--no-build', action='store_true', help="不重新產生報表，直接以既有的 event store 啟動伺服器")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if not args.no_build: main()
+    if args.serve: serve(OUTPUT_DATA_DIR, OUTPUT_HTML, args.host, args.port)
\ No newline at end of file
@@ -5,6 +5,9 @@ import heapq
 import csv
 from datetime import datetime, timedelta
 
+from engine import ingest
+from engine.loaders import load_shelf_coords
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 DATA_MAP_DIR = os.path.join(BASE_DIR, 'data', 'master')
@@ -131,9 +134,7 @@ class PhysicsSim:
 
     def _load_shelf_map(self):
         p = os.path.join(BASE_DIR, 'data', 'mapping', 'shelf_coordinate_map.csv')
-        try: 
-            df = pd.read_csv(p)
-            return {str(r['shelf_id']): {'floor': r['floor'], 'pos': (int(r['y']), int(r['x']))} for _, r in df.iterrows()}
+        try: return load_shelf_coords(p, pos_order='rc', keep='last')
         except: return {}
 
     def _spawn_agvs(self, grid, floor, start, count):
@@ -151,21 +152,11 @@ class PhysicsSim:
     def _load_orders(self):
         p = os.path.join(DATA_TRX_DIR, 'wave_orders.csv')
         try:
-            try: df = pd.read_csv(p, encoding='utf-8-sig')
-            except: df = pd.read_csv(p, encoding='cp950')
-            
-            # [關鍵修正] 強制重新構建 datetime 並排序
-            # 有時候 CSV 存檔後順序會亂，或者格式被誤判
-            if 'DATE' in df.columns and 'TIME' in df.columns:
-                df['datetime'] = pd.to_datetime(df['DATE'].astype(str) + ' ' + df['TIME'].astype(str))
-            else:
-                df['datetime'] = pd.to_datetime(df['datetime'])
+            # datetime / WAVE_DEADLINE 已由 ingest schema 解析 (datetime 即 DATE + TIME)
+            df = ingest.load_table('wave_orders', p)
             
             # 這裡進行嚴格排序！
-            df = df.sort_values('datetime', ascending=True).reset_index(drop=True)
-            
-            if 'WAVE_DEADLINE' in df.columns:
-                df['WAVE_DEADLINE'] = pd.to_datetime(df['WAVE_DEADLINE'], errors='coerce')
+            df = df.sort_values('datetime', ascending=True, kind='stable').reset_index(drop=True)
                 
             print(f"📦 訂單載入完成: {len(df)} 筆")
             print(f"   📅 時間範圍: {df['datetime'].min()} ~ {df['datetime'].max()}")